@@ -0,0 +1,111 @@
+"""Headless batch analysis of PGN or FEN files, one JSON line per game or position.
+
+    python analyse.py games.pgn --output results.jsonl
+    python analyse.py positions.fen --eval-time 0.5
+
+Files are read as a stream, so memory use does not grow with the file size.
+"""
+import argparse
+import json
+import sys
+
+from chess_engine import START_FEN, make_board
+from pgn import find_move, read_games
+from search import Searcher
+
+
+def game_status(board):
+    if board.checkmate:
+        return 'checkmate'
+    if board.stale_mate:
+        return 'stalemate'
+    return 'ongoing'
+
+
+def analyse_game(game, backend='bitboard', searcher=None, eval_time=0):
+    """Replay a PgnGame, checking every move against get_valid_moves."""
+    result = {'white': game.headers.get('White', '?'), 'black': game.headers.get('Black', '?'),
+              'result': game.result, 'legal': True, 'plies': 0}
+    try:
+        board = make_board(game.headers.get('FEN', START_FEN), backend)
+    except (ValueError, KeyError, IndexError):
+        return dict(result, legal=False, error='bad FEN header')
+    moves = board.get_valid_moves()
+    for san in game.moves:
+        move = find_move(san, moves)
+        # A king can only be taken if the position was illegal from the start; neither backend plays on without it.
+        if move is None or move.piece_captured[1] == 'K':
+            result['legal'] = False
+            result['error'] = 'illegal or unsupported move {} at ply {}'.format(san, result['plies'] + 1)
+            break
+        board.move(move)
+        result['plies'] += 1
+        moves = board.get_valid_moves()
+    result['status'] = game_status(board)
+    result['fen'] = board.get_fen()
+    if searcher is not None:
+        result['eval'] = evaluate_position(board, searcher, eval_time)
+    return result
+
+
+def analyse_fen(fen, backend='bitboard', searcher=None, eval_time=0):
+    try:
+        board = make_board(fen, backend)
+    except (ValueError, KeyError, IndexError):
+        return {'fen': fen, 'legal': False, 'error': 'bad FEN'}
+    result = {'fen': board.get_fen(), 'legal': True, 'moves': len(board.get_valid_moves()),
+              'status': game_status(board)}
+    if searcher is not None:
+        result['eval'] = evaluate_position(board, searcher, eval_time)
+    return result
+
+
+def evaluate_position(board, searcher, eval_time):
+    """Search score in centipawns from white's point of view, with the best move."""
+    search = searcher.search(board, eval_time)
+    score = search.score if board.white_to_move else -search.score
+    return {'score': score, 'depth': search.depth,
+            'best': search.best_move.get_chess_notation() if search.best_move else None}
+
+
+def read_fens(lines):
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def detect_format(path):
+    return 'fen' if path.lower().endswith(('.fen', '.epd')) else 'pgn'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Validate and analyse every game in a PGN or FEN file.')
+    parser.add_argument('path', help="PGN or FEN file, '-' for standard input")
+    parser.add_argument('--format', choices=['pgn', 'fen'], help='default: from the file extension')
+    parser.add_argument('--backend', choices=['bitboard', 'field'], default='bitboard')
+    parser.add_argument('--eval-time', type=float, default=0, help='seconds of search per final position, 0 = off')
+    parser.add_argument('--output', help='write JSON lines here instead of standard output')
+    args = parser.parse_args(argv)
+
+    file_format = args.format or detect_format(args.path)
+    searcher = Searcher() if args.eval_time > 0 else None
+    source = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8', errors='replace')
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        if file_format == 'pgn':
+            results = (analyse_game(game, args.backend, searcher, args.eval_time) for game in read_games(source))
+        else:
+            results = (analyse_fen(fen, args.backend, searcher, args.eval_time) for fen in read_fens(source))
+        for number, result in enumerate(results, 1):
+            result['game'] = number
+            output.write(json.dumps(result) + '\n')
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Piece sets: a registry of image folders and an LRU cache of piece images scaled to a tile size.
+
+Scaled sets can be written to disk as raw RGBA atlases, so a cold start reads one file instead of
+decoding and smoothscaling twelve PNGs.
+
+    python assets.py --bench --tile-size 64
+"""
+import argparse
+import os
+import time
+from collections import OrderedDict
+
+import pygame
+
+PIECES = ['wP', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK']
+DEFAULT_SET = 'classic'
+# Piece images are kept in memory at this size and scaled down from there for every tile size.
+MASTER_SIZE = 256
+PIECE_SETS = OrderedDict([
+    ('classic', 'data'),
+    ('brawl', 'brawl pieces'),
+    ('medieval', 'mediaval pieces'),
+])
+
+
+def register_piece_set(name, directory):
+    PIECE_SETS[name] = directory
+
+
+def find_piece_file(directory, piece):
+    """Path of the image for `piece`, matching the file name case-insensitively (wp.png, wP.png)."""
+    wanted = piece.lower() + '.png'
+    for name in os.listdir(directory):
+        if name.lower() == wanted:
+            return os.path.join(directory, name)
+    return None
+
+
+def piece_files(set_name):
+    """Image path for every piece; pieces missing from a set come from the default set."""
+    files = {}
+    for piece in PIECES:
+        path = find_piece_file(PIECE_SETS[set_name], piece)
+        if path is None:
+            path = find_piece_file(PIECE_SETS[DEFAULT_SET], piece)
+        if path is None:
+            raise FileNotFoundError('no image for {} in piece set {}'.format(piece, set_name))
+        files[piece] = path
+    return files
+
+
+class PieceSetCache:
+    """Scaled piece images keyed by (set name, tile size), keeping the `size` most recently used sets.
+
+    With `atlas_dir` set, scaled sets are also saved there and reused by later runs while they are
+    newer than their source images. The images of the recently used sets are also kept at MASTER_SIZE,
+    so a new tile size (a window being resized) is a quick downscale instead of decoding the PNGs again.
+    """
+
+    def __init__(self, size=4, atlas_dir=None):
+        self.size = size
+        self.atlas_dir = atlas_dir
+        self.sets = OrderedDict()
+        self.masters = OrderedDict()
+        self.last_load = None
+
+    def get(self, set_name, tile_size, persist=True):
+        """The set scaled to tile_size; `persist=False` skips writing an atlas, e.g. for passing window sizes."""
+        key = (set_name, tile_size)
+        if key in self.sets:
+            self.sets.move_to_end(key)
+            self.last_load = ('cache', 0.0)
+            return self.sets[key]
+        start = time.perf_counter()
+        images, source = self.load_atlas(set_name, tile_size), 'atlas'
+        if images is None:
+            source = 'master' if set_name in self.masters else 'png'
+            images = self.load_images(set_name, tile_size)
+            if persist:
+                self.save_atlas(set_name, tile_size, images)
+        if pygame.display.get_surface() is not None:
+            images = {piece: image.convert_alpha() for piece, image in images.items()}
+        self.sets[key] = images
+        if len(self.sets) > self.size:
+            self.sets.popitem(last=False)
+        self.last_load = (source, time.perf_counter() - start)
+        return images
+
+    def clear(self):
+        self.sets.clear()
+        self.masters.clear()
+
+    def load_images(self, set_name, tile_size):
+        if tile_size > MASTER_SIZE:
+            return {piece: pygame.transform.smoothscale(pygame.image.load(path), (tile_size, tile_size))
+                    for piece, path in piece_files(set_name).items()}
+        if set_name not in self.masters:
+            self.masters[set_name] = {piece: pygame.transform.smoothscale(pygame.image.load(path),
+                                                                          (MASTER_SIZE, MASTER_SIZE))
+                                      for piece, path in piece_files(set_name).items()}
+            if len(self.masters) > self.size:
+                self.masters.popitem(last=False)
+        self.masters.move_to_end(set_name)
+        return {piece: pygame.transform.smoothscale(image, (tile_size, tile_size))
+                for piece, image in self.masters[set_name].items()}
+
+    def atlas_path(self, set_name, tile_size):
+        return os.path.join(self.atlas_dir, '{}-{}.rgba'.format(set_name, tile_size))
+
+    def load_atlas(self, set_name, tile_size):
+        if not self.atlas_dir:
+            return None
+        path = self.atlas_path(set_name, tile_size)
+        try:
+            if os.path.getmtime(path) < max(os.path.getmtime(source) for source in piece_files(set_name).values()):
+                return None
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+        if len(data) != len(PIECES) * tile_size * tile_size * 4:
+            return None
+        atlas = pygame.image.fromstring(data, (tile_size * len(PIECES), tile_size), 'RGBA')
+        return {piece: atlas.subsurface((i * tile_size, 0, tile_size, tile_size)).copy()
+                for i, piece in enumerate(PIECES)}
+
+    def save_atlas(self, set_name, tile_size, images):
+        if not self.atlas_dir:
+            return
+        atlas = pygame.Surface((tile_size * len(PIECES), tile_size), pygame.SRCALPHA)
+        for i, piece in enumerate(PIECES):
+            atlas.blit(images[piece], (i * tile_size, 0))
+        try:
+            os.makedirs(self.atlas_dir, exist_ok=True)
+            path = self.atlas_path(set_name, tile_size)
+            with open(path + '.tmp', 'wb') as file:
+                file.write(pygame.image.tostring(atlas, 'RGBA'))
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+
+def benchmark(tile_size, atlas_dir, repeat):
+    def timed(cache, set_name):
+        start = time.perf_counter()
+        cache.get(set_name, tile_size)
+        return (time.perf_counter() - start) * 1000
+
+    for set_name in PIECE_SETS:
+        png = min(timed(PieceSetCache(), set_name) for _ in range(repeat))
+        cache = PieceSetCache(atlas_dir=atlas_dir)
+        cache.get(set_name, tile_size)
+        atlas = min(timed(PieceSetCache(atlas_dir=atlas_dir), set_name) for _ in range(repeat))
+        cached = min(timed(cache, set_name) for _ in range(repeat))
+        resized = []
+        for size in range(tile_size + 1, tile_size + 1 + repeat):
+            start = time.perf_counter()
+            cache.get(set_name, size, persist=False)
+            resized.append((time.perf_counter() - start) * 1000)
+        print('{:10} tile {}: png + smoothscale {:7.2f} ms  atlas {:6.2f} ms  cached {:6.3f} ms  '
+              'new tile size {:6.2f} ms, then {:5.2f} ms'.format(set_name, tile_size, png, atlas, cached, resized[0],
+                                                                   min(resized[1:] or resized)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Piece set loading benchmark.')
+    parser.add_argument('--bench', action='store_true', help='time loading every piece set')
+    parser.add_argument('--tile-size', type=int, default=64)
+    parser.add_argument('--atlas-dir', default='cache')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+    if args.bench:
+        benchmark(args.tile_size, args.atlas_dir, args.repeat)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Vectorized evaluation of many positions at once with NumPy.
+
+A position becomes 12 piece planes of 64 squares (PLANE_PIECES order, squares as in Board.field),
+a batch an (N, 12, 64) array. Material and piece-square scores are one matrix product, mobility is
+computed with shifted occupancy boards for the whole batch.
+
+    python batch_eval.py --bench --positions 20000
+    python batch_eval.py positions.fen
+"""
+import argparse
+import itertools
+import random
+import sys
+import time
+
+import numpy as np
+
+from chess_engine import START_FEN, parse_fen
+from evaluation import SQUARE_SCORES, evaluate
+
+PLANE_PIECES = ['wP', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bP', 'bN', 'bB', 'bR', 'bQ', 'bK']
+PLANE_INDEX = {piece: i for i, piece in enumerate(PLANE_PIECES)}
+EMPTY = len(PLANE_PIECES)
+_SQUARE_CODES = dict(PLANE_INDEX, **{'--': EMPTY})
+
+# Material plus piece-square score of every piece on every square, white-positive like evaluate().
+SQUARE_WEIGHTS = np.array([SQUARE_SCORES[piece] for piece in PLANE_PIECES], dtype=np.float32).reshape(-1)
+# Centipawns per square a piece attacks that is not taken by its own side.
+MOBILITY_WEIGHTS = {'N': 4, 'B': 5, 'R': 2, 'Q': 1}
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (2, -1), (2, 1), (1, 2), (1, -2), (-1, 2), (-1, -2))
+ROOK_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+def position_field(position):
+    """Board.field of a position given as a FEN string, a board or a field."""
+    if isinstance(position, str):
+        return parse_fen(position)[0]
+    return getattr(position, 'field', position)
+
+
+def square_codes(positions):
+    """(N, 64) plane index of the piece on every square, EMPTY for empty squares."""
+    lookup = _SQUARE_CODES.__getitem__
+    flat = itertools.chain.from_iterable(itertools.chain.from_iterable(map(position_field, positions)))
+    return np.fromiter(map(lookup, flat), dtype=np.int8, count=len(positions) * 64).reshape(-1, 64)
+
+
+def piece_planes(positions):
+    """(N, 12, 64) one-hot piece planes for a list of positions."""
+    codes = square_codes(positions)
+    return (codes[:, None, :] == np.arange(len(PLANE_PIECES), dtype=np.int8)[None, :, None]).astype(np.float32)
+
+
+def _shift(boards, d_row, d_col):
+    # Move (8, 8, batch) boards by (d_row, d_col); squares shifted off the edge are dropped. Keeping the
+    # batch as the last axis makes both slices contiguous runs of memory.
+    shifted = np.zeros_like(boards)
+    shifted[max(d_row, 0):8 + min(d_row, 0), max(d_col, 0):8 + min(d_col, 0)] = \
+        boards[max(-d_row, 0):8 + min(-d_row, 0), max(-d_col, 0):8 + min(-d_col, 0)]
+    return shifted
+
+
+def _slider_attacks(pieces, empty, directions):
+    attacks = np.zeros_like(pieces)
+    for d_row, d_col in directions:
+        ray = _shift(pieces, d_row, d_col)
+        for _ in range(6):
+            attacks += ray
+            ray *= empty
+            ray = _shift(ray, d_row, d_col)
+        attacks += ray
+    return attacks
+
+
+def mobility(planes):
+    """White minus black weighted count of squares attacked by knights, bishops, rooks and queens."""
+    count = len(planes)
+    boards = np.ascontiguousarray(planes.reshape(count, len(PLANE_PIECES), 8, 8).transpose(1, 2, 3, 0), np.int16)
+    # Both colors go through the same shifts at once, white in the first half of the batch. Pieces are
+    # weighted before their attacks are spread, so one pass covers every piece kind.
+    sides = np.concatenate([boards[:6], boards[6:]], axis=3)
+    free = 1 - sides.sum(axis=0, dtype=np.int16)
+    empty = np.tile(1 - boards.sum(axis=0, dtype=np.int16), 2)
+    weights = MOBILITY_WEIGHTS
+    knights = weights['N'] * sides[1]
+    diagonal = weights['B'] * sides[2] + weights['Q'] * sides[4]
+    straight = weights['R'] * sides[3] + weights['Q'] * sides[4]
+    attacks = sum(_shift(knights, d_row, d_col) for d_row, d_col in KNIGHT_OFFSETS)
+    attacks += _slider_attacks(diagonal, empty, BISHOP_DIRECTIONS)
+    attacks += _slider_attacks(straight, empty, ROOK_DIRECTIONS)
+    per_side = (attacks * free).sum(axis=(0, 1))
+    return (per_side[:count] - per_side[count:]).astype(np.float32)
+
+
+def evaluate_planes(planes, with_mobility=True):
+    scores = planes.reshape(len(planes), -1) @ SQUARE_WEIGHTS
+    if with_mobility:
+        scores += mobility(planes)
+    return scores
+
+
+def evaluate_batch(positions, with_mobility=True):
+    """Scores in centipawns, positive when white is better, for a list of FENs, boards or fields.
+
+    Without mobility the scores equal evaluation.evaluate() position by position.
+    """
+    return evaluate_planes(piece_planes(positions), with_mobility)
+
+
+def random_positions(count, seed=0, max_plies=60):
+    """FENs reached by random play from the start, for benchmarks."""
+    from bitboard import BitBoard
+
+    rng = random.Random(seed)
+    fens = []
+    while len(fens) < count:
+        board = BitBoard(START_FEN)
+        for _ in range(rng.randrange(max_plies)):
+            moves = board.get_valid_moves()
+            if not moves:
+                break
+            board.move(rng.choice(moves))
+        fens.append(board.get_fen())
+    return fens
+
+
+def benchmark(fens, repeat=3):
+    fields = [parse_fen(fen)[0] for fen in fens]
+
+    def timed(function):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print('{:40} {:8.3f}s  {:10.0f} positions/sec'.format(function.__doc__, best, len(fields) / best))
+        return result
+
+    def python_loop():
+        """python evaluate() loop (no mobility)"""
+        return np.array([evaluate(field) for field in fields], dtype=np.float32)
+
+    def numpy_loop():
+        """evaluate_batch() per position"""
+        return np.concatenate([evaluate_batch([field]) for field in fields])
+
+    def numpy_batch():
+        """evaluate_batch() on the whole list"""
+        return evaluate_batch(fields)
+
+    def planes_batch():
+        """evaluate_planes() on prebuilt planes"""
+        return evaluate_planes(planes)
+
+    expected = timed(python_loop)
+    looped = timed(numpy_loop)
+    batched = timed(numpy_batch)
+    planes = piece_planes(fields)
+    timed(planes_batch)
+    same = np.array_equal(evaluate_batch(fields, with_mobility=False), expected) and np.array_equal(looped, batched)
+    print('batch scores match the per-position scores' if same else 'batch scores DIFFER from per-position scores')
+    return same
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score positions in batches with NumPy.')
+    parser.add_argument('path', nargs='?', help="FEN file, one position per line, '-' for standard input")
+    parser.add_argument('--bench', action='store_true', help='compare a per-position loop with batch scoring')
+    parser.add_argument('--positions', type=int, default=10000, help='random positions to benchmark without a file')
+    parser.add_argument('--no-mobility', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.path:
+        source = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8')
+        with source:
+            fens = [line.strip() for line in source if line.strip() and not line.startswith('#')]
+    else:
+        fens = random_positions(args.positions)
+    if args.bench:
+        return 0 if benchmark(fens) else 1
+    for fen, score in zip(fens, evaluate_batch(fens, not args.no_mobility)):
+        print('{:7.0f}  {}'.format(score, fen))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
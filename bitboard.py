@@ -0,0 +1,400 @@
+from chess_engine import (CASTLE_FLAG, ENPASSANT_FLAG, PIECE_CODES, PIECE_NAMES, PROMOTION_FLAG, START_FEN,
+                          CastleRights, Move, MoveList, make_fen, parse_fen)
+from zobrist import compute_key, enpassant_key, update_key
+
+# Squares are numbered row * 8 + col, with row 0 being the 8th rank, the same as Board.field.
+SQUARES = [(row, col) for row in range(8) for col in range(8)]
+PIECES = ['wP', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK']
+
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (1, -1), (1, 1), (-1, 1))
+
+
+def _leaper_attacks(offsets):
+    table = []
+    for row, col in SQUARES:
+        attacks = 0
+        for d_row, d_col in offsets:
+            end_row, end_col = row + d_row, col + d_col
+            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
+                attacks |= 1 << (end_row * 8 + end_col)
+        table.append(attacks)
+    return table
+
+
+def _rays(d_row, d_col):
+    table = []
+    for row, col in SQUARES:
+        ray = 0
+        end_row, end_col = row + d_row, col + d_col
+        while 0 <= end_row <= 7 and 0 <= end_col <= 7:
+            ray |= 1 << (end_row * 8 + end_col)
+            end_row, end_col = end_row + d_row, end_col + d_col
+        table.append(ray)
+    return table
+
+
+KNIGHT_ATTACKS = _leaper_attacks(((-2, -1), (-2, 1), (2, -1), (2, 1), (1, 2), (1, -2), (-1, 2), (-1, -2)))
+KING_ATTACKS = _leaper_attacks(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+# Squares attacked by a pawn of the given colour standing on a square.
+PAWN_ATTACKS = {'w': _leaper_attacks(((-1, -1), (-1, 1))), 'b': _leaper_attacks(((1, -1), (1, 1)))}
+
+# A ray "grows" towards higher square numbers if it points down the board or to the right.
+# For those the nearest blocker is the lowest set bit, otherwise it is the highest one.
+ROOK_RAYS = [(_rays(d_row, d_col), d_row * 8 + d_col > 0) for d_row, d_col in ROOK_DIRECTIONS]
+BISHOP_RAYS = [(_rays(d_row, d_col), d_row * 8 + d_col > 0) for d_row, d_col in BISHOP_DIRECTIONS]
+
+
+def _slider_attacks(rays, sq, occupied):
+    attacks = 0
+    for table, ascending in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            if ascending:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= table[blocker]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(sq, occupied):
+    return _slider_attacks(ROOK_RAYS, sq, occupied)
+
+
+def bishop_attacks(sq, occupied):
+    return _slider_attacks(BISHOP_RAYS, sq, occupied)
+
+
+def _nearest(bb, ascending):
+    if ascending:
+        return (bb & -bb).bit_length() - 1
+    return bb.bit_length() - 1
+
+
+def iter_bits(bb):
+    while bb:
+        bit = bb & -bb
+        yield bit.bit_length() - 1
+        bb ^= bit
+
+
+class BitBoard:
+    """Board backend keeping one 64-bit integer per piece type.
+
+    It exposes the same game API as chess_engine.Board (field, move, cancel_move, get_valid_moves,
+    in_check, square_under_attack, ...) and returns the same Move objects, so the two are
+    interchangeable. Legality is decided from the occupancy bitboards instead of making
+    every pseudo-legal move and regenerating all opponent moves.
+    """
+
+    def __init__(self, fen=START_FEN):
+        self.load_fen(fen)
+
+    def load_fen(self, fen):
+        self.field, self.white_to_move, self.current_castling_rights, self.enpassant_possible = parse_fen(fen)
+        self.pieces = dict.fromkeys(PIECES, 0)
+        self.occupancy = {'w': 0, 'b': 0}
+        # Piece code on every square, for building packed moves without touching field.
+        self.square_codes = [0] * 64
+        for sq, (row, col) in enumerate(SQUARES):
+            piece = self.field[row][col]
+            if piece != '--':
+                self.square_codes[sq] = PIECE_CODES[piece]
+                self.pieces[piece] |= 1 << sq
+                self.occupancy[piece[0]] |= 1 << sq
+
+        self.move_log = []
+        self.enpassant_log = [self.enpassant_possible]
+        rights = self.current_castling_rights
+        self.castle_rights_log = [CastleRights(rights.wks, rights.bks, rights.wqs, rights.bqs)]
+
+        self.key = compute_key(self.field, self.white_to_move, self.current_castling_rights, self.enpassant_possible)
+        self.key_log = [self.key]
+        self.repetitions = {self.key: 1}
+        self.checkmate = False
+        self.stale_mate = False
+
+    @property
+    def white_king_location(self):
+        return SQUARES[self.pieces['wK'].bit_length() - 1]
+
+    @property
+    def black_king_location(self):
+        return SQUARES[self.pieces['bK'].bit_length() - 1]
+
+    def _put(self, piece, sq):
+        bit = 1 << sq
+        self.field[sq >> 3][sq & 7] = piece
+        self.square_codes[sq] = PIECE_CODES[piece]
+        self.pieces[piece] |= bit
+        self.occupancy[piece[0]] |= bit
+
+    def _take(self, sq):
+        piece = self.field[sq >> 3][sq & 7]
+        if piece != '--':
+            bit = 1 << sq
+            self.field[sq >> 3][sq & 7] = '--'
+            self.square_codes[sq] = 0
+            self.pieces[piece] ^= bit
+            self.occupancy[piece[0]] ^= bit
+        return piece
+
+    def seek(self, record, ply):
+        """Jump to `ply` of a record.GameRecord; the moves before its snapshot can't be undone."""
+        record.restore(self, ply)
+
+    def get_fen(self):
+        return make_fen(self.field, self.white_to_move, self.current_castling_rights, self.enpassant_possible)
+
+    def move(self, move):
+        code = move.code
+        start = code & 63
+        end = (code >> 6) & 63
+        old_enpassant_key = enpassant_key(self.field, self.enpassant_possible, self.white_to_move)
+        piece = self._take(start)
+        if code & ENPASSANT_FLAG:
+            self._take(start - start % 8 + end % 8)
+        else:
+            self._take(end)
+        self._put(piece[0] + 'Q' if code & PROMOTION_FLAG else piece, end)
+
+        if code & CASTLE_FLAG:
+            if end > start:
+                self._put(self._take(end + 1), end - 1)
+            else:
+                self._put(self._take(end - 2), end + 1)
+
+        self.move_log.append(move)
+        self.white_to_move = not self.white_to_move
+
+        if piece[1] == 'P' and abs(end - start) == 16:
+            self.enpassant_possible = SQUARES[(start + end) // 2]
+        else:
+            self.enpassant_possible = ()
+        self.enpassant_log.append(self.enpassant_possible)
+
+        self.update_castle_rights(start, end)
+        rights = self.current_castling_rights
+        self.castle_rights_log.append(CastleRights(rights.wks, rights.bks, rights.wqs, rights.bqs))
+
+        self.key = update_key(self.key, move, self.castle_rights_log[-2], self.castle_rights_log[-1], old_enpassant_key,
+                              enpassant_key(self.field, self.enpassant_possible, self.white_to_move))
+        self.key_log.append(self.key)
+        self.repetitions[self.key] = self.repetitions.get(self.key, 0) + 1
+
+    def cancel_move(self):
+        if len(self.move_log) != 0:
+            move = self.move_log.pop()
+            if self.repetitions[self.key] == 1:
+                del self.repetitions[self.key]
+            else:
+                self.repetitions[self.key] -= 1
+            self.key_log.pop()
+            self.key = self.key_log[-1]
+
+            code = move.code
+            start = code & 63
+            end = (code >> 6) & 63
+            captured = PIECE_NAMES[(code >> 16) & 15]
+            self._take(end)
+            self._put(PIECE_NAMES[(code >> 12) & 15], start)
+            if code & ENPASSANT_FLAG:
+                self._put(captured, start - start % 8 + end % 8)
+            elif captured != '--':
+                self._put(captured, end)
+
+            if code & CASTLE_FLAG:
+                if end > start:
+                    self._put(self._take(end - 1), end + 1)
+                else:
+                    self._put(self._take(end + 1), end - 2)
+
+            self.white_to_move = not self.white_to_move
+            self.enpassant_log.pop()
+            self.enpassant_possible = self.enpassant_log[-1]
+            self.castle_rights_log.pop()
+            rights = self.castle_rights_log[-1]
+            self.current_castling_rights = CastleRights(rights.wks, rights.bks, rights.wqs, rights.bqs)
+
+    def repetition_count(self):
+        return self.repetitions[self.key]
+
+    def update_castle_rights(self, start, end):
+        rights = self.current_castling_rights
+        if start == 60:
+            rights.wks = False
+            rights.wqs = False
+        elif start == 4:
+            rights.bks = False
+            rights.bqs = False
+        # A move from or onto a corner either moves or captures that rook.
+        for sq in (start, end):
+            if sq == 56:
+                rights.wqs = False
+            elif sq == 63:
+                rights.wks = False
+            elif sq == 0:
+                rights.bqs = False
+            elif sq == 7:
+                rights.bks = False
+
+    def is_attacked(self, sq, by_color, occupied=None, keep=-1):
+        """Whether by_color attacks sq; `keep` masks out a piece that is about to be captured."""
+        pieces = self.pieces
+        if occupied is None:
+            occupied = self.occupancy['w'] | self.occupancy['b']
+        if KNIGHT_ATTACKS[sq] & pieces[by_color + 'N'] & keep:
+            return True
+        if PAWN_ATTACKS['b' if by_color == 'w' else 'w'][sq] & pieces[by_color + 'P'] & keep:
+            return True
+        if KING_ATTACKS[sq] & pieces[by_color + 'K']:
+            return True
+        diagonal = (pieces[by_color + 'B'] | pieces[by_color + 'Q']) & keep
+        if diagonal and bishop_attacks(sq, occupied) & diagonal:
+            return True
+        straight = (pieces[by_color + 'R'] | pieces[by_color + 'Q']) & keep
+        if straight and rook_attacks(sq, occupied) & straight:
+            return True
+        return False
+
+    def square_under_attack(self, row, col):
+        return self.is_attacked(row * 8 + col, 'b' if self.white_to_move else 'w')
+
+    def in_check(self):
+        color = 'w' if self.white_to_move else 'b'
+        return self.is_attacked(self.pieces[color + 'K'].bit_length() - 1, 'b' if color == 'w' else 'w')
+
+    def get_pins_and_checks(self, king_sq, color, occupied):
+        """Return (checkers, check mask, pins) for the king of `color` on king_sq.
+
+        The check mask holds the squares a non-king move has to land on (all squares when not in check),
+        pins map a pinned piece's square to the squares it may still move to.
+        """
+        enemy = 'b' if color == 'w' else 'w'
+        pieces = self.pieces
+        own = self.occupancy[color]
+        checkers = KNIGHT_ATTACKS[king_sq] & pieces[enemy + 'N'] | PAWN_ATTACKS[color][king_sq] & pieces[enemy + 'P']
+        check_mask = checkers or -1
+        pins = {}
+        queens = pieces[enemy + 'Q']
+        for rays, sliders in ((ROOK_RAYS, pieces[enemy + 'R'] | queens), (BISHOP_RAYS, pieces[enemy + 'B'] | queens)):
+            for table, ascending in rays:
+                ray = table[king_sq]
+                if not ray & sliders:
+                    continue
+                blockers = ray & occupied
+                first = _nearest(blockers, ascending)
+                if (1 << first) & sliders:
+                    checkers |= 1 << first
+                    check_mask = ray ^ table[first]
+                elif (1 << first) & own:
+                    behind = table[first] & occupied
+                    if behind:
+                        second = _nearest(behind, ascending)
+                        if (1 << second) & sliders:
+                            pins[first] = ray ^ table[second]
+        return checkers, check_mask, pins
+
+    def get_valid_moves(self):
+        return MoveList(map(Move.from_code, self.get_valid_move_codes()))
+
+    def get_valid_move_codes(self):
+        """Legal moves as packed Move codes; the allocation-free core of get_valid_moves."""
+        color = 'w' if self.white_to_move else 'b'
+        enemy = 'b' if self.white_to_move else 'w'
+        pieces = self.pieces
+        codes = self.square_codes
+        own = self.occupancy[color]
+        their = self.occupancy[enemy]
+        occupied = own | their
+        king_sq = pieces[color + 'K'].bit_length() - 1
+        moves = []
+
+        checkers, check_mask, pins = self.get_pins_and_checks(king_sq, color, occupied)
+        without_king = occupied ^ (1 << king_sq)
+        base = king_sq | codes[king_sq] << 12
+        for end in iter_bits(KING_ATTACKS[king_sq] & ~own):
+            if not self.is_attacked(end, enemy, without_king):
+                moves.append(base | end << 6 | codes[end] << 16)
+
+        if checkers & (checkers - 1) == 0:
+            targets = ~own & check_mask
+            for start in iter_bits(pieces[color + 'N']):
+                if start not in pins:
+                    base = start | codes[start] << 12
+                    for end in iter_bits(KNIGHT_ATTACKS[start] & targets):
+                        moves.append(base | end << 6 | codes[end] << 16)
+            for start in iter_bits(pieces[color + 'B'] | pieces[color + 'Q']):
+                base = start | codes[start] << 12
+                for end in iter_bits(bishop_attacks(start, occupied) & targets & pins.get(start, -1)):
+                    moves.append(base | end << 6 | codes[end] << 16)
+            for start in iter_bits(pieces[color + 'R'] | pieces[color + 'Q']):
+                base = start | codes[start] << 12
+                for end in iter_bits(rook_attacks(start, occupied) & targets & pins.get(start, -1)):
+                    moves.append(base | end << 6 | codes[end] << 16)
+            self.get_pawn_move_codes(color, king_sq, occupied, targets, pins, moves)
+            if not checkers:
+                self.get_castle_move_codes(king_sq, occupied, moves)
+
+        if len(moves) == 0:
+            if checkers:
+                self.checkmate = True
+            else:
+                self.stale_mate = True
+        else:
+            self.checkmate = False
+            self.stale_mate = False
+        return moves
+
+    def get_pawn_move_codes(self, color, king_sq, occupied, targets, pins, moves):
+        codes = self.square_codes
+        their = self.occupancy['b' if color == 'w' else 'w']
+        step, start_row = (-8, 6) if color == 'w' else (8, 1)
+        enpassant_bit = 0
+        if self.enpassant_possible:
+            enpassant_bit = 1 << (self.enpassant_possible[0] * 8 + self.enpassant_possible[1])
+        for start in iter_bits(self.pieces[color + 'P']):
+            allowed = targets & pins.get(start, -1)
+            base = start | codes[start] << 12
+            end = start + step
+            if end < 8 or end >= 56:
+                base |= PROMOTION_FLAG
+            if not (occupied >> end) & 1:
+                if (allowed >> end) & 1:
+                    moves.append(base | end << 6)
+                if start // 8 == start_row and not (occupied >> (end + step)) & 1 and (allowed >> (end + step)) & 1:
+                    moves.append(base | (end + step) << 6)
+            attacks = PAWN_ATTACKS[color][start]
+            for end in iter_bits(attacks & their & allowed):
+                moves.append(base | end << 6 | codes[end] << 16)
+            if attacks & enpassant_bit and self.is_enpassant_legal(start, enpassant_bit, king_sq, occupied):
+                end = enpassant_bit.bit_length() - 1
+                moves.append(base | end << 6 | codes[start - start % 8 + end % 8] << 16 | ENPASSANT_FLAG)
+
+    def is_enpassant_legal(self, start, end_bit, king_sq, occupied):
+        # Both pawns leave the rank at once, which pins can't describe, so test the resulting occupancy.
+        end = end_bit.bit_length() - 1
+        captured_bit = 1 << (start - start % 8 + end % 8)
+        after = (occupied ^ (1 << start) ^ captured_bit) | end_bit
+        return not self.is_attacked(king_sq, 'b' if self.white_to_move else 'w', after, ~captured_bit)
+
+    def get_castle_move_codes(self, king_sq, occupied, moves):
+        rights = self.current_castling_rights
+        if self.white_to_move:
+            kingside, queenside, enemy = rights.wks, rights.wqs, 'b'
+        else:
+            kingside, queenside, enemy = rights.bks, rights.bqs, 'w'
+        if not (kingside or queenside) or self.is_attacked(king_sq, enemy, occupied):
+            return
+        base = king_sq | self.square_codes[king_sq] << 12 | CASTLE_FLAG
+        if kingside and not occupied & (0b11 << (king_sq + 1)):
+            if not self.is_attacked(king_sq + 1, enemy, occupied) and \
+                    not self.is_attacked(king_sq + 2, enemy, occupied):
+                moves.append(base | (king_sq + 2) << 6)
+        if queenside and not occupied & (0b111 << (king_sq - 3)):
+            if not self.is_attacked(king_sq - 1, enemy, occupied) and \
+                    not self.is_attacked(king_sq - 2, enemy, occupied):
+                moves.append(base | (king_sq - 2) << 6)
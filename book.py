@@ -0,0 +1,207 @@
+"""Opening book: a sorted file of fixed 16-byte records, searched through mmap without loading it.
+
+Records use the Polyglot layout (big-endian key u64, move u16, weight u16, learn u32, sorted by key,
+moves encoded as in Polyglot with castling as king takes rook), but the keys are this program's
+Zobrist keys (zobrist.py), so Polyglot books from elsewhere do not match positions here.
+
+    python book.py build games.pgn more.pgn --output book.bin --plies 20
+    python book.py probe book.bin --fen "<FEN>"
+"""
+import argparse
+import heapq
+import mmap
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from bitboard import BitBoard
+from chess_engine import START_FEN
+from pgn import find_move, read_games
+
+RECORD = struct.Struct('>QHHI')
+KEY = struct.Struct('>Q')
+MAX_WEIGHT = 0xFFFF
+
+
+def encode_move(move):
+    """Polyglot move: to file, to rank, from file, from rank (rank 0 = 1st rank), promotion piece."""
+    end_col = move.end_col
+    if move.is_castle_move:
+        end_col = 7 if move.end_col > move.start_col else 0
+    code = end_col | (7 - move.end_row) << 3 | move.start_col << 6 | (7 - move.start_row) << 9
+    if move.is_pawn_promoted:
+        code |= 4 << 12
+    return code
+
+
+class OpeningBook:
+    """Read-only view of a book file. Close it, or use it as a context manager."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.count = size // RECORD.size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.count else b''
+
+    def __len__(self):
+        return self.count
+
+    def lower_bound(self, key):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def entries(self, key):
+        """(move code, weight) of every record for `key`."""
+        found = []
+        index = self.lower_bound(key)
+        while index < self.count:
+            record_key, move, weight, _ = RECORD.unpack_from(self.data, index * RECORD.size)
+            if record_key != key:
+                break
+            found.append((move, weight))
+            index += 1
+        return found
+
+    def moves(self, board):
+        """Legal book moves in the board's position as (Move, weight), best first."""
+        entries = self.entries(board.key)
+        if not entries:
+            return []
+        legal = {encode_move(move): move for move in board.get_valid_moves()}
+        found = [(legal[code], weight) for code, weight in entries if code in legal]
+        found.sort(key=lambda entry: -entry[1])
+        return found
+
+    def probe(self, board, rng=random):
+        """A book move for the board, picked at random in proportion to the weights, or None."""
+        found = [(move, weight) for move, weight in self.moves(board) if weight > 0]
+        if not found:
+            return None
+        return rng.choices([move for move, _ in found], [weight for _, weight in found])[0]
+
+    def close(self):
+        if self.count:
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _write_run(counts):
+    run = tempfile.TemporaryFile()
+    for (key, move), weight in sorted(counts.items()):
+        run.write(RECORD.pack(key, move, min(weight, MAX_WEIGHT), 0))
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    while True:
+        data = run.read(RECORD.size)
+        if len(data) < RECORD.size:
+            return
+        yield RECORD.unpack(data)
+
+
+def build_book(games, output, max_plies=20, min_count=1, max_entries=1 << 20):
+    """Write a book of the first `max_plies` moves of every game; returns (games, records).
+
+    Counts are kept in memory up to `max_entries` positions and moves, then spilled to sorted runs
+    that are merged at the end, so the PGN input can be of any size.
+    """
+    counts = Counter()
+    runs = []
+    game_count = 0
+    for game in games:
+        game_count += 1
+        board = BitBoard(game.headers.get('FEN', START_FEN))
+        moves = board.get_valid_moves()
+        for san in game.moves[:max_plies]:
+            move = find_move(san, moves)
+            if move is None:
+                break
+            counts[board.key, encode_move(move)] += 1
+            board.move(move)
+            moves = board.get_valid_moves()
+        if len(counts) >= max_entries:
+            runs.append(_write_run(counts))
+            counts.clear()
+    runs.append(_write_run(counts))
+
+    records = 0
+    with open(output + '.tmp', 'wb') as file:
+        current, weight = None, 0
+        for key, move, run_weight, _ in heapq.merge(*(_read_run(run) for run in runs)):
+            if (key, move) != current:
+                if current is not None and weight >= min_count:
+                    file.write(RECORD.pack(current[0], current[1], min(weight, MAX_WEIGHT), 0))
+                    records += 1
+                current, weight = (key, move), 0
+            weight += run_weight
+        if current is not None and weight >= min_count:
+            file.write(RECORD.pack(current[0], current[1], min(weight, MAX_WEIGHT), 0))
+            records += 1
+    os.replace(output + '.tmp', output)
+    for run in runs:
+        run.close()
+    return game_count, records
+
+
+def read_pgn_files(paths):
+    for path in paths:
+        source = sys.stdin if path == '-' else open(path, encoding='utf-8', errors='replace')
+        try:
+            yield from read_games(source)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or query an opening book.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='build a book from PGN files')
+    build.add_argument('pgn', nargs='+', help="PGN files, '-' for standard input")
+    build.add_argument('--output', default='book.bin')
+    build.add_argument('--plies', type=int, default=20, help='book depth in half moves')
+    build.add_argument('--min-count', type=int, default=1, help='drop moves played fewer times than this')
+    probe = commands.add_parser('probe', help='list the book moves of a position')
+    probe.add_argument('book')
+    probe.add_argument('--fen', default=START_FEN)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        games, records = build_book(read_pgn_files(args.pgn), args.output, args.plies, args.min_count)
+        print('{} games, {} records written to {} in {:.1f}s'.format(games, records, args.output,
+                                                                      time.perf_counter() - start))
+        return 0
+
+    board = BitBoard(args.fen)
+    with OpeningBook(args.book) as book:
+        start = time.perf_counter()
+        found = book.moves(board)
+        elapsed = time.perf_counter() - start
+        for move, weight in found:
+            print('{:8} {}'.format(move.get_chess_notation(), weight))
+        print('{} moves from {} records in {:.3f} ms'.format(len(found), len(book), elapsed * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
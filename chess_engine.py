@@ -0,0 +1,698 @@
+from zobrist import compute_key, enpassant_key, update_key
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+
+def _targets(offsets):
+    targets = []
+    for sq in range(64):
+        row, col = sq >> 3, sq & 7
+        targets.append([(row + d_row) * 8 + col + d_col for d_row, d_col in offsets
+                        if 0 <= row + d_row <= 7 and 0 <= col + d_col <= 7])
+    return targets
+
+
+# Squares by index (row * 8 + col). RAYS[sq][j] lists the squares from sq outwards in DIRECTIONS[j];
+# the first four directions are the rook's, the last four the bishop's.
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+RAYS = [[[(row + d_row * i) * 8 + col + d_col * i for i in range(1, 8)
+          if 0 <= row + d_row * i <= 7 and 0 <= col + d_col * i <= 7] for d_row, d_col in DIRECTIONS]
+        for row in range(8) for col in range(8)]
+KNIGHT_TARGETS = _targets(((-2, -1), (-2, 1), (2, -1), (2, 1), (1, 2), (1, -2), (-1, 2), (-1, -2)))
+KING_TARGETS = _targets(DIRECTIONS)
+SLIDER_DIRECTIONS = {'R': range(4), 'B': range(4, 8), 'Q': range(8)}
+
+
+class CastleRights:
+
+    def __init__(self, wks, bks, wqs, bqs):
+        self.wks = wks
+        self.bks = bks
+        self.wqs = wqs
+        self.bqs = bqs
+
+
+# Piece codes used inside packed moves; bit 3 set means black.
+PIECE_NAMES = ['--', 'wP', 'wR', 'wN', 'wB', 'wQ', 'wK', '--', '--', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK', '--']
+PIECE_CODES = {name: PIECE_NAMES.index(name) for name in PIECE_NAMES}
+
+# Packed move layout: bits 0-5 start square, 6-11 end square (row * 8 + col), 12-15 piece moved,
+# 16-19 piece captured, then the flags below.
+PROMOTION_FLAG = 1 << 20
+ENPASSANT_FLAG = 1 << 21
+CASTLE_FLAG = 1 << 22
+
+
+class Move:
+    """A move packed into one integer `code`; all other attributes are decoded from it on access."""
+    __slots__ = ('code',)
+
+    ranks_to_rows = {'1': 7, '2': 6, '3': 5, '4': 4,
+                     '5': 3, '6': 2, '7': 1, '8': 0}
+    rows_to_ranks = {v: k for k, v in ranks_to_rows.items()}
+
+    files_to_cols = {'a': 0, 'b': 1, 'c': 2, 'd': 3, 'e': 4,
+                     'f': 5, 'g': 6, 'h': 7}
+    cols_to_files = {v: k for k, v in files_to_cols.items()}
+
+    def __init__(self, start_sq, end_sq, board, is_enpassant_move=False, is_castle_move=False):
+        start_row, start_col = start_sq
+        end_row, end_col = end_sq
+        piece_moved = board[start_row][start_col]
+        piece_captured = board[end_row][end_col]
+        code = start_row * 8 + start_col | (end_row * 8 + end_col) << 6 | PIECE_CODES[piece_moved] << 12
+        if (piece_moved == 'wP' and end_row == 0) or (piece_moved == 'bP' and end_row == 7):
+            code |= PROMOTION_FLAG
+        if is_enpassant_move:
+            piece_captured = 'wP' if piece_moved == 'bP' else 'bP'
+            code |= ENPASSANT_FLAG
+        if is_castle_move:
+            code |= CASTLE_FLAG
+        self.code = code | PIECE_CODES[piece_captured] << 16
+
+    @classmethod
+    def from_code(cls, code):
+        move = object.__new__(cls)
+        move.code = code
+        return move
+
+    @property
+    def start_row(self):
+        return (self.code & 63) >> 3
+
+    @property
+    def start_col(self):
+        return self.code & 7
+
+    @property
+    def end_row(self):
+        return (self.code >> 9) & 7
+
+    @property
+    def end_col(self):
+        return (self.code >> 6) & 7
+
+    @property
+    def piece_moved(self):
+        return PIECE_NAMES[(self.code >> 12) & 15]
+
+    @property
+    def piece_captured(self):
+        return PIECE_NAMES[(self.code >> 16) & 15]
+
+    @property
+    def is_pawn_promoted(self):
+        return bool(self.code & PROMOTION_FLAG)
+
+    @property
+    def is_enpassant_move(self):
+        return bool(self.code & ENPASSANT_FLAG)
+
+    @property
+    def is_castle_move(self):
+        return bool(self.code & CASTLE_FLAG)
+
+    @property
+    def move_ID(self):
+        return self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+
+    def __eq__(self, other):
+        if isinstance(other, Move):
+            return self.code & 0xFFF == other.code & 0xFFF
+        return NotImplemented
+
+    def __hash__(self):
+        return self.code & 0xFFF
+
+    def __repr__(self):
+        return 'Move({})'.format(self.get_chess_notation())
+
+    def get_chess_notation(self):
+        return self.piece_moved[1] + self.get_rank_file(self.start_row, self.start_col) + \
+               self.get_rank_file(self.end_row, self.end_col)
+
+    def get_rank_file(self, row, col):
+        return self.cols_to_files[col] + self.rows_to_ranks[row]
+
+
+class MoveList(list):
+    """The list get_valid_moves() returns, with lookups by origin square and by (from, to).
+
+    The index is built on the first lookup, so the search, which only iterates, never pays for it.
+    It stays valid until the board moves.
+    """
+
+    __slots__ = ('by_square', 'by_squares')
+
+    def build_index(self):
+        self.by_square = {}
+        self.by_squares = {}
+        for move in self:
+            self.by_square.setdefault(move.code & 0x3F, []).append(move)
+            self.by_squares[move.code & 0xFFF] = move
+
+    def moves_from(self, row, col):
+        """Legal moves of the piece on (row, col)."""
+        if not hasattr(self, 'by_square'):
+            self.build_index()
+        return self.by_square.get(row * 8 + col, [])
+
+    def find(self, start_sq, end_sq):
+        """The legal move from start_sq to end_sq, both (row, col), or None."""
+        if not hasattr(self, 'by_squares'):
+            self.build_index()
+        return self.by_squares.get(start_sq[0] * 8 + start_sq[1] | (end_sq[0] * 8 + end_sq[1]) << 6)
+
+
+class Board:
+
+    def __init__(self, fen=START_FEN):
+        self.move_functions = {'P': self.get_pawn_moves, 'R': self.get_rook_moves, 'N': self.get_knight_moves,
+                               'B': self.get_bishop_moves, 'Q': self.get_queen_moves, 'K': self.get_king_moves}
+        self.load_fen(fen)
+
+    def load_fen(self, fen):
+        self.field, self.white_to_move, self.current_castling_rights, self.enpassant_possible = parse_fen(fen)
+        self.move_log = []
+
+        for row in range(8):
+            for col in range(8):
+                if self.field[row][col] == 'wK':
+                    self.white_king_location = (row, col)
+                elif self.field[row][col] == 'bK':
+                    self.black_king_location = (row, col)
+
+        self.checkmate = False
+        self.stale_mate = False
+
+        self.enpassant_log = [self.enpassant_possible]
+        self.pins = {}
+        self.block_squares = None
+        self.xray_squares = ()
+
+        # How many pieces of each color attack every square, kept up to date by set_squares().
+        self.attacks = {'w': [0] * 64, 'b': [0] * 64}
+        for row in range(8):
+            for col in range(8):
+                if self.field[row][col] != '--':
+                    self.add_attacks(row * 8 + col, 1)
+
+        self.castle_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
+                                               self.current_castling_rights.wqs, self.current_castling_rights.bqs)]
+
+        self.key = compute_key(self.field, self.white_to_move, self.current_castling_rights, self.enpassant_possible)
+        self.key_log = [self.key]
+        self.repetitions = {self.key: 1}
+
+    def seek(self, record, ply):
+        """Jump to `ply` of a record.GameRecord; the moves before its snapshot can't be undone."""
+        record.restore(self, ply)
+
+    def get_fen(self):
+        return make_fen(self.field, self.white_to_move, self.current_castling_rights, self.enpassant_possible)
+
+    def move(self, move):
+        old_enpassant_key = enpassant_key(self.field, self.enpassant_possible, self.white_to_move)
+        start = move.start_row * 8 + move.start_col
+        end = move.end_row * 8 + move.end_col
+        changes = [(start, '--'), (end, move.piece_moved[0] + 'Q' if move.is_pawn_promoted else move.piece_moved)]
+        if move.is_enpassant_move:
+            changes.append((move.start_row * 8 + move.end_col, '--'))
+        elif move.is_castle_move:
+            rook = move.piece_moved[0] + 'R'
+            if move.end_col - move.start_col == 2:
+                changes += [(end + 1, '--'), (end - 1, rook)]
+            else:
+                changes += [(end - 2, '--'), (end + 1, rook)]
+        self.set_squares(changes)
+        self.move_log.append(move)
+        self.white_to_move = not self.white_to_move
+        if move.piece_moved == 'wK':
+            self.white_king_location = (move.end_row, move.end_col)
+        elif move.piece_moved == 'bK':
+            self.black_king_location = (move.end_row, move.end_col)
+
+        if move.piece_moved[1] == 'P' and abs(move.end_row - move.start_row) == 2:
+            self.enpassant_possible = ((move.start_row + move.end_row) // 2, move.start_col)
+        else:
+            self.enpassant_possible = ()
+        self.enpassant_log.append(self.enpassant_possible)
+
+        self.update_castle_rights(move)
+        self.castle_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
+                                                   self.current_castling_rights.wqs, self.current_castling_rights.bqs))
+
+        self.key = update_key(self.key, move, self.castle_rights_log[-2], self.castle_rights_log[-1], old_enpassant_key,
+                              enpassant_key(self.field, self.enpassant_possible, self.white_to_move))
+        self.key_log.append(self.key)
+        self.repetitions[self.key] = self.repetitions.get(self.key, 0) + 1
+
+    def cancel_move(self):
+        if len(self.move_log) != 0:
+            move = self.move_log.pop()
+            if self.repetitions[self.key] == 1:
+                del self.repetitions[self.key]
+            else:
+                self.repetitions[self.key] -= 1
+            self.key_log.pop()
+            self.key = self.key_log[-1]
+
+            start = move.start_row * 8 + move.start_col
+            end = move.end_row * 8 + move.end_col
+            changes = [(start, move.piece_moved)]
+            if move.is_enpassant_move:
+                changes += [(end, '--'), (move.start_row * 8 + move.end_col, move.piece_captured)]
+            else:
+                changes.append((end, move.piece_captured))
+            if move.is_castle_move:
+                rook = move.piece_moved[0] + 'R'
+                if move.end_col - move.start_col == 2:
+                    changes += [(end - 1, '--'), (end + 1, rook)]
+                else:
+                    changes += [(end + 1, '--'), (end - 2, rook)]
+            self.set_squares(changes)
+            self.white_to_move = not self.white_to_move
+            if move.piece_moved == 'wK':
+                self.white_king_location = (move.start_row, move.start_col)
+            elif move.piece_moved == 'bK':
+                self.black_king_location = (move.start_row, move.start_col)
+            self.enpassant_log.pop()
+            self.enpassant_possible = self.enpassant_log[-1]
+
+            self.castle_rights_log.pop()
+            new_rights = self.castle_rights_log[-1]
+            self.current_castling_rights = CastleRights(new_rights.wks, new_rights.bks, new_rights.wqs, new_rights.bqs)
+
+    def repetition_count(self):
+        return self.repetitions[self.key]
+
+    def set_squares(self, changes):
+        """Put the pieces of `changes`, (square, piece) pairs, on the field and update the attack counts.
+
+        Only the pieces on the changed squares and the sliders whose rays reach them attack differently
+        afterwards, so only their attacks are taken off and added back.
+        """
+        field = self.field
+        affected = set()
+        for sq, _ in changes:
+            if field[sq >> 3][sq & 7] != '--':
+                affected.add(sq)
+            affected.update(self.sliders_reaching(sq))
+        for sq in affected:
+            self.add_attacks(sq, -1)
+        for sq, piece in changes:
+            field[sq >> 3][sq & 7] = piece
+            if piece != '--':
+                affected.add(sq)
+        for sq in affected:
+            if field[sq >> 3][sq & 7] != '--':
+                self.add_attacks(sq, 1)
+
+    def add_attacks(self, sq, delta):
+        field = self.field
+        piece = field[sq >> 3][sq & 7]
+        counts = self.attacks[piece[0]]
+        kind = piece[1]
+        if kind == 'P':
+            row = (sq >> 3) - 1 if piece[0] == 'w' else (sq >> 3) + 1
+            if 0 <= row <= 7:
+                col = sq & 7
+                if col > 0:
+                    counts[row * 8 + col - 1] += delta
+                if col < 7:
+                    counts[row * 8 + col + 1] += delta
+        elif kind == 'N' or kind == 'K':
+            for target in (KNIGHT_TARGETS if kind == 'N' else KING_TARGETS)[sq]:
+                counts[target] += delta
+        else:
+            rays = RAYS[sq]
+            for j in SLIDER_DIRECTIONS[kind]:
+                for target in rays[j]:
+                    counts[target] += delta
+                    if field[target >> 3][target & 7] != '--':
+                        break
+
+    def sliders_reaching(self, sq):
+        """Squares of the rooks, bishops and queens of both colors whose rays reach sq."""
+        field = self.field
+        sliders = []
+        rays = RAYS[sq]
+        for j in range(8):
+            for target in rays[j]:
+                piece = field[target >> 3][target & 7]
+                if piece != '--':
+                    if piece[1] == 'Q' or piece[1] == ('R' if j < 4 else 'B'):
+                        sliders.append(target)
+                    break
+        return sliders
+
+    def update_castle_rights(self, move):
+        if move.piece_moved == 'wK':
+            self.current_castling_rights.wks = False
+            self.current_castling_rights.wqs = False
+        elif move.piece_moved == 'bK':
+            self.current_castling_rights.bks = False
+            self.current_castling_rights.bqs = False
+        elif move.piece_moved == 'wR':
+            if move.start_row == 7:
+                if move.start_col == 0:
+                    self.current_castling_rights.wqs = False
+                elif move.start_col == 7:
+                    self.current_castling_rights.wks = False
+        elif move.piece_moved == 'bR':
+            if move.start_row == 0:
+                if move.start_col == 0:
+                    self.current_castling_rights.bqs = False
+                elif move.start_col == 7:
+                    self.current_castling_rights.bks = False
+
+        if move.piece_captured == 'wR':
+            if move.end_row == 7:
+                if move.end_col == 0:
+                    self.current_castling_rights.wqs = False
+                elif move.end_col == 7:
+                    self.current_castling_rights.wks = False
+        elif move.piece_captured == 'bR':
+            if move.end_row == 0:
+                if move.end_col == 0:
+                    self.current_castling_rights.bqs = False
+                elif move.end_col == 7:
+                    self.current_castling_rights.bks = False
+
+    def get_valid_moves(self):
+        if self.white_to_move:
+            king_row, king_col = self.white_king_location
+        else:
+            king_row, king_col = self.black_king_location
+        self.pins, checks = self.check_for_pins_and_checks(king_row, king_col)
+        # A checking slider still attacks the square behind the king, where the attack counts stop.
+        self.xray_squares = {(king_row - d[0], king_col - d[1]) for check_row, check_col, d in checks
+                             if self.field[check_row][check_col][1] in 'RBQ'}
+
+        moves = []
+        if len(checks) == 0:
+            moves = self.get_all_possible_moves()
+            self.get_castle_moves(king_row, king_col, moves)
+        elif len(checks) == 1:
+            check_row, check_col, d = checks[0]
+            self.block_squares = {(check_row, check_col)}
+            if self.field[check_row][check_col][1] in 'RBQ':
+                for i in range(1, 8):
+                    square = (king_row + d[0] * i, king_col + d[1] * i)
+                    self.block_squares.add(square)
+                    if square == (check_row, check_col):
+                        break
+            moves = self.get_all_possible_moves()
+        else:
+            self.get_king_moves(king_row, king_col, moves)
+        self.pins = {}
+        self.block_squares = None
+        self.xray_squares = ()
+        moves = MoveList(moves)
+
+        if len(moves) == 0:
+            if len(checks) != 0:
+                self.checkmate = True
+            else:
+                self.stale_mate = True
+        else:
+            self.checkmate = False
+            self.stale_mate = False
+        return moves
+
+    def check_for_pins_and_checks(self, row, col):
+        """Find pieces pinned to the king on (row, col) and the pieces giving check.
+
+        Pins map the pinned square to the direction of the pin, checks are (row, col, direction) tuples.
+        """
+        pins = {}
+        checks = []
+        ally_color = 'w' if self.white_to_move else 'b'
+        enemy_color = 'b' if self.white_to_move else 'w'
+        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+        for j in range(len(directions)):
+            d = directions[j]
+            possible_pin = ()
+            for i in range(1, 8):
+                end_row = row + d[0] * i
+                end_col = col + d[1] * i
+                if not (0 <= end_row <= 7 and 0 <= end_col <= 7):
+                    break
+                end_piece = self.field[end_row][end_col]
+                if end_piece[0] == ally_color:
+                    if possible_pin == ():
+                        possible_pin = (end_row, end_col)
+                    else:
+                        break
+                elif end_piece[0] == enemy_color:
+                    kind = end_piece[1]
+                    if (j < 4 and kind in 'RQ') or (j >= 4 and kind in 'BQ'):
+                        if possible_pin == ():
+                            checks.append((end_row, end_col, d))
+                        else:
+                            pins[possible_pin] = d
+                    break
+
+        for d in ((-2, -1), (-2, 1), (2, -1), (2, 1), (1, 2), (1, -2), (-1, 2), (-1, -2)):
+            end_row = row + d[0]
+            end_col = col + d[1]
+            if 0 <= end_row <= 7 and 0 <= end_col <= 7 and self.field[end_row][end_col] == enemy_color + 'N':
+                checks.append((end_row, end_col, d))
+
+        pawn_row = row - 1 if self.white_to_move else row + 1
+        if 0 <= pawn_row <= 7:
+            for pawn_col in (col - 1, col + 1):
+                if 0 <= pawn_col <= 7 and self.field[pawn_row][pawn_col] == enemy_color + 'P':
+                    checks.append((pawn_row, pawn_col, (pawn_row - row, pawn_col - col)))
+        return pins, checks
+
+    def is_move_allowed(self, row, col, end_row, end_col):
+        if self.block_squares is not None and (end_row, end_col) not in self.block_squares:
+            return False
+        pin = self.pins.get((row, col))
+        if pin is not None:
+            d = ((end_row > row) - (end_row < row), (end_col > col) - (end_col < col))
+            return d == pin or (-d[0], -d[1]) == pin
+        return True
+
+    def is_enpassant_legal(self, row, col, end_row, end_col):
+        # Both pawns leave the rank at once, so pins can't describe this case: try it on the field instead.
+        pawn = self.field[row][col]
+        captured = self.field[row][end_col]
+        self.set_squares([(row * 8 + col, '--'), (row * 8 + end_col, '--'), (end_row * 8 + end_col, pawn)])
+        attacked = self.in_check()
+        self.set_squares([(row * 8 + col, pawn), (row * 8 + end_col, captured), (end_row * 8 + end_col, '--')])
+        return not attacked
+
+    def in_check(self):
+        if self.white_to_move:
+            return self.square_under_attack(self.white_king_location[0], self.white_king_location[1])
+        else:
+            return self.square_under_attack(self.black_king_location[0], self.black_king_location[1])
+
+    def square_under_attack(self, row, col):
+        return self.attacks['b' if self.white_to_move else 'w'][row * 8 + col] > 0
+
+    def get_all_possible_moves(self):
+        moves = []
+        for row in range(len(self.field)):
+            for col in range(len(self.field[row])):
+                turn = self.field[row][col][0]
+                if (turn == 'w' and self.white_to_move) or (turn == 'b' and not self.white_to_move):
+                    piece = self.field[row][col][1]
+                    self.move_functions[piece](row, col, moves)
+        return moves
+
+    def get_pawn_moves(self, row, col, moves):
+        if self.white_to_move:
+            direction, start_row, enemy_color = -1, 6, 'b'
+        else:
+            direction, start_row, enemy_color = 1, 1, 'w'
+        end_row = row + direction
+        if self.field[end_row][col] == '--':
+            if self.is_move_allowed(row, col, end_row, col):
+                moves.append(Move((row, col), (end_row, col), self.field))
+            if row == start_row and self.field[end_row + direction][col] == '--' and \
+                    self.is_move_allowed(row, col, end_row + direction, col):
+                moves.append(Move((row, col), (end_row + direction, col), self.field))
+        for end_col in (col - 1, col + 1):
+            if 0 <= end_col <= 7:
+                if self.field[end_row][end_col][0] == enemy_color:
+                    if self.is_move_allowed(row, col, end_row, end_col):
+                        moves.append(Move((row, col), (end_row, end_col), self.field))
+                elif (end_row, end_col) == self.enpassant_possible:
+                    if self.is_enpassant_legal(row, col, end_row, end_col):
+                        moves.append(Move((row, col), (end_row, end_col), self.field, is_enpassant_move=True))
+
+    def get_rook_moves(self, row, col, moves):
+        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
+        enemy_color = 'b' if self.white_to_move else 'w'
+        for d in directions:
+            for i in range(1, 8):
+                end_row = row + (d[0] * i)
+                end_col = col + (d[1] * i)
+                if 0 <= end_row <= 7 and 0 <= end_col <= 7:
+                    end_piece = self.field[end_row][end_col]
+                    if end_piece == '--':
+                        if self.is_move_allowed(row, col, end_row, end_col):
+                            moves.append(Move((row, col), (end_row, end_col), self.field))
+                    elif end_piece[0] == enemy_color:
+                        if self.is_move_allowed(row, col, end_row, end_col):
+                            moves.append(Move((row, col), (end_row, end_col), self.field))
+                        break
+                    else:
+                        break
+                else:
+                    break
+
+    def get_knight_moves(self, row, col, moves):
+        if (row, col) in self.pins:
+            return
+        directions = ((-2, -1), (-2, 1), (2, -1), (2, 1), (1, 2), (1, -2), (-1, 2), (-1, -2))
+        ally_color = 'w' if self.white_to_move else 'b'
+        for d in directions:
+            end_row = row + d[0]
+            end_col = col + d[1]
+            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
+                end_piece = self.field[end_row][end_col]
+                if end_piece[0] != ally_color and self.is_move_allowed(row, col, end_row, end_col):
+                    moves.append(Move((row, col), (end_row, end_col), self.field))
+
+    def get_queen_moves(self, row, col, moves):
+        self.get_rook_moves(row, col, moves)
+        self.get_bishop_moves(row, col, moves)
+
+    def get_bishop_moves(self, row, col, moves):
+        directions = ((-1, -1), (1, -1), (1, 1), (-1, 1))
+        enemy_color = 'b' if self.white_to_move else 'w'
+        for d in directions:
+            for i in range(1, 8):
+                end_row = row + (d[0] * i)
+                end_col = col + (d[1] * i)
+                if 0 <= end_row <= 7 and 0 <= end_col <= 7:
+                    end_piece = self.field[end_row][end_col]
+                    if end_piece == '--':
+                        if self.is_move_allowed(row, col, end_row, end_col):
+                            moves.append(Move((row, col), (end_row, end_col), self.field))
+                    elif end_piece[0] == enemy_color:
+                        if self.is_move_allowed(row, col, end_row, end_col):
+                            moves.append(Move((row, col), (end_row, end_col), self.field))
+                        break
+                    else:
+                        break
+                else:
+                    break
+
+    def get_king_moves(self, row, col, moves):
+        directions = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+        ally_color = 'w' if self.white_to_move else 'b'
+        attacks = self.attacks['b' if self.white_to_move else 'w']
+        for i in range(8):
+            end_row = row + directions[i][0]
+            end_col = col + directions[i][1]
+            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
+                end_piece = self.field[end_row][end_col]
+                if end_piece[0] != ally_color and not attacks[end_row * 8 + end_col] and \
+                        (end_row, end_col) not in self.xray_squares:
+                    moves.append(Move((row, col), (end_row, end_col), self.field))
+
+    def get_castle_moves(self, row, col, moves):
+        if self.in_check():
+            return
+        if (self.white_to_move and self.current_castling_rights.wks) or \
+                (not self.white_to_move and self.current_castling_rights.bks):
+            self.get_kingside_castle_moves(row, col, moves)
+        if (self.white_to_move and self.current_castling_rights.wqs) or \
+                (not self.white_to_move and self.current_castling_rights.bqs):
+            self.get_queenside_castle_moves(row, col, moves)
+
+    def get_kingside_castle_moves(self, row, col, moves):
+        if self.field[row][col + 1] == '--' and self.field[row][col + 2] == '--':
+            if not self.square_under_attack(row, col + 1) and not self.square_under_attack(row, col + 2):
+                moves.append(Move((row, col), (row, col + 2), self.field, is_castle_move=True))
+
+    def get_queenside_castle_moves(self, row, col, moves):
+        if self.field[row][col - 1] == '--' and self.field[row][col - 2] == '--' and self.field[row][col - 3] == '--':
+            if not self.square_under_attack(row, col - 1) and not self.square_under_attack(row, col - 2):
+                moves.append(Move((row, col), (row, col - 2), self.field, is_castle_move=True))
+
+
+def parse_fen(fen):
+    """Return (field, white_to_move, castle rights, en passant square) for a FEN string."""
+    parts = fen.split()
+    field = []
+    for rank in parts[0].split('/') if parts else ():
+        row = []
+        for char in rank:
+            if char in '12345678':
+                row.extend(['--'] * int(char))
+            elif char in 'PNBRQKpnbrqk':
+                row.append(('w' if char.isupper() else 'b') + char.upper())
+            else:
+                raise ValueError('Bad FEN: ' + fen)
+        field.append(row)
+    if len(field) != 8 or any(len(row) != 8 for row in field):
+        raise ValueError('Bad FEN: ' + fen)
+    # Both backends need exactly one king of each color.
+    kings = sorted(piece for row in field for piece in row if piece[1] == 'K')
+    if kings != ['bK', 'wK']:
+        raise ValueError('Bad FEN, one king of each color needed: ' + fen)
+
+    white_to_move = len(parts) < 2 or parts[1] == 'w'
+    castling = parts[2] if len(parts) > 2 else '-'
+    # Rights are kept only while the king and that rook are still on their home squares.
+    white_king, black_king = field[7][4] == 'wK', field[0][4] == 'bK'
+    castle_rights = CastleRights('K' in castling and white_king and field[7][7] == 'wR',
+                                 'k' in castling and black_king and field[0][7] == 'bR',
+                                 'Q' in castling and white_king and field[7][0] == 'wR',
+                                 'q' in castling and black_king and field[0][0] == 'bR')
+
+    enpassant_possible = ()
+    if len(parts) > 3 and parts[3] != '-':
+        row, col = Move.ranks_to_rows[parts[3][1]], Move.files_to_cols[parts[3][0]]
+        # Only a square a pawn of the other side has just passed over, with that pawn in front of it.
+        pawn_row, pawn = (row + 1, 'bP') if white_to_move else (row - 1, 'wP')
+        if row == (2 if white_to_move else 5) and field[row][col] == '--' and field[pawn_row][col] == pawn:
+            enpassant_possible = (row, col)
+    return field, white_to_move, castle_rights, enpassant_possible
+
+
+def make_fen(field, white_to_move, castle_rights, enpassant_possible):
+    ranks = []
+    for row in field:
+        rank = ''
+        empty = 0
+        for piece in row:
+            if piece == '--':
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            rank += piece[1] if piece[0] == 'w' else piece[1].lower()
+        if empty:
+            rank += str(empty)
+        ranks.append(rank)
+
+    castling = ''.join(flag for flag, allowed in (('K', castle_rights.wks), ('Q', castle_rights.wqs),
+                                                  ('k', castle_rights.bks), ('q', castle_rights.bqs)) if allowed)
+    enpassant = '-'
+    if enpassant_possible:
+        enpassant = Move.cols_to_files[enpassant_possible[1]] + Move.rows_to_ranks[enpassant_possible[0]]
+    return ' '.join(('/'.join(ranks), 'w' if white_to_move else 'b', castling or '-', enpassant, '0', '1'))
+
+
+def make_board(fen=START_FEN, backend='bitboard', history=()):
+    """Board without any pygame parts: 'bitboard' for BitBoard, 'field' for the list-of-strings Board.
+
+    `history` holds the Zobrist keys of the positions played before `fen`, so repetitions still count
+    when a game travels to another process as a FEN (board.key_log[:-1] of the sending board).
+    """
+    if backend == 'bitboard':
+        from bitboard import BitBoard
+        board = BitBoard(fen)
+    else:
+        board = Board(fen)
+    for key in history:
+        board.repetitions[key] = board.repetitions.get(key, 0) + 1
+    return board
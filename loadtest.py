@@ -0,0 +1,129 @@
+"""Load test for server.py: many concurrent games of random moves, with move latency percentiles.
+
+    python server.py --port 8765 &
+    python loadtest.py --port 8765 --games 2000 --connections 100 --plies 40 --engine-every 20
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+
+class Connection:
+    """One TCP connection with any number of requests in flight, matched to answers by id."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.listener = asyncio.ensure_future(self.listen())
+
+    @classmethod
+    async def open(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port, limit=1 << 16)
+        return cls(reader, writer)
+
+    async def listen(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.pending.pop(response.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('connection closed'))
+
+    async def request(self, **request):
+        request['id'] = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request['id']] = future
+        self.writer.write(json.dumps(request).encode() + b'\n')
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        self.listener.cancel()
+
+
+class Stats:
+
+    def __init__(self):
+        self.latencies = {'move': [], 'engine': []}
+        self.errors = 0
+        self.games = 0
+
+    def report(self, elapsed):
+        print('{} games in {:.1f}s, {} errors'.format(self.games, elapsed, self.errors))
+        for kind, latencies in self.latencies.items():
+            if not latencies:
+                continue
+            latencies.sort()
+            percentiles = ['p{} {:7.2f}'.format(p, latencies[min(len(latencies) - 1, len(latencies) * p // 100)] * 1000)
+                           for p in (50, 90, 99)]
+            print('{:6} {:7} requests {:8.0f}/s  latency ms: {}  max {:7.2f}'.format(
+                kind, len(latencies), len(latencies) / elapsed, '  '.join(percentiles), latencies[-1] * 1000))
+
+
+async def play_game(connection, stats, rng, plies, engine_every, think_time):
+    state = await connection.request(cmd='new')
+    if not state['ok']:
+        stats.errors += 1
+        return
+    game = state['game']
+    for ply in range(1, plies + 1):
+        if not state['moves']:
+            break
+        kind = 'engine' if engine_every and ply % engine_every == 0 else 'move'
+        start = time.perf_counter()
+        if kind == 'engine':
+            state = await connection.request(cmd='engine', game=game, time=think_time)
+        else:
+            state = await connection.request(cmd='move', game=game, move=rng.choice(state['moves']))
+        stats.latencies[kind].append(time.perf_counter() - start)
+        if not state['ok']:
+            stats.errors += 1
+            break
+    await connection.request(cmd='close', game=game)
+    stats.games += 1
+
+
+async def run(host, port, games, connections, plies, engine_every, think_time, seed):
+    rng = random.Random(seed)
+    stats = Stats()
+    pool = [await Connection.open(host, port) for _ in range(connections)]
+    start = time.perf_counter()
+    await asyncio.gather(*(play_game(pool[i % connections], stats, rng, plies, engine_every, think_time)
+                           for i in range(games)), return_exceptions=False)
+    elapsed = time.perf_counter() - start
+    for connection in pool:
+        await connection.close()
+    stats.report(elapsed)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play many concurrent random games against server.py.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--games', type=int, default=1000, help='games played at the same time')
+    parser.add_argument('--connections', type=int, default=50, help='the games are spread over this many connections')
+    parser.add_argument('--plies', type=int, default=40)
+    parser.add_argument('--engine-every', type=int, default=0, help='ask the engine for every n-th move, 0 = never')
+    parser.add_argument('--think-time', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.host, args.port, args.games, max(1, min(args.connections, args.games)), args.plies,
+                    args.engine_every, args.think_time, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,54 @@
 import os
 import sys
+import time
+from collections import OrderedDict
 
 import pygame
 
+import chess_engine
+from assets import DEFAULT_SET, PIECE_SETS, PieceSetCache
+from bitboard import BitBoard
+from chess_engine import START_FEN
+from profiler import Profiler
+from worker import WORKER_EVENT, BackgroundWorker, find_code, moves_from_codes
+
 WHITE = 1
 BLACK = 2
 WIDTH = HEIGHT = 512
 NUMBER = 8
 TILE_SIZE = WIDTH // NUMBER
-PIECE_IMAGES = {}
+MIN_TILE_SIZE = 24
+# The window can be resized; the board is the largest that fits, centered at BOARD_LEFT, BOARD_TOP.
+BOARD_LEFT = BOARD_TOP = 0
+MARGIN_COLOR = pygame.Color('gray20')
+# rendered board backgrounds kept for recent window sizes and color schemes
+BACKGROUND_CACHE = 4
 MAX_FPS = 15
-pygame.init()
-pygame.mixer.music.load("data/sound.mp3")
-pygame.mixer.music.play(-1)
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
+# 'timed' slides a moved piece to its square in ANIMATION_TIME seconds whatever the distance, and any click or key
+# ends it; 'frames' is the old blocking slide of 10 frames per square; 'off' skips it
+ANIMATION = os.environ.get('CHESS_ANIMATION', 'timed')
+ANIMATION_TIME = float(os.environ.get('CHESS_ANIMATION_TIME', 0.15))
+ANIMATION_FPS = 60
+# 'bitboard' or 'field' (the original list-of-strings board)
+BACKEND = os.environ.get('CHESS_BACKEND', 'bitboard')
+# 'white' or 'black' to let the computer play that side, empty for two human players
+COMPUTER = os.environ.get('CHESS_COMPUTER', '')
+THINK_TIME = float(os.environ.get('CHESS_THINK_TIME', 2))
+# opening book file built with book.py, the computer plays from it while the position is in the book
+BOOK = os.environ.get('CHESS_BOOK', '')
+# directory of endgame tables generated with tablebase.py, covered endgames are played from them
+TABLEBASES = os.environ.get('CHESS_TABLEBASES', '')
+# one of assets.PIECE_SETS, P switches sets while playing
+PIECE_SET = os.environ.get('CHESS_PIECE_SET', DEFAULT_SET)
+# pre-scaled piece images are kept here between runs, empty to always load the PNGs
+ATLAS_DIR = os.environ.get('CHESS_ATLAS_DIR', 'cache')
+piece_sets = PieceSetCache(atlas_dir=ATLAS_DIR)
+# 'process' runs move generation and the engine in a worker process, 'inline' in the game loop itself
+WORKER = os.environ.get('CHESS_WORKER', 'process')
+# '1' starts with the profiling overlay on (F3 toggles it, F4 exports), 'cprofile' also runs cProfile
+PROFILE = os.environ.get('CHESS_PROFILE', '')
+profiler = Profiler(use_cprofile=PROFILE == 'cprofile')
+screen = None
 colors = [pygame.Color('light gray'), pygame.Color('dark green')]
 clock = pygame.time.Clock()
 
@@ -33,400 +68,278 @@ def load_image(name, color_key=None):
     return image
 
 
-def load_piece_images():
-    pieces = ['wP', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK']
-    for piece in pieces:
-        PIECE_IMAGES[piece] = pygame.transform.scale(load_image(piece + '.png', -1), (TILE_SIZE, TILE_SIZE))
+def load_piece_set(name):
+    # Only the default size is worth an atlas on disk, other sizes come and go while the window is dragged.
+    images = piece_sets.get(name, TILE_SIZE, persist=TILE_SIZE == WIDTH // NUMBER)
+    source, elapsed = piece_sets.last_load
+    if source in ('png', 'atlas'):
+        print('piece set {} loaded from {} in {:.1f} ms'.format(name, source, elapsed * 1000))
+    return images
 
 
-class Board:
+def fit_board(size):
+    """Size and place the board for a window of `size`: the largest that fits, centered."""
+    global TILE_SIZE, BOARD_LEFT, BOARD_TOP
+    width, height = size
+    TILE_SIZE = max(MIN_TILE_SIZE, min(width, height) // NUMBER)
+    BOARD_LEFT = max(0, (width - TILE_SIZE * NUMBER) // 2)
+    BOARD_TOP = max(0, (height - TILE_SIZE * NUMBER) // 2)
+
+
+def resize_window(size):
+    global screen
+    fit_board(size)
+    # pygame 2 resizes the display surface by itself, older versions need set_mode.
+    screen = pygame.display.get_surface()
+    if screen.get_size() != tuple(size):
+        screen = pygame.display.set_mode(size, pygame.RESIZABLE)
+
+
+def square_rect(row, col):
+    return pygame.Rect(BOARD_LEFT + col * TILE_SIZE, BOARD_TOP + row * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+
+
+def board_rect():
+    return pygame.Rect(BOARD_LEFT, BOARD_TOP, TILE_SIZE * NUMBER, TILE_SIZE * NUMBER)
+
+
+def board_square(position):
+    """(row, col) of the square at a window position, None outside the board."""
+    row, col = (position[1] - BOARD_TOP) // TILE_SIZE, (position[0] - BOARD_LEFT) // TILE_SIZE
+    return (row, col) if 0 <= row < NUMBER and 0 <= col < NUMBER else None
+
+
+def squares_under(rect):
+    first_row, first_col = (rect.top - BOARD_TOP) // TILE_SIZE, (rect.left - BOARD_LEFT) // TILE_SIZE
+    last_row, last_col = (rect.bottom - 1 - BOARD_TOP) // TILE_SIZE, (rect.right - 1 - BOARD_LEFT) // TILE_SIZE
+    return [(row, col) for row in range(max(0, first_row), min(NUMBER - 1, last_row) + 1)
+            for col in range(max(0, first_col), min(NUMBER - 1, last_col) + 1)]
 
-    def __init__(self, screen):
-        self.screen = screen
-        self.white_to_move = True
-        self.field = [
-            ['bR', 'bN', 'bB', 'bQ', 'bK', 'bB', 'bN', 'bR'],
-            ['bP', 'bP', 'bP', 'bP', 'bP', 'bP', 'bP', 'bP'],
-            ['--', '--', '--', '--', '--', '--', '--', '--'],
-            ['--', '--', '--', '--', '--', '--', '--', '--'],
-            ['--', '--', '--', '--', '--', '--', '--', '--'],
-            ['--', '--', '--', '--', '--', '--', '--', '--'],
-            ['wP', 'wP', 'wP', 'wP', 'wP', 'wP', 'wP', 'wP'],
-            ['wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR'],
-        ]
-        self.move_log = []
-        self.move_functions = {'P': self.get_pawn_moves, 'R': self.get_rook_moves, 'N': self.get_knight_moves,
-                               'B': self.get_bishop_moves, 'Q': self.get_queen_moves, 'K': self.get_king_moves}
-
-        self.white_king_location = (7, 4)
-        self.black_king_location = (0, 4)
-
-        self.checkmate = False
-        self.stale_mate = False
-
-        self.enpassant_possible = ()
-
-        self.current_castling_rights = CastleRights(True, True, True, True)
-        self.castle_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                               self.current_castling_rights.wqs, self.current_castling_rights.bqs)]
-
-    '''darkslategray1 cyan3'''
-
-    def draw_board(self, screen):
-        for row in range(NUMBER):
-            for col in range(NUMBER):
-                color = colors[((row + col) % 2)]
-                pygame.draw.rect(screen, color, pygame.Rect(col * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE))
 
-    def draw_pieces(self, screen):
+class Animation:
+    """The moved piece on its way from the start to the end square of `move`, `duration` seconds from `start`."""
+
+    def __init__(self, move, start, duration):
+        self.move = move
+        # The board already holds the position after the move; until the piece arrives the end square
+        # still shows what was captured there.
+        self.captured = move.piece_captured if not move.is_enpassant_move else '--'
+        self.start = start
+        self.duration = duration
+        self.rect = None
+
+    def piece_rect(self, now):
+        """Where the piece is drawn at `now`, None once it has arrived."""
+        progress = (now - self.start) / self.duration if self.duration > 0 else 1
+        if progress >= 1:
+            return None
+        # Ease out, so the piece lands gently.
+        progress = 1 - (1 - progress) ** 2
+        move = self.move
+        row = move.start_row + (move.end_row - move.start_row) * progress
+        col = move.start_col + (move.end_col - move.start_col) * progress
+        return pygame.Rect(BOARD_LEFT + round(col * TILE_SIZE), BOARD_TOP + round(row * TILE_SIZE), TILE_SIZE,
+                           TILE_SIZE)
+
+
+class Renderer:
+    """Draws boards into `screen`, repainting only the squares that changed since the last frame.
+
+    render() returns the dirty rectangles for pygame.display.update(); an idle frame returns none.
+    """
+
+    def __init__(self, screen, pieces):
+        self.screen = screen
+        self.pieces = pieces
+        self.drawn_pieces = None
+        self.backgrounds = OrderedDict()
+        self.background = None
+        self.shown = [None] * (NUMBER * NUMBER)
+        self.exposed = []
+        self.message = None
+        self.highlights = {}
+        self.tile_size = None
+        self.animation = None
+        self.resize(screen, pieces)
+
+    def resize(self, screen, pieces):
+        """Switch to a new window surface and pieces scaled for the current TILE_SIZE."""
+        self.screen = screen
+        self.pieces = pieces
+        if self.tile_size != TILE_SIZE:
+            self.tile_size = TILE_SIZE
+            for name in ('blue', 'yellow'):
+                surface = pygame.Surface((TILE_SIZE, TILE_SIZE))
+                surface.set_alpha(100)
+                surface.fill(pygame.Color(name))
+                self.highlights[name] = surface
+
+    def get_background(self):
+        """The empty board and margins in the current colors, rendered once per color scheme and window size."""
+        key = (tuple(tuple(color) for color in colors), self.screen.get_size(), TILE_SIZE)
+        if key in self.backgrounds:
+            self.backgrounds.move_to_end(key)
+        else:
+            surface = pygame.Surface(self.screen.get_size())
+            surface.fill(MARGIN_COLOR)
+            for row in range(NUMBER):
+                for col in range(NUMBER):
+                    pygame.draw.rect(surface, colors[(row + col) % 2], square_rect(row, col))
+            self.backgrounds[key] = surface
+            if len(self.backgrounds) > BACKGROUND_CACHE:
+                self.backgrounds.popitem(last=False)
+        return self.backgrounds[key]
+
+    def invalidate(self):
+        self.shown = [None] * (NUMBER * NUMBER)
+
+    def invalidate_rect(self, rect):
+        """Repaint whatever is under `rect` on the next render, e.g. after an overlay was drawn there."""
+        self.exposed.append(rect)
+        for row, col in squares_under(rect):
+            self.shown[row * NUMBER + col] = None
+
+    def draw_square(self, row, col, piece, highlight=None):
+        rect = square_rect(row, col)
+        self.screen.blit(self.background, rect, rect)
+        if highlight is not None:
+            self.screen.blit(self.highlights[highlight], rect)
+        if piece != '--':
+            self.screen.blit(self.pieces[piece], rect)
+        return rect
+
+    def get_highlights(self, board, selected_square, valid_moves):
+        if selected_square == () or valid_moves is None:
+            return {}
+        row, col = selected_square
+        if board.field[row][col][0] != ('w' if board.white_to_move else 'b'):
+            return {}
+        highlights = {(row, col): 'blue'}
+        for move in valid_moves.moves_from(row, col):
+            highlights[(move.end_row, move.end_col)] = 'yellow'
+        return highlights
+
+    def start_animation(self, move, now=None, duration=None):
+        """Slide the piece of `move`, already made on the board, over the frames rendered from now on."""
+        self.stop_animation()
+        self.animation = Animation(move, time.perf_counter() if now is None else now,
+                                   ANIMATION_TIME if duration is None else duration)
+
+    def stop_animation(self):
+        """Put an animated piece straight on its end square."""
+        if self.animation is not None:
+            if self.animation.rect is not None:
+                self.invalidate_rect(self.animation.rect)
+            self.animation = None
+
+    def render(self, board, selected_square=(), valid_moves=None, message=None, now=None):
+        background = self.get_background()
+        rects = []
+        if background is not self.background:
+            self.exposed = [self.screen.get_rect()]
+        if background is not self.background or self.pieces is not self.drawn_pieces or message != self.message:
+            self.background = background
+            self.drawn_pieces = self.pieces
+            self.message = message
+            self.invalidate()
+        for rect in self.exposed:
+            rects.append(self.screen.blit(background, rect, rect))
+        self.exposed = []
+        highlights = self.get_highlights(board, selected_square, valid_moves)
+        animation = self.animation
+        covered = {}
+        if animation is not None:
+            # The squares under the piece in the last frame are repainted, the piece is drawn over the board.
+            piece_rect = animation.piece_rect(time.perf_counter() if now is None else now)
+            if animation.rect is not None:
+                for row, col in squares_under(animation.rect):
+                    self.shown[row * NUMBER + col] = None
+            if piece_rect is None:
+                self.animation = animation = None
+            else:
+                covered[animation.move.end_row, animation.move.end_col] = animation.captured
         for row in range(NUMBER):
             for col in range(NUMBER):
-                piece = self.field[row][col]
-                if piece != '--':
-                    screen.blit(PIECE_IMAGES[piece], pygame.Rect(col * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE
-                                                                 ))
-
-    def highlight_squares(self, screen, selected_square, valid_moves):
-        if selected_square != ():
-            row, col = selected_square
-            if self.field[row][col][0] == ('w' if self.white_to_move else 'b'):
-                s = pygame.Surface((TILE_SIZE, TILE_SIZE))
-                s.set_alpha(100)
-                s.fill(pygame.Color('blue'))
-                screen.blit(s, (col * TILE_SIZE, row * TILE_SIZE))
-                for move in valid_moves:
-                    if move.start_row == row and move.start_col == col:
-                        s.fill(pygame.Color('yellow'))
-                        screen.blit(s, (move.end_col * TILE_SIZE, move.end_row * TILE_SIZE))
-
-    def move_animation(self, move, screen, clock):
+                state = (covered.get((row, col), board.field[row][col]), highlights.get((row, col)))
+                if self.shown[row * NUMBER + col] != state:
+                    self.shown[row * NUMBER + col] = state
+                    rects.append(self.draw_square(row, col, *state))
+        if animation is not None:
+            rects.append(self.screen.blit(self.pieces[animation.move.piece_moved], piece_rect))
+            animation.rect = piece_rect
+            for row, col in squares_under(piece_rect):
+                self.shown[row * NUMBER + col] = None
+        if message is not None and rects:
+            draw_text(self.screen, message)
+        return rects
+
+    def move_animation(self, board, move, clock):
+        """Slide the moved piece from its start to its end square, 10 frames per square, before returning."""
+        captured = Animation(move, 0, 0).captured
+
+        def restore(rect):
+            touched = []
+            for row, col in squares_under(rect):
+                piece = captured if (row, col) == (move.end_row, move.end_col) else board.field[row][col]
+                self.shown[row * NUMBER + col] = None
+                touched.append(self.draw_square(row, col, piece))
+            return touched
+
+        self.background = self.get_background()
         delta_row = move.end_row - move.start_row
         delta_col = move.end_col - move.start_col
         frames_per_square = 10
         frames_count = (abs(delta_row) + abs(delta_col)) * frames_per_square
+        previous = square_rect(move.start_row, move.start_col)
+        pygame.display.update(restore(previous) + restore(square_rect(move.end_row, move.end_col)))
         for frame in range(frames_count + 1):
             row, col = (move.start_row + delta_row * frame / frames_count,
                         move.start_col + delta_col * frame / frames_count)
-            self.draw_board(screen)
-            self.draw_pieces(screen)
-
-            color = colors[(move.end_row + move.end_col) % 2]
-            end_square = pygame.Rect(move.end_col * TILE_SIZE, move.end_row * TILE_SIZE, TILE_SIZE, TILE_SIZE)
-            pygame.draw.rect(screen, color, end_square)
-            if move.piece_captured != '--':
-                screen.blit(PIECE_IMAGES[move.piece_captured], end_square)
-            screen.blit(PIECE_IMAGES[move.piece_moved],
-                        pygame.Rect(col * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE))
-            pygame.display.flip()
+            rect = pygame.Rect(BOARD_LEFT + round(col * TILE_SIZE), BOARD_TOP + round(row * TILE_SIZE), TILE_SIZE,
+                               TILE_SIZE)
+            restore(previous)
+            self.screen.blit(self.pieces[move.piece_moved], rect)
+            pygame.display.update(previous.union(rect))
+            previous = rect
             clock.tick(60)
 
-    def move(self, move):
-        self.field[move.start_row][move.start_col] = '--'
-        self.field[move.end_row][move.end_col] = move.piece_moved
-        self.move_log.append(move)
-        self.white_to_move = not self.white_to_move
-        if move.piece_moved == 'wK':
-            self.white_king_location = (move.end_row, move.end_col)
-        elif move.piece_moved == 'bK':
-            self.black_king_location = (move.end_row, move.end_col)
 
-        if move.is_pawn_promoted:
-            self.field[move.end_row][move.end_col] = move.piece_moved[0] + 'Q'
+class Board(chess_engine.Board):
 
-        if move.is_enpassant_move:
-            self.field[move.start_row][move.end_col] = '--'
+    def __init__(self, screen, fen=START_FEN):
+        super().__init__(fen)
+        self.screen = screen
 
-        if move.piece_moved[1] == 'P' and abs(move.end_row - move.start_row) == 2:
-            self.enpassant_possible = ((move.start_row + move.end_row) // 2, move.start_col)
-        else:
-            self.enpassant_possible = ()
 
-        if move.is_castle_move:
-            if move.end_col - move.start_col == 2:
-                self.field[move.end_row][move.end_col - 1] = self.field[move.end_row][move.end_col + 1]
-                self.field[move.end_row][move.end_col + 1] = '--'
-            else:
-                self.field[move.end_row][move.end_col + 1] = self.field[move.end_row][move.end_col - 2]
-                self.field[move.end_row][move.end_col - 2] = '--'
-
-        self.update_castle_rights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                                   self.current_castling_rights.wqs, self.current_castling_rights.bqs))
-
-    def cancel_move(self):
-        if len(self.move_log) != 0:
-            move = self.move_log.pop()
-            self.field[move.start_row][move.start_col] = move.piece_moved
-            self.field[move.end_row][move.end_col] = move.piece_captured
-            self.white_to_move = not self.white_to_move
-            if move.piece_moved == 'wK':
-                self.white_king_location = (move.start_row, move.start_col)
-            elif move.piece_moved == 'bK':
-                self.black_king_location = (move.start_row, move.start_col)
-            if move.is_enpassant_move:
-                self.field[move.end_row][move.end_col] = '--'
-                self.field[move.start_row][move.end_col] = move.piece_captured
-                self.enpassant_possible = (move.end_row, move.end_col)
-            if move.piece_moved[1] == 'P' and abs(move.start_row - move.end_row) == 2:
-                self.enpassant_possible = ()
-
-            self.castle_rights_log.pop()
-            new_rights = self.castle_rights_log[-1]
-            self.current_castling_rights = CastleRights(new_rights.wks, new_rights.bks, new_rights.wqs, new_rights.bks)
-            if move.is_castle_move:
-                if move.end_col - move.start_col == 2:
-                    self.field[move.end_row][move.end_col + 1] = self.field[move.end_row][move.end_col - 1]
-                    self.field[move.end_row][move.end_col - 1] = '--'
-                else:
-                    self.field[move.end_row][move.end_col - 2] = self.field[move.end_row][move.end_col + 1]
-                    self.field[move.end_row][move.end_col + 1] = '--'
-
-    def update_castle_rights(self, move):
-        if move.piece_moved == 'wK':
-            self.current_castling_rights.wks = False
-            self.current_castling_rights.wqs = False
-        elif move.piece_moved == 'bK':
-            self.current_castling_rights.bks = False
-            self.current_castling_rights.bqs = False
-        elif move.piece_moved == 'wR':
-            if move.start_row == 7:
-                if move.start_col == 0:
-                    self.current_castling_rights.wqs = False
-                elif move.start_col == 7:
-                    self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bR':
-            if move.start_row == 0:
-                if move.start_col == 0:
-                    self.current_castling_rights.bqs = False
-                elif move.start_col == 7:
-                    self.current_castling_rights.bks = False
-
-    def get_valid_moves(self):
-        temp_enpassant_possible = self.enpassant_possible
-        temp_castle_rights = CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                          self.current_castling_rights.wqs, self.current_castling_rights.bqs)
-        moves = self.get_all_possible_moves()
-        if self.white_to_move:
-            self.get_castle_moves(self.white_king_location[0], self.white_king_location[1], moves)
-        else:
-            self.get_castle_moves(self.black_king_location[0], self.black_king_location[1], moves)
-
-        for i in range(len(moves) - 1, -1, -1):
-            self.move(moves[i])
-
-            self.white_to_move = not self.white_to_move
-            if self.in_check():
-                moves.remove(moves[i])
-            self.white_to_move = not self.white_to_move
-            self.cancel_move()
-        if len(moves) == 0:
-            if self.in_check():
-                self.checkmate = True
-            else:
-                self.stale_mate = True
-        else:
-            self.checkmate = False
-            self.stale_mate = False
+class FastBoard(BitBoard):
 
-        self.enpassant_possible = temp_enpassant_possible
-        self.current_castling_rights = temp_castle_rights
-        return moves
+    def __init__(self, screen, fen=START_FEN):
+        super().__init__(fen)
+        self.screen = screen
 
-    def in_check(self):
-        if self.white_to_move:
-            return self.square_under_attack(self.white_king_location[0], self.white_king_location[1])
-        else:
-            return self.square_under_attack(self.black_king_location[0], self.black_king_location[1])
-
-    def square_under_attack(self, row, col):
-        self.white_to_move = not self.white_to_move
-        opp_moves = self.get_all_possible_moves()
-        self.white_to_move = not self.white_to_move
-        for move in opp_moves:
-            if move.end_row == row and move.end_col == col:
-                return True
-        return False
-
-    def get_all_possible_moves(self):
-        moves = []
-        for row in range(len(self.field)):
-            for col in range(len(self.field[row])):
-                turn = self.field[row][col][0]
-                if (turn == 'w' and self.white_to_move) or (turn == 'b' and not self.white_to_move):
-                    piece = self.field[row][col][1]
-                    self.move_functions[piece](row, col, moves)
-        return moves
-
-    def get_pawn_moves(self, row, col, moves):
-        if self.white_to_move:
-            if self.field[row - 1][col] == '--':
-                moves.append(Move((row, col), (row - 1, col), self.field))
-                if row == 6 and self.field[row - 2][col] == '--':
-                    moves.append(Move((row, col), (row - 2, col), self.field))
-            if col - 1 >= 0:
-                if self.field[row - 1][col - 1][0] == 'b':
-                    moves.append(Move((row, col), (row - 1, col - 1), self.field))
-                elif (row - 1, col - 1) == self.enpassant_possible:
-                    moves.append(Move((row, col), (row - 1, col - 1), self.field, is_enpassant_move=True))
-            if col + 1 <= 7:
-                if self.field[row - 1][col + 1][0] == 'b':
-                    moves.append(Move((row, col), (row - 1, col + 1), self.field))
-                elif (row - 1, col + 1) == self.enpassant_possible:
-                    moves.append(Move((row, col), (row - 1, col + 1), self.field, is_enpassant_move=True))
-        else:
-            if self.field[row + 1][col] == '--':
-                moves.append(Move((row, col), (row + 1, col), self.field))
-                if row == 1 and self.field[row + 2][col] == '--':
-                    moves.append(Move((row, col), (row + 2, col), self.field))
-            if col - 1 >= 0:
-                if self.field[row + 1][col - 1][0] == 'w':
-                    moves.append(Move((row, col), (row + 1, col - 1), self.field))
-                elif (row + 1, col - 1) == self.enpassant_possible:
-                    moves.append(Move((row, col), (row + 1, col - 1), self.field, is_enpassant_move=True))
-            if col + 1 <= 7:
-                if self.field[row + 1][col + 1][0] == 'w':
-                    moves.append(Move((row, col), (row + 1, col + 1), self.field))
-                elif (row + 1, col + 1) == self.enpassant_possible:
-                    moves.append(Move((row, col), (row + 1, col + 1), self.field, is_enpassant_move=True))
-
-    def get_rook_moves(self, row, col, moves):
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
-        enemy_color = 'b' if self.white_to_move else 'w'
-        for d in directions:
-            for i in range(1, 8):
-                end_row = row + (d[0] * i)
-                end_col = col + (d[1] * i)
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                    end_piece = self.field[end_row][end_col]
-                    if end_piece == '--':
-                        moves.append(Move((row, col), (end_row, end_col), self.field))
-                    elif end_piece[0] == enemy_color:
-                        moves.append(Move((row, col), (end_row, end_col), self.field))
-                        break
-                    else:
-                        break
-                else:
-                    break
-
-    def get_knight_moves(self, row, col, moves):
-        directions = ((-2, -1), (-2, 1), (2, -1), (2, 1), (1, 2), (1, -2), (-1, 2), (-1, -2))
-        ally_color = 'w' if self.white_to_move else 'b'
-        for d in directions:
-            end_row = row + d[0]
-            end_col = col + d[1]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.field[end_row][end_col]
-                if end_piece[0] != ally_color:
-                    moves.append(Move((row, col), (end_row, end_col), self.field))
-
-    def get_queen_moves(self, row, col, moves):
-        self.get_rook_moves(row, col, moves)
-        self.get_bishop_moves(row, col, moves)
-
-    def get_bishop_moves(self, row, col, moves):
-        directions = ((-1, -1), (1, -1), (1, 1), (-1, 1))
-        enemy_color = 'b' if self.white_to_move else 'w'
-        for d in directions:
-            for i in range(1, 8):
-                end_row = row + (d[0] * i)
-                end_col = col + (d[1] * i)
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                    end_piece = self.field[end_row][end_col]
-                    if end_piece == '--':
-                        moves.append(Move((row, col), (end_row, end_col), self.field))
-                    elif end_piece[0] == enemy_color:
-                        moves.append(Move((row, col), (end_row, end_col), self.field))
-                        break
-                    else:
-                        break
-                else:
-                    break
-
-    def get_king_moves(self, row, col, moves):
-        directions = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
-        ally_color = 'w' if self.white_to_move else 'b'
-        for i in range(8):
-            end_row = row + directions[i][0]
-            end_col = col + directions[i][1]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.field[end_row][end_col]
-                if end_piece[0] != ally_color:
-                    moves.append(Move((row, col), (end_row, end_col), self.field))
-
-    def get_castle_moves(self, row, col, moves):
-        if self.in_check():
-            return
-        if (self.white_to_move and self.current_castling_rights.wks) or \
-                (not self.white_to_move and self.current_castling_rights.bks):
-            self.get_kingside_castle_moves(row, col, moves)
-        if (self.white_to_move and self.current_castling_rights.wqs) or \
-                (not self.white_to_move and self.current_castling_rights.bqs):
-            self.get_queenside_castle_moves(row, col, moves)
-
-    def get_kingside_castle_moves(self, row, col, moves):
-        if self.field[row][col + 1] == '--' and self.field[row][col + 2] == '--':
-            if not self.square_under_attack(row, col + 1) and not self.square_under_attack(row, col + 2):
-                moves.append(Move((row, col), (row, col + 2), self.field, is_castle_move=True))
-
-    def get_queenside_castle_moves(self, row, col, moves):
-        if self.field[row][col - 1] == '--' and self.field[row][col - 2] == '--':
-            if not self.square_under_attack(row, col - 1) and not self.square_under_attack(row, col - 2):
-                moves.append(Move((row, col), (row, col - 2), self.field, is_castle_move=True))
-
-
-class CastleRights:
-
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
-
-
-class Move:
-    ranks_to_rows = {'1': 7, '2': 6, '3': 5, '4': 4,
-                     '5': 3, '6': 2, '7': 1, '8': 0}
-    rows_to_ranks = {v: k for k, v in ranks_to_rows.items()}
-
-    files_to_cols = {'a': 0, 'b': 1, 'c': 2, 'd': 3, 'e': 4,
-                     'f': 5, 'g': 6, 'h': 7}
-    cols_to_files = {v: k for k, v in files_to_cols.items()}
-
-    def __init__(self, start_sq, end_sq, board, is_enpassant_move=False, is_castle_move=False):
-        self.start_row = start_sq[0]
-        self.start_col = start_sq[1]
-        self.end_row = end_sq[0]
-        self.end_col = end_sq[1]
-        self.piece_moved = board[self.start_row][self.start_col]
-        self.piece_captured = board[self.end_row][self.end_col]
-        self.move_ID = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
-        self.is_pawn_promoted = (self.piece_moved == 'wP' and self.end_row == 0) or \
-                                (self.piece_moved == 'bP' and self.end_row == 7)
-
-        self.is_enpassant_move = is_enpassant_move
-        if self.is_enpassant_move:
-            self.piece_captured = 'wP' if self.piece_moved == 'bP' else 'bP'
-
-        self.is_castle_move = is_castle_move
-
-    def __eq__(self, other):
-        if isinstance(other, Move):
-            return self.move_ID == other.move_ID
-
-    def get_chess_notation(self):
-        return self.piece_moved[1] + self.get_rank_file(self.start_row, self.start_col) + \
-               self.get_rank_file(self.end_row, self.end_col)
-
-    def get_rank_file(self, row, col):
-        return self.cols_to_files[col] + self.rows_to_ranks[row]
+
+def new_board(screen, fen=START_FEN, backend=None):
+    if (backend or BACKEND) == 'bitboard':
+        return FastBoard(screen, fen)
+    return Board(screen, fen)
 
 
 def draw_text(screen, text):
-    font = pygame.font.SysFont('Helvitca', 32, True, False)
+    font = pygame.font.SysFont('Helvitca', TILE_SIZE // 2, True, False)
     text_object = font.render(text, 0, pygame.Color('black'))
-    text_pos = pygame.Rect(0, 0, WIDTH, HEIGHT).move((WIDTH / 2 - text_object.get_width() / 2),
-                                                     (HEIGHT / 2 - text_object.get_height() / 2))
-    screen.blit(text_object, text_pos)
+    screen.blit(text_object, text_object.get_rect(center=board_rect().center))
+
+
+def draw_thinking(screen):
+    """A 'thinking' label with moving dots in the bottom right corner; returns its rectangle."""
+    font = pygame.font.SysFont('Helvitca', 24, True, False)
+    text = font.render('thinking' + '.' * (int(time.perf_counter() * 3) % 4), True, pygame.Color('white'))
+    rect = pygame.Rect(0, 0, font.size('thinking...')[0] + 12, text.get_height() + 6)
+    rect.bottomright = board_rect().bottomright
+    panel = pygame.Surface(rect.size, pygame.SRCALPHA)
+    panel.fill((0, 0, 0, 150))
+    panel.blit(text, (6, 3))
+    return screen.blit(panel, rect)
 
 
 def terminate():
@@ -440,7 +353,7 @@ def start_screen():
                   "А затем нажмите на поле,", "",
                   "на которое хотите походить", "",
                   "Для изменения цвета доски,", "",
-                  "Нажмите 1, 2 или 3", "",
+                  "Нажмите 1, 2 или 3 (фигуры: P)", "",
                   "Остальные правила такие же,", "",
                   "как в стандартных шахматах"]
 
@@ -468,36 +381,85 @@ def start_screen():
         clock.tick(MAX_FPS)
 
 
-start_screen()
+def init_window():
+    global screen
+    pygame.init()
+    pygame.mixer.music.load("data/sound.mp3")
+    pygame.mixer.music.play(-1)
+    screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.RESIZABLE)
+
+
+def is_computer_turn(board, computer):
+    return computer == ('white' if board.white_to_move else 'black')
+
+
+def instrument(profiler):
+    for board_class in (chess_engine.Board, BitBoard):
+        profiler.instrument(board_class, 'get_valid_moves', 'square_under_attack', 'move', 'cancel_move')
+    profiler.instrument(Renderer, 'render', 'draw_square', 'get_highlights', 'move_animation',
+                        'start_animation')
+    profiler.instrument(sys.modules[__name__], 'draw_text', prefix='main')
 
 
-def main():
+def export_profile():
+    print('profile written to', ', '.join(profiler.export()))
+
+
+def main(computer=COMPUTER):
     global colors
     pygame.init()
     pygame.display.set_caption('Chess')
     clock = pygame.time.Clock()
-    screen.fill(pygame.Color('white'))
-    board = Board(screen)
-    load_piece_images()
-    valid_moves = board.get_valid_moves()
+    fit_board(screen.get_size())
+    board = new_board(screen)
+    piece_set = PIECE_SET
+    renderer = Renderer(screen, load_piece_set(piece_set))
+    worker = BackgroundWorker(BACKEND, BOOK, TABLEBASES, process=WORKER == 'process')
+    worker.request_moves(board)
+    valid_moves = None
     move_made = False
     animate = False
     game_over = False
+    message = None
 
     running = True
 
     selected_square = ()
     player_clicks = []
+    overlay_rects = []
+    window_size = None
+    instrument(profiler)
+    if PROFILE:
+        profiler.enable()
 
     while running:
+        frame_start = time.perf_counter()
         for event in pygame.event.get():
+            if event.type in (pygame.MOUSEBUTTONDOWN, pygame.KEYDOWN):
+                renderer.stop_animation()
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.VIDEORESIZE:
+                # Dragging sends many of these; only the last one of a frame is applied.
+                window_size = event.size
+            elif event.type == WORKER_EVENT:
+                if not worker.accept(event):
+                    continue
+                if event.kind == 'moves':
+                    valid_moves = moves_from_codes(event.codes)
+                    board.checkmate, board.stale_mate = event.checkmate, event.stale_mate
+                else:
+                    move = find_code(valid_moves, event.code)
+                    print('{} (score {}, depth {})'.format(move.get_chess_notation(), event.score, event.depth))
+                    board.move(move)
+                    move_made = True
+                    animate = True
             elif event.type == pygame.MOUSEBUTTONDOWN:
-                if not game_over:
-                    position = pygame.mouse.get_pos()
-                    col = position[0] // TILE_SIZE
-                    row = position[1] // TILE_SIZE
+                if not game_over and valid_moves is not None and not is_computer_turn(board, computer):
+                    square = board_square(pygame.mouse.get_pos())
+                    if square is None:
+                        continue
+                    row, col = square
 
                     if selected_square == (row, col):
                         selected_square = ()
@@ -506,57 +468,93 @@ def main():
                         selected_square = (row, col)
                         player_clicks.append(selected_square)
                     if len(player_clicks) == 2:
-                        move = Move(player_clicks[0], player_clicks[1], board.field)
-                        print(move.get_chess_notation())
-                        for i in range(len(valid_moves)):
-                            if move == valid_moves[i]:
-                                board.move(valid_moves[i])
-                                move_made = True
-                                animate = True
-                                selected_square = ()
-                                player_clicks = []
-                        if not move_made:
+                        move = valid_moves.find(player_clicks[0], player_clicks[1])
+                        if move is not None:
+                            print(move.get_chess_notation())
+                            board.move(move)
+                            move_made = True
+                            animate = True
+                            selected_square = ()
+                            player_clicks = []
+                        else:
                             player_clicks = [selected_square]
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_z:
+                    worker.cancel()
                     board.cancel_move()
+                    if is_computer_turn(board, computer):
+                        board.cancel_move()
                     move_made = True
                     animate = False
+                    game_over = False
+                    message = None
                 if event.key == pygame.K_r:
-                    board = Board(screen)
-                    valid_moves = board.get_valid_moves()
-                    move_made = False
+                    worker.cancel()
+                    board = new_board(screen)
+                    move_made = True
                     animate = False
                     game_over = False
+                    message = None
                 if event.key == pygame.K_1:
                     colors = [pygame.Color('light gray'), pygame.Color('dark green')]
                 if event.key == pygame.K_2:
                     colors = [pygame.Color('darkslategray1'), pygame.Color('cyan3')]
                 if event.key == pygame.K_3:
                     colors = [pygame.Color('darkorchid3'), pygame.Color('violetred4')]
-
+                if event.key == pygame.K_p:
+                    names = list(PIECE_SETS)
+                    piece_set = names[(names.index(piece_set) + 1) % len(names)]
+                    renderer.pieces = load_piece_set(piece_set)
+                if event.key == pygame.K_F3:
+                    profiler.toggle()
+                if event.key == pygame.K_F4:
+                    export_profile()
+
+        if window_size is not None:
+            resize_window(window_size)
+            renderer.resize(screen, load_piece_set(piece_set))
+            window_size = None
         if move_made:
-            if animate:
-                board.move_animation(board.move_log[-1], screen, clock)
-            valid_moves = board.get_valid_moves()
+            if animate and ANIMATION == 'timed':
+                renderer.start_animation(board.move_log[-1])
+            elif animate and ANIMATION == 'frames':
+                renderer.move_animation(board, board.move_log[-1], clock)
+            # Until the worker answers there are no legal moves to click and the game end is unknown.
+            valid_moves = None
+            board.checkmate = board.stale_mate = False
+            worker.request_moves(board)
             move_made = False
             animate = False
-        board.draw_board(screen)
-        board.highlight_squares(screen, selected_square, valid_moves)
-        board.draw_pieces(screen)
+        if not game_over and valid_moves and not worker.busy and is_computer_turn(board, computer):
+            worker.request_search(board, THINK_TIME)
         if board.checkmate:
             game_over = True
-            if not board.white_to_move:
-                draw_text(screen, 'white wins')
-            else:
-                draw_text(screen, 'black wins')
+            message = 'white wins' if not board.white_to_move else 'black wins'
         elif board.stale_mate:
             game_over = True
-            draw_text(screen, 'Stalemate')
-        clock.tick(MAX_FPS)
-        pygame.display.flip()
+            message = 'Stalemate'
+        # Overlays are drawn over the board every frame, so the squares under last frame's are repainted.
+        for rect in overlay_rects:
+            renderer.invalidate_rect(rect)
+        dirty_rects = renderer.render(board, selected_square, valid_moves, message)
+        overlay_rects = []
+        if worker.thinking():
+            overlay_rects.append(draw_thinking(screen))
+        if profiler.enabled:
+            overlay_rects.append(profiler.draw_overlay(screen, clock.get_fps()))
+        dirty_rects += overlay_rects
+        if dirty_rects:
+            pygame.display.update(dirty_rects)
+        profiler.frame(time.perf_counter() - frame_start)
+        clock.tick(ANIMATION_FPS if renderer.animation is not None else MAX_FPS)
+    worker.close()
+    if profiler.enabled:
+        export_profile()
+        profiler.disable()
     pygame.quit()
 
 
 if __name__ == '__main__':
+    init_window()
+    start_screen()
     main()
@@ -0,0 +1,159 @@
+"""Lazy-SMP search: several processes search the same position and share one transposition table.
+
+Positions go to the workers as a FEN plus the Zobrist keys of the game so far (for repetitions),
+never as pickled Board objects.
+
+    python parallel.py --fen "<FEN>" --time 5 --workers 4
+    python parallel.py --bench --depth 5 --workers 1,2,4
+"""
+import argparse
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+from bitboard import BitBoard
+from chess_engine import START_FEN, make_board
+from search import SQUARES_MASK, SearchResult, Searcher
+
+# Every slot is two unsigned 64-bit words: key ^ data and data. A torn write from another process
+# then fails the key check instead of returning a mixed-up entry, so no locks are needed.
+SLOT_WORDS = 2
+SCORE_OFFSET = 1 << 31
+
+
+class SharedTranspositionTable:
+    """TranspositionTable with the same probe/store interface, kept in shared memory."""
+
+    def __init__(self, size=1 << 18, name=None):
+        self.size = size
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=size * SLOT_WORDS * 8)
+            self.memory.buf[:] = bytes(len(self.memory.buf))
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.slots = self.memory.buf.cast('Q')
+        self.age = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def probe(self, key):
+        index = (key % self.size) * SLOT_WORDS
+        data = self.slots[index + 1]
+        if data and self.slots[index] ^ data == key:
+            return (key, data & 0xFF, (data >> 8) & 0x3, (data >> 32) - SCORE_OFFSET, (data >> 18) & 0x3FFF or None,
+                    (data >> 10) & 0xFF)
+        return None
+
+    def store(self, key, depth, flag, score, move_id):
+        index = (key % self.size) * SLOT_WORDS
+        old = self.slots[index + 1]
+        if old and self.slots[index] ^ old != key and (old >> 10) & 0xFF == self.age and depth < old & 0xFF:
+            return
+        data = (min(max(depth, 0), 0xFF) | flag << 8 | self.age << 10 | (move_id or 0) << 18 |
+                (score + SCORE_OFFSET) << 32)
+        self.slots[index] = key ^ data
+        self.slots[index + 1] = data
+
+    def new_search(self):
+        self.age = (self.age + 1) & 0xFF
+
+    def clear(self):
+        self.memory.buf[:] = bytes(len(self.memory.buf))
+        self.age = 0
+
+    def close(self):
+        self.slots.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+_searcher = None
+
+
+def _init_worker(tt_name, tt_size, stop_event):
+    global _searcher
+    _searcher = Searcher(tt=SharedTranspositionTable(tt_size, tt_name), stop_event=stop_event)
+
+
+def _search_worker(fen, history, time_limit, max_depth, worker_index):
+    board = make_board(fen, history=history)
+    # Helpers skip the shallow iterations so they fill the table ahead of the main worker instead of
+    # repeating its work move for move.
+    result = _searcher.search(board, time_limit, max_depth, start_depth=1 + worker_index % 2)
+    move_id = result.best_move.code & SQUARES_MASK if result.best_move else None
+    return worker_index, move_id, result.score, result.depth, result.nodes
+
+
+class ParallelSearcher:
+    """Runs Searcher in `workers` processes on one shared transposition table. Close it when done."""
+
+    def __init__(self, workers=None, tt_size=1 << 18):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.tt = SharedTranspositionTable(tt_size)
+        self.stop_event = multiprocessing.Event()
+        self.pool = multiprocessing.Pool(self.workers, _init_worker, (self.tt.name, tt_size, self.stop_event))
+
+    def search(self, board, time_limit=2.0, max_depth=64):
+        start = time.perf_counter()
+        fen = board.get_fen()
+        history = board.key_log[:-1]
+        self.stop_event.clear()
+        jobs = [self.pool.apply_async(_search_worker, (fen, history, time_limit, max_depth, i))
+                for i in range(self.workers)]
+        # The main worker decides when the search is over; helpers are stopped as soon as it returns.
+        results = [jobs[0].get()]
+        self.stop_event.set()
+        results += [job.get() for job in jobs[1:]]
+
+        best = max(results, key=lambda r: (r[3], r[0] == 0))
+        moves = {move.code & SQUARES_MASK: move for move in board.get_valid_moves()}
+        return SearchResult(moves.get(best[1]), best[2], best[3], sum(r[4] for r in results),
+                            time.perf_counter() - start)
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+        self.tt.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def benchmark(fen, depth, worker_counts):
+    """Time to reach `depth` for every worker count, with a fresh table each time."""
+    baseline = None
+    for workers in worker_counts:
+        with ParallelSearcher(workers) as searcher:
+            result = searcher.search(BitBoard(fen), time_limit=10 ** 6, max_depth=depth)
+        baseline = baseline or result.elapsed
+        print('{:2} workers: depth {} in {:7.2f}s  {:8} nodes  {:7.0f} nodes/sec  speedup {:.2f}x'.format(
+            workers, result.depth, result.elapsed, result.nodes, result.nps, baseline / result.elapsed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parallel (Lazy SMP) search.')
+    parser.add_argument('--fen', default=START_FEN)
+    parser.add_argument('--time', type=float, default=5.0)
+    parser.add_argument('--depth', type=int, default=64)
+    parser.add_argument('--workers', default=str(multiprocessing.cpu_count()),
+                        help='worker count, or a comma separated list with --bench')
+    parser.add_argument('--bench', action='store_true', help='report time to depth for every worker count')
+    args = parser.parse_args(argv)
+
+    worker_counts = [int(count) for count in args.workers.split(',')]
+    if args.bench:
+        benchmark(args.fen, args.depth if args.depth != 64 else 5, worker_counts)
+        return
+    with ParallelSearcher(worker_counts[0]) as searcher:
+        print(searcher.search(BitBoard(args.fen), args.time, args.depth))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Perft: count the leaf nodes of the legal move tree to check and benchmark move generation.
+
+    python perft.py --position kiwipete --depth 3 --divide
+    python perft.py --fen "8/8/8/8/8/8/8/K6k w - - 0 1" --depth 4 --backend field
+    python perft.py --verify --max-nodes 200000
+"""
+import argparse
+import sys
+import time
+
+from chess_engine import START_FEN, make_board
+
+# Reference counts from https://www.chessprogramming.org/Perft_Results.
+# Board always promotes to a queen, so only depths without promotions are listed.
+POSITIONS = {
+    'start': (START_FEN, [20, 400, 8902, 197281, 4865609]),
+    'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', [48, 2039, 97862]),
+    'position3': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', [14, 191, 2812, 43238, 674624]),
+    'position4': ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', [6]),
+    'position6': ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10', [46, 2079, 89890]),
+}
+
+
+def perft(board, depth):
+    moves = board.get_valid_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        board.move(move)
+        nodes += perft(board, depth - 1)
+        board.cancel_move()
+    return nodes
+
+
+def divide(board, depth):
+    result = {}
+    for move in board.get_valid_moves():
+        board.move(move)
+        name = move.get_rank_file(move.start_row, move.start_col) + move.get_rank_file(move.end_row, move.end_col)
+        result[name] = perft(board, depth - 1) if depth > 1 else 1
+        board.cancel_move()
+    return result
+
+
+def run(board, depth, show_divide=False):
+    start = time.perf_counter()
+    if show_divide:
+        counts = divide(board, depth)
+        for name, count in counts.items():
+            print(name + ':', count)
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(board, depth)
+    elapsed = time.perf_counter() - start
+    print('depth {}: {} nodes in {:.3f}s ({:.0f} nodes/sec)'.format(depth, nodes, elapsed, nodes / max(elapsed, 1e-9)))
+    return nodes
+
+
+def verify(backend, max_nodes):
+    failures = 0
+    for name, (fen, expected_counts) in POSITIONS.items():
+        for depth, expected in enumerate(expected_counts, 1):
+            if expected > max_nodes:
+                break
+            board = make_board(fen, backend)
+            start = time.perf_counter()
+            nodes = perft(board, depth)
+            elapsed = time.perf_counter() - start
+            status = 'ok' if nodes == expected else 'FAIL (expected {})'.format(expected)
+            print('{:10} depth {}: {:8} nodes {:8.3f}s  {}'.format(name, depth, nodes, elapsed, status))
+            if nodes != expected:
+                failures += 1
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Perft move generation test and benchmark.')
+    parser.add_argument('--backend', choices=['bitboard', 'field'], default='bitboard')
+    parser.add_argument('--position', choices=sorted(POSITIONS), default='start')
+    parser.add_argument('--fen', help='custom position, overrides --position')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--divide', action='store_true', help='print the node count below every root move')
+    parser.add_argument('--verify', action='store_true', help='compare all positions against the reference counts')
+    parser.add_argument('--max-nodes', type=int, default=100000, help='skip reference depths larger than this')
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        failures = verify(args.backend, args.max_nodes)
+        print('all perft counts match' if not failures else '{} perft counts differ'.format(failures))
+        return 1 if failures else 0
+
+    fen = args.fen or POSITIONS[args.position][0]
+    run(make_board(fen, args.backend), args.depth, args.divide)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Streaming PGN reading and SAN move matching.
+
+read_games() yields one game at a time, so memory use depends on the longest game, not on the file size.
+
+The examples in the docstrings double as tests: python -m doctest pgn.py
+"""
+import re
+
+SAN_RE = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([QRBN]))?$')
+COORDINATE_RE = re.compile(r'^([a-h][1-8])([a-h][1-8])([qrbn])?$')
+TAG_RE = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$')
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+
+class PgnGame:
+
+    def __init__(self, headers, moves, result):
+        self.headers = headers
+        self.moves = moves
+        self.result = result
+
+
+def read_games(lines):
+    """Yield a PgnGame for every game in an iterable of PGN lines (an open file works)."""
+    headers = {}
+    movetext = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('[') and TAG_RE.match(line):
+            if movetext:
+                yield _make_game(headers, movetext)
+                headers = {}
+                movetext = []
+            match = TAG_RE.match(line)
+            headers[match.group(1)] = match.group(2)
+        elif line and not line.startswith('%'):
+            movetext.append(line)
+    if headers or movetext:
+        yield _make_game(headers, movetext)
+
+
+def _make_game(headers, movetext):
+    moves = []
+    result = headers.get('Result', '*')
+    # Lines stay apart, so a ';' comment ends with its line.
+    for token in tokenize_movetext('\n'.join(movetext)):
+        if token in RESULTS:
+            result = token
+        else:
+            moves.append(token)
+    return PgnGame(headers, moves, result)
+
+
+def tokenize_movetext(text):
+    r"""Split movetext into SAN tokens, dropping comments, variations, NAGs and move numbers.
+
+    >>> list(tokenize_movetext('1. e4 ; rest of the line\ne5 {a comment} 2. Nf3 (2. f4) $1 *'))
+    ['e4', 'e5', 'Nf3', '*']
+    >>> [game.moves for game in read_games(['1. e4 ; comment', 'e5 2. Nf3 *'])]
+    [['e4', 'e5', 'Nf3']]
+    """
+    text = re.sub(r'\{[^}]*\}|;[^\n]*', ' ', text)
+    depth = 0
+    cleaned = []
+    for char in text:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            cleaned.append(char)
+    for token in ''.join(cleaned).split():
+        token = re.sub(r'^\d+\.(\.\.)?', '', token)
+        if token and not token.startswith('$'):
+            yield token
+
+
+def find_move(san, moves):
+    """Return the move from `moves` (a get_valid_moves() list) written as `san`, or None.
+
+    Plain coordinates like e2e4 are accepted too. Board only promotes to a queen, so an
+    under-promotion never matches.
+    """
+    san = san.rstrip('+#!?')
+    if san in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        step = 2 if len(san) == 3 else -2
+        for move in moves:
+            if move.is_castle_move and move.end_col - move.start_col == step:
+                return move
+        return None
+
+    match = COORDINATE_RE.match(san)
+    if match:
+        if match.group(3) not in (None, 'q'):
+            return None
+        start, end = match.group(1), match.group(2)
+        for move in moves:
+            if move.get_rank_file(move.start_row, move.start_col) == start and \
+                    move.get_rank_file(move.end_row, move.end_col) == end:
+                return move
+        return None
+
+    match = SAN_RE.match(san)
+    if not match:
+        return None
+    piece, from_file, from_rank, end, promotion = match.groups()
+    if promotion not in (None, 'Q'):
+        return None
+    piece = piece or 'P'
+    found = []
+    for move in moves:
+        if move.piece_moved[1] != piece or move.get_rank_file(move.end_row, move.end_col) != end:
+            continue
+        if from_file and move.cols_to_files[move.start_col] != from_file:
+            continue
+        if from_rank and move.rows_to_ranks[move.start_row] != from_rank:
+            continue
+        found.append(move)
+    return found[0] if len(found) == 1 else None
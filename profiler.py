@@ -0,0 +1,223 @@
+"""Call counters, timers and frame-time histograms for the game, shown as an overlay.
+
+Methods are timed by swapping in wrappers while profiling is on and putting the originals back when it is
+off, so a disabled profiler costs nothing. In the game F3 (or CHESS_PROFILE=1) turns it on and F4 writes
+profile-<time>.json: the counters, the frame histogram and a Chrome trace of the most recent calls (open it
+in chrome://tracing or ui.perfetto.dev). With CHESS_PROFILE=cprofile a cProfile run goes along and is
+saved as profile-<time>.prof for pstats or snakeviz.
+
+    python profiler.py profile-20240101-120000.json
+"""
+import argparse
+import cProfile
+import functools
+import json
+import os
+import sys
+import time
+from collections import deque
+
+# Upper edges of the frame-time buckets in milliseconds; slower frames land in the last bucket.
+FRAME_BUCKETS = (2, 4, 8, 16, 33, 66, 133)
+OVERLAY_ROWS = 8
+
+
+def frame_bucket(milliseconds):
+    bucket = 0
+    while bucket < len(FRAME_BUCKETS) and milliseconds >= FRAME_BUCKETS[bucket]:
+        bucket += 1
+    return bucket
+
+
+def bucket_names():
+    edges = ['<{}'.format(edge) for edge in FRAME_BUCKETS]
+    return edges + ['{}+'.format(FRAME_BUCKETS[-1])]
+
+
+class Profiler:
+
+    def __init__(self, use_cprofile=False, trace_size=20000, recent_frames=240):
+        self.enabled = False
+        self.use_cprofile = use_cprofile
+        self.cprofile = None
+        self.targets = []
+        self.originals = {}
+        self.calls = {}
+        self.times = {}
+        self.trace = deque(maxlen=trace_size)
+        self.histogram = [0] * (len(FRAME_BUCKETS) + 1)
+        self.recent = deque(maxlen=recent_frames)
+        self.started = time.perf_counter()
+        self.overlay_rect = None
+        self.font = None
+
+    def instrument(self, owner, *names, prefix=None):
+        """Time `names` of a class or module, counted as prefix.name."""
+        prefix = prefix or owner.__name__
+        for name in names:
+            target = (owner, name, '{}.{}'.format(prefix, name))
+            self.targets.append(target)
+            if self.enabled:
+                self._patch(*target)
+
+    def _patch(self, owner, name, label):
+        original = owner.__dict__.get(name)
+        self.originals[owner, name] = original
+        setattr(owner, name, self._timed(getattr(owner, name), label))
+
+    def _timed(self, function, label):
+        calls, times, trace = self.calls, self.times, self.trace
+        clock = time.perf_counter
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                calls[label] = calls.get(label, 0) + 1
+                times[label] = times.get(label, 0) + elapsed
+                trace.append((label, start, elapsed))
+        return timed
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.reset()
+        self.enabled = True
+        for target in self.targets:
+            self._patch(*target)
+        if self.use_cprofile:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        for (owner, name), original in self.originals.items():
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        self.originals = {}
+        if self.cprofile is not None:
+            self.cprofile.disable()
+
+    def toggle(self):
+        self.disable() if self.enabled else self.enable()
+        return self.enabled
+
+    def reset(self):
+        self.calls.clear()
+        self.times.clear()
+        self.trace.clear()
+        self.histogram = [0] * (len(FRAME_BUCKETS) + 1)
+        self.recent.clear()
+        self.started = time.perf_counter()
+
+    def frame(self, seconds):
+        """Record the time one pass of the game loop took, without the wait for the next frame."""
+        if not self.enabled:
+            return
+        milliseconds = seconds * 1000
+        self.histogram[frame_bucket(milliseconds)] += 1
+        self.recent.append(milliseconds)
+
+    def summary(self):
+        frames = sorted(self.recent)
+
+        def percentile(p):
+            return frames[min(len(frames) - 1, len(frames) * p // 100)] if frames else 0
+
+        return {
+            'seconds': time.perf_counter() - self.started,
+            'frames': sum(self.histogram),
+            'frame_ms': {'p50': percentile(50), 'p95': percentile(95), 'max': frames[-1] if frames else 0},
+            'frame_histogram': dict(zip(bucket_names(), self.histogram)),
+            'timers': {label: {'calls': self.calls[label], 'total_ms': self.times[label] * 1000,
+                               'mean_us': self.times[label] / self.calls[label] * 1e6}
+                       for label in sorted(self.times, key=self.times.get, reverse=True)},
+        }
+
+    def export(self, directory='.'):
+        """Write the summary and trace as JSON, and the cProfile stats if there are any; returns the paths."""
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(directory, 'profile-{}.json'.format(stamp))
+        data = self.summary()
+        data['traceEvents'] = [{'name': label, 'ph': 'X', 'pid': 0, 'tid': 0,
+                                'ts': (start - self.started) * 1e6, 'dur': elapsed * 1e6}
+                               for label, start, elapsed in list(self.trace)]
+        with open(path, 'w') as file:
+            json.dump(data, file)
+        paths = [path]
+        if self.cprofile is not None:
+            paths.append(os.path.join(directory, 'profile-{}.prof'.format(stamp)))
+            self.cprofile.dump_stats(paths[-1])
+            if self.enabled:
+                self.cprofile.enable()
+        return paths
+
+    def overlay_lines(self, fps):
+        summary = self.summary()
+        frame = summary['frame_ms']
+        lines = ['fps {:4.1f}  frame p50 {:5.1f}  p95 {:5.1f}  max {:6.1f} ms'.format(
+            fps, frame['p50'], frame['p95'], frame['max'])]
+        for label, timer in list(summary['timers'].items())[:OVERLAY_ROWS]:
+            lines.append('{:26} {:7} {:9.1f} ms {:8.1f} us'.format(label, timer['calls'], timer['total_ms'],
+                                                                 timer['mean_us']))
+        return lines
+
+    def draw_overlay(self, screen, fps=0):
+        """Draw the overlay in the top left corner; returns its rectangle."""
+        import pygame
+
+        if self.font is None:
+            self.font = pygame.font.SysFont('monospace', 11)
+        lines = self.overlay_lines(fps)
+        line_height = self.font.get_linesize()
+        bar_height = 30
+        width = max(self.font.size(line)[0] for line in lines) + 8
+        height = line_height * len(lines) + bar_height + line_height + 8
+        panel = pygame.Surface((width, height), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 170))
+        for number, line in enumerate(lines):
+            panel.blit(self.font.render(line, True, (255, 255, 255)), (4, 4 + number * line_height))
+
+        # Histogram of the recent frames, one bar per bucket.
+        counts = [0] * len(self.histogram)
+        for milliseconds in self.recent:
+            counts[frame_bucket(milliseconds)] += 1
+        top = 4 + len(lines) * line_height
+        column = (width - 8) // len(counts)
+        for bucket, (count, name) in enumerate(zip(counts, bucket_names())):
+            bar = round(bar_height * count / max(1, max(counts)))
+            left = 4 + bucket * column
+            color = (90, 200, 90) if bucket < 4 else (230, 180, 60) if bucket < 6 else (230, 70, 70)
+            pygame.draw.rect(panel, color, (left, top + bar_height - bar, column - 2, bar))
+            panel.blit(self.font.render(name, True, (200, 200, 200)), (left, top + bar_height))
+        self.overlay_rect = screen.blit(panel, (0, 0))
+        return self.overlay_rect
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print a profile written by the game (F4).')
+    parser.add_argument('path')
+    parser.add_argument('--top', type=int, default=20, help='timers to list')
+    args = parser.parse_args(argv)
+    with open(args.path) as file:
+        data = json.load(file)
+    frame = data['frame_ms']
+    print('{} frames in {:.1f}s, frame p50 {:.1f} ms, p95 {:.1f} ms, max {:.1f} ms'.format(
+        data['frames'], data['seconds'], frame['p50'], frame['p95'], frame['max']))
+    print('  '.join('{} ms: {}'.format(name, count) for name, count in data['frame_histogram'].items()))
+    for label, timer in list(data['timers'].items())[:args.top]:
+        print('{:30} {:9} calls {:10.1f} ms {:10.1f} us/call'.format(label, timer['calls'], timer['total_ms'],
+                                                                    timer['mean_us']))
+    print('{} trace events'.format(len(data['traceEvents'])))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""Compact game records: 16-bit moves plus a position snapshot every few plies, and archives of them.
+
+A move is start square | end square << 6 | promotion << 12 (squares as row * 8 + col, promotion 4 for
+a queen as in book.py), 2 bytes. A snapshot is 34 bytes: the piece code of every square in a nibble,
+then side to move and castling rights, then the en passant square. Board.seek(record, ply) loads the
+nearest snapshot at or before `ply` and plays at most `interval - 1` moves from there.
+
+An archive is records back to back followed by an offset table, read through mmap, so game n of
+millions is found without reading the others.
+
+    python record.py pack games.pgn --output games.cgr
+    python record.py show games.cgr --game 12 --ply 40
+    python record.py --bench --games 200
+"""
+import argparse
+import mmap
+import os
+import pickle
+import random
+import struct
+import sys
+import time
+from array import array
+
+from chess_engine import PIECE_CODES, PIECE_NAMES, START_FEN, CastleRights, Move, make_board, make_fen
+
+HEADER = struct.Struct('>4sHHI')
+MAGIC = b'CGR1'
+SNAPSHOT_SIZE = 34
+NO_ENPASSANT = 0xFF
+PROMOTION = 4 << 12
+ARCHIVE_FOOTER = struct.Struct('>QQ4s')
+ARCHIVE_MAGIC = b'CGA1'
+
+
+def encode_move(move):
+    code = move.code & 0xFFF
+    if move.is_pawn_promoted:
+        code |= PROMOTION
+    return code
+
+
+def decode_move(board, code):
+    """The Move for a 16-bit code in the board's current position; the code is trusted, not checked."""
+    start_row, start_col = (code >> 3) & 7, code & 7
+    end_row, end_col = (code >> 9) & 7, (code >> 6) & 7
+    piece = board.field[start_row][start_col]
+    enpassant = piece[1] == 'P' and start_col != end_col and board.field[end_row][end_col] == '--'
+    castle = piece[1] == 'K' and abs(end_col - start_col) == 2
+    return Move((start_row, start_col), (end_row, end_col), board.field, enpassant, castle)
+
+
+def encode_snapshot(board):
+    data = bytearray(SNAPSHOT_SIZE)
+    field = board.field
+    for sq in range(0, 64, 2):
+        data[sq >> 1] = PIECE_CODES[field[sq >> 3][sq & 7]] << 4 | PIECE_CODES[field[sq >> 3][(sq & 7) + 1]]
+    rights = board.current_castling_rights
+    data[32] = board.white_to_move | rights.wks << 1 | rights.wqs << 2 | rights.bks << 3 | rights.bqs << 4
+    enpassant = board.enpassant_possible
+    data[33] = enpassant[0] * 8 + enpassant[1] if enpassant else NO_ENPASSANT
+    return bytes(data)
+
+
+def snapshot_fen(data):
+    field = [[PIECE_NAMES[data[(row * 8 + col) >> 1] >> (0 if col & 1 else 4) & 15] for col in range(8)]
+             for row in range(8)]
+    flags = data[32]
+    rights = CastleRights(bool(flags & 2), bool(flags & 8), bool(flags & 4), bool(flags & 16))
+    enpassant = divmod(data[33], 8) if data[33] != NO_ENPASSANT else ()
+    return make_fen(field, bool(flags & 1), rights, enpassant)
+
+
+class GameRecord:
+
+    def __init__(self, moves, snapshots, interval=32):
+        self.moves = moves
+        self.snapshots = snapshots
+        self.interval = interval
+
+    def __len__(self):
+        return len(self.moves)
+
+    @classmethod
+    def from_board(cls, board, interval=32):
+        """Record the game played on `board` so far; the board ends up where it was."""
+        played = list(board.move_log)
+        for _ in played:
+            board.cancel_move()
+        moves = array('H')
+        snapshots = []
+        for ply, move in enumerate(played):
+            if ply % interval == 0:
+                snapshots.append(encode_snapshot(board))
+            moves.append(encode_move(move))
+            board.move(move)
+        if len(played) % interval == 0:
+            snapshots.append(encode_snapshot(board))
+        return cls(moves, snapshots, interval)
+
+    @classmethod
+    def from_moves(cls, moves, fen=START_FEN, interval=32):
+        board = make_board(fen)
+        for move in moves:
+            board.move(move)
+        return cls.from_board(board, interval)
+
+    def fen(self, ply):
+        """FEN of the snapshot nearest to `ply` at or before it, and that snapshot's ply."""
+        if not 0 <= ply <= len(self.moves):
+            raise IndexError('ply {} outside 0..{}'.format(ply, len(self.moves)))
+        index = ply // self.interval
+        return snapshot_fen(self.snapshots[index]), index * self.interval
+
+    def restore(self, board, ply):
+        fen, snapshot_ply = self.fen(ply)
+        board.load_fen(fen)
+        for code in self.moves[snapshot_ply:ply]:
+            board.move(decode_move(board, code))
+
+    def to_bytes(self):
+        moves = array('H', self.moves)
+        if sys.byteorder == 'little':
+            moves.byteswap()
+        return (HEADER.pack(MAGIC, self.interval, len(self.snapshots), len(self.moves)) +
+                b''.join(self.snapshots) + moves.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, interval, snapshot_count, move_count = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('not a game record')
+        offset = HEADER.size
+        snapshots = [bytes(data[offset + i * SNAPSHOT_SIZE:offset + (i + 1) * SNAPSHOT_SIZE])
+                     for i in range(snapshot_count)]
+        offset += snapshot_count * SNAPSHOT_SIZE
+        moves = array('H')
+        moves.frombytes(data[offset:offset + move_count * 2])
+        if sys.byteorder == 'little':
+            moves.byteswap()
+        return cls(moves, snapshots, interval)
+
+
+def write_archive(path, records):
+    """Write GameRecords to `path`; returns how many."""
+    offsets = array('Q', [0])
+    with open(path + '.tmp', 'wb') as file:
+        for record in records:
+            data = record.to_bytes()
+            file.write(data)
+            offsets.append(offsets[-1] + len(data))
+        table = array('Q', offsets)
+        if sys.byteorder == 'little':
+            table.byteswap()
+        file.write(table.tobytes())
+        file.write(ARCHIVE_FOOTER.pack(offsets[-1], len(offsets) - 1, ARCHIVE_MAGIC))
+    os.replace(path + '.tmp', path)
+    return len(offsets) - 1
+
+
+class GameArchive:
+    """Random access to the records of an archive file. Close it, or use it as a context manager."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.table, self.count, magic = ARCHIVE_FOOTER.unpack_from(self.data, len(self.data) - ARCHIVE_FOOTER.size)
+        if magic != ARCHIVE_MAGIC:
+            self.close()
+            raise ValueError('{} is not a game archive'.format(path))
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        start, end = struct.unpack_from('>QQ', self.data, self.table + index * 8)
+        return GameRecord.from_bytes(self.data[start:end])
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def random_game(rng, max_plies=200):
+    board = make_board()
+    for _ in range(max_plies):
+        moves = board.get_valid_moves()
+        if not moves:
+            break
+        board.move(rng.choice(moves))
+    return board
+
+
+def read_pgn_records(paths, interval):
+    from book import read_pgn_files
+    from pgn import find_move
+
+    for game in read_pgn_files(paths):
+        board = make_board(game.headers.get('FEN', START_FEN))
+        for san in game.moves:
+            move = find_move(san, board.get_valid_moves())
+            if move is None:
+                break
+            board.move(move)
+        yield GameRecord.from_board(board, interval)
+
+
+def benchmark(games, interval, seed=0):
+    rng = random.Random(seed)
+    boards = [random_game(rng) for _ in range(games)]
+    plies = sum(len(board.move_log) for board in boards)
+    start = time.perf_counter()
+    records = [GameRecord.from_board(board, interval) for board in boards]
+    encode_time = time.perf_counter() - start
+    data = [record.to_bytes() for record in records]
+    start = time.perf_counter()
+    decoded = [GameRecord.from_bytes(blob) for blob in data]
+    decode_time = time.perf_counter() - start
+    logs = pickle.dumps([(board.move_log, board.castle_rights_log) for board in boards])
+    size = sum(map(len, data))
+    print('{} games, {} plies: {} bytes as records ({:.1f} per ply), {} bytes as pickled move and castling logs'
+          .format(games, plies, size, size / plies, len(logs)))
+    print('record from board {:.1f} us/ply, from bytes {:.1f} us/game'.format(
+        encode_time / plies * 1e6, decode_time / games * 1e6))
+
+    seeks = [(i, rng.randint(0, len(records[i]))) for i in range(games) for _ in range(5)]
+    board = make_board()
+    start = time.perf_counter()
+    for i, ply in seeks:
+        decoded[i].restore(board, ply)
+    seek_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for i, ply in seeks:
+        board.load_fen(START_FEN)
+        for move in boards[i].move_log[:ply]:
+            board.move(move)
+    replay_time = time.perf_counter() - start
+    print('seek {:.0f} us, replay from the start {:.0f} us (mean over {} random plies)'.format(
+        seek_time / len(seeks) * 1e6, replay_time / len(seeks) * 1e6, len(seeks)))
+
+    same = True
+    for i, ply in seeks[:200]:
+        board.seek(decoded[i], ply)
+        expected = make_board()
+        for move in boards[i].move_log[:ply]:
+            expected.move(move)
+        same &= board.get_fen() == expected.get_fen() and board.key == expected.key
+    print('seeks match replays' if same else 'seeks DIFFER from replays')
+    return same
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pack games into compact records, or look into an archive.')
+    parser.add_argument('--bench', action='store_true', help='sizes and seek times on random games')
+    parser.add_argument('--games', type=int, default=200, help='random games for --bench')
+    parser.add_argument('--interval', type=int, default=32, help='plies between snapshots')
+    commands = parser.add_subparsers(dest='command')
+    pack = commands.add_parser('pack', help='write an archive from PGN files')
+    pack.add_argument('pgn', nargs='+', help="PGN files, '-' for standard input")
+    pack.add_argument('--output', default='games.cgr')
+    show = commands.add_parser('show', help='print a position from an archive')
+    show.add_argument('archive')
+    show.add_argument('--game', type=int, default=0)
+    show.add_argument('--ply', type=int, help='default: the end of the game')
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        return 0 if benchmark(args.games, args.interval) else 1
+    if args.command == 'pack':
+        start = time.perf_counter()
+        count = write_archive(args.output, read_pgn_records(args.pgn, args.interval))
+        print('{} games written to {} ({} bytes) in {:.1f}s'.format(count, args.output, os.path.getsize(args.output),
+                                                                     time.perf_counter() - start))
+        return 0
+    if args.command == 'show':
+        with GameArchive(args.archive) as archive:
+            record = archive[args.game]
+            board = make_board()
+            start = time.perf_counter()
+            board.seek(record, len(record) if args.ply is None else args.ply)
+            elapsed = time.perf_counter() - start
+            print('game {} of {}, {} plies'.format(args.game, len(archive), len(record)))
+            print(board.get_fen(), ' ({:.0f} us)'.format(elapsed * 1e6))
+        return 0
+    parser.print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Headless benchmark of the game's drawing: board, pieces, highlights and move animations, in ms per frame.
+
+Runs on SDL's dummy video driver, so it needs no window. Every move type is animated both ways the game
+can: 'timed' (CHESS_ANIMATION=timed, frames at ANIMATION_FPS for ANIMATION_TIME seconds) and 'frames'
+(the blocking 10 frames per square). 'shown ms' is how long the animation stays on screen at 60 fps.
+
+Save the numbers before a UI change and compare after it; --compare exits with 1 when a case got slower
+than --tolerance allows:
+
+    python render_bench.py --save render-baseline.json
+    python render_bench.py --compare render-baseline.json --tolerance 0.25
+    python render_bench.py --size 1024 --repeat 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame  # noqa: E402
+
+import main as game  # noqa: E402
+from assets import DEFAULT_SET  # noqa: E402
+from chess_engine import START_FEN  # noqa: E402
+from pgn import find_move  # noqa: E402
+
+# Name, position and move in coordinates (or O-O) for every animated move type.
+MOVES = [
+    ('pawn push', START_FEN, 'e2e4'),
+    ('knight', START_FEN, 'g1f3'),
+    ('capture', 'rnbqkbnr/ppp1pppp/8/3p4/4P3/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 2', 'e4d5'),
+    ('castle', 'r3k2r/pppppppp/8/8/8/8/PPPPPPPP/R3K2R w KQkq - 0 1', 'O-O'),
+    ('en passant', 'k7/8/8/3pP3/8/8/8/K7 w - d6 0 1', 'e5d6'),
+    ('promotion', 'k7/4P3/8/8/8/8/8/K7 w - - 0 1', 'e7e8q'),
+    ('long diagonal', 'k7/8/8/8/8/8/8/B6K w - - 0 1', 'a1h8'),
+]
+# Differences below this many milliseconds are noise, not regressions.
+MIN_DIFFERENCE = 0.05
+
+
+class FrameClock:
+    """Stands in for pygame.time.Clock in move_animation: no waiting, the time between ticks is recorded."""
+
+    def __init__(self):
+        self.frames = []
+        self.last = time.perf_counter()
+
+    def tick(self, framerate=0):
+        now = time.perf_counter()
+        self.frames.append(now - self.last)
+        self.last = now
+
+
+def stats(seconds, shown_frames=None):
+    """Mean, p95 and max frame time in ms; `shown_frames` per move gives the time on screen."""
+    frames = sorted(seconds)
+    result = {'frames': len(frames), 'mean_ms': sum(frames) / len(frames) * 1000,
+              'p95_ms': frames[min(len(frames) - 1, len(frames) * 95 // 100)] * 1000, 'max_ms': frames[-1] * 1000}
+    if shown_frames is not None:
+        result['shown_ms'] = shown_frames / game.ANIMATION_FPS * 1000
+    return result
+
+
+def timed(function, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def draw(renderer, board, **kwargs):
+    pygame.display.update(renderer.render(board, **kwargs))
+
+
+def static_cases(renderer, repeat):
+    board = game.new_board(renderer.screen)
+    valid_moves = board.get_valid_moves()
+    draw(renderer, board)
+
+    def background():
+        renderer.backgrounds.clear()
+        renderer.get_background()
+
+    def pieces():
+        renderer.invalidate()
+        draw(renderer, board)
+
+    # A pawn is selected and deselected in turn, so every frame changes the highlights.
+    squares = [(6, 4), ()]
+
+    def highlight():
+        squares.reverse()
+        draw(renderer, board, selected_square=squares[0], valid_moves=valid_moves)
+
+    results = {
+        'board background': stats(timed(background, repeat)),
+        'board and pieces': stats(timed(pieces, repeat)),
+        'highlight squares': stats(timed(highlight, repeat)),
+        'idle frame': stats(timed(lambda: draw(renderer, board), repeat)),
+    }
+    renderer.get_background()
+    return results
+
+
+def animate_timed(renderer, board, move):
+    """Frame times of one timed animation, rendered at ANIMATION_FPS steps of a simulated clock."""
+    renderer.start_animation(move, now=0)
+    seconds = []
+    frame = 0
+    while renderer.animation is not None:
+        frame += 1
+        start = time.perf_counter()
+        draw(renderer, board, now=frame / game.ANIMATION_FPS)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def animate_frames(renderer, board, move):
+    clock = FrameClock()
+    renderer.move_animation(board, move, clock)
+    # The final repaint of the end square happens in the next render, as in the game.
+    start = time.perf_counter()
+    draw(renderer, board)
+    return clock.frames + [time.perf_counter() - start]
+
+
+def move_cases(renderer, repeat, modes):
+    results = {}
+    for name, fen, text in MOVES:
+        for mode in modes:
+            seconds = []
+            for _ in range(repeat):
+                board = game.new_board(renderer.screen, fen)
+                move = find_move(text, board.get_valid_moves())
+                if move is None:
+                    raise ValueError('{} is not legal in {}'.format(text, fen))
+                renderer.invalidate()
+                draw(renderer, board)
+                board.move(move)
+                animate = animate_timed if mode == 'timed' else animate_frames
+                seconds += animate(renderer, board, move)
+            results['{} ({})'.format(name, mode)] = stats(seconds, len(seconds) / repeat)
+    return results
+
+
+def run(size, repeat, modes):
+    pygame.init()
+    game.screen = pygame.display.set_mode((size, size))
+    game.fit_board((size, size))
+    renderer = game.Renderer(game.screen, game.load_piece_set(DEFAULT_SET))
+    results = static_cases(renderer, repeat * 10)
+    results.update(move_cases(renderer, repeat, modes))
+    pygame.quit()
+    return results
+
+
+def print_results(results):
+    print('{:28} {:>7} {:>8} {:>8} {:>8} {:>9}'.format('case', 'frames', 'mean ms', 'p95 ms', 'max ms', 'shown ms'))
+    for name, result in results.items():
+        shown = '{:9.0f}'.format(result['shown_ms']) if 'shown_ms' in result else ''
+        print('{:28} {:7} {:8.3f} {:8.3f} {:8.3f} {}'.format(name, result['frames'], result['mean_ms'],
+                                                           result['p95_ms'], result['max_ms'], shown))
+
+
+def compare(results, baseline, tolerance):
+    """Names of the cases whose mean frame time grew by more than `tolerance` over `baseline`."""
+    slower = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['mean_ms'], result['mean_ms']
+        change = after / before - 1 if before else 0
+        print('{:28} {:8.3f} -> {:8.3f} ms {:+7.1%}'.format(name, before, after, change))
+        if after - before > max(MIN_DIFFERENCE, before * tolerance):
+            slower.append(name)
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time board drawing and move animations without a window.')
+    parser.add_argument('--size', type=int, default=game.WIDTH, help='window width and height in pixels')
+    parser.add_argument('--repeat', type=int, default=10, help='animations per move type; static cases run 10x this')
+    parser.add_argument('--animation', choices=['timed', 'frames', 'both'], default='both')
+    parser.add_argument('--save', help='write the results as JSON, as a baseline for --compare')
+    parser.add_argument('--compare', help='baseline JSON from --save; exit with 1 if a case got slower')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown of the mean, 0.25 = 25%%')
+    args = parser.parse_args(argv)
+
+    modes = ['timed', 'frames'] if args.animation == 'both' else [args.animation]
+    results = run(args.size, args.repeat, modes)
+    print_results(results)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=1)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        slower = compare(results, baseline, args.tolerance)
+        if slower:
+            print('slower than the baseline: ' + ', '.join(slower))
+            return 1
+        print('no case slower than the baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""Alpha-beta search on top of the Board API (get_valid_moves / move / cancel_move).
+
+    python search.py --fen "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1" --time 5
+"""
+import argparse
+import time
+
+from chess_engine import PIECE_NAMES, PROMOTION_FLAG, START_FEN
+from evaluation import PIECE_VALUES, evaluate
+
+MATE = 100000
+INFINITY = 10 ** 9
+# Scores beyond this are mates, their distance is stored relative to the node in the transposition table.
+MATE_BOUND = MATE - 1000
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# Hot paths read Move.code directly: bits 0-11 are the from/to squares, used as the move's identity,
+# bits 6-15 are the end square plus the piece moved, used as the history key.
+SQUARES_MASK = 0xFFF
+CAPTURE_MASK = 0xF0000
+CODE_VALUES = [PIECE_VALUES[name[1]] if name != '--' else 0 for name in PIECE_NAMES]
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class TranspositionTable:
+    """Fixed number of slots indexed by key; a slot keeps the deeper entry unless it is from an older search."""
+
+    def __init__(self, size=1 << 18):
+        self.size = size
+        self.entries = [None] * size
+        self.age = 0
+
+    def probe(self, key):
+        entry = self.entries[key % self.size]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, flag, score, move_id):
+        index = key % self.size
+        old = self.entries[index]
+        if old is None or old[0] == key or old[5] != self.age or depth >= old[1]:
+            self.entries[index] = (key, depth, flag, score, move_id, self.age)
+
+    def new_search(self):
+        self.age += 1
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.age = 0
+
+
+class SearchResult:
+
+    def __init__(self, best_move, score, depth, nodes, elapsed):
+        self.best_move = best_move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+    @property
+    def nps(self):
+        return self.nodes / max(self.elapsed, 1e-9)
+
+    def __str__(self):
+        move = self.best_move.get_chess_notation() if self.best_move else '-'
+        return 'depth {} score {} nodes {} time {:.2f}s nps {:.0f} best {}'.format(
+            self.depth, self.score, self.nodes, self.elapsed, self.nps, move)
+
+
+def _to_tt(score, ply):
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def _from_tt(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class Searcher:
+    """Negamax alpha-beta with iterative deepening, quiescence search and a transposition table.
+
+    Keeping one Searcher for a whole game lets the transposition table and history carry over between moves.
+    With an OpeningBook, positions found in the book are answered from it without searching, and so are
+    endgames covered by a Tablebase.
+    """
+
+    def __init__(self, tt_size=1 << 18, tt=None, stop_event=None, book=None, tablebase=None):
+        self.tt = tt if tt is not None else TranspositionTable(tt_size)
+        self.stop_event = stop_event
+        self.book = book
+        self.tablebase = tablebase
+        self.history = {}
+        self.killers = []
+        self.nodes = 0
+        self.deadline = 0
+
+    def search(self, board, time_limit=2.0, max_depth=64, info=None, start_depth=1):
+        """Search until time_limit seconds pass or max_depth is done; `info` is called after every depth."""
+        start = time.perf_counter()
+        if self.book is not None:
+            move = self.book.probe(board)
+            if move is not None:
+                return SearchResult(move, 0, 0, 0, time.perf_counter() - start)
+        if self.tablebase is not None:
+            found = self.tablebase.best_move(board)
+            if found is not None:
+                move, outcome, plies = found
+                score = {'win': MATE - plies, 'draw': 0, 'loss': -MATE + plies}[outcome]
+                return SearchResult(move, score, 0, 0, time.perf_counter() - start)
+        self.deadline = start + time_limit
+        self.nodes = 0
+        self.killers = [[None, None] for _ in range(max_depth + 1)]
+        self.tt.new_search()
+        root_length = len(board.move_log)
+        checkmate, stale_mate = board.checkmate, board.stale_mate
+
+        result = SearchResult(None, 0, 0, 0, 0)
+        root_moves = board.get_valid_moves()
+        if root_moves:
+            result.best_move = root_moves[0]
+            for depth in range(min(start_depth, max_depth), max_depth + 1):
+                try:
+                    score, move = self.search_root(board, root_moves, depth)
+                except SearchTimeout:
+                    while len(board.move_log) > root_length:
+                        board.cancel_move()
+                    break
+                result = SearchResult(move, score, depth, self.nodes, time.perf_counter() - start)
+                if info is not None:
+                    info(result)
+                if abs(score) > MATE_BOUND:
+                    break
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+
+        board.checkmate, board.stale_mate = checkmate, stale_mate
+        return result
+
+    def search_root(self, board, moves, depth):
+        entry = self.tt.probe(board.key)
+        self.order_moves(moves, entry[4] if entry else None, 0)
+        alpha = -INFINITY
+        best_move = moves[0]
+        for move in moves:
+            board.move(move)
+            score = -self.negamax(board, depth - 1, -INFINITY, -alpha, 1)
+            board.cancel_move()
+            if score > alpha:
+                alpha = score
+                best_move = move
+        self.tt.store(board.key, depth, EXACT, _to_tt(alpha, 0), best_move.code & SQUARES_MASK)
+        return alpha, best_move
+
+    def negamax(self, board, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_time()
+        if board.repetition_count() > 1:
+            return 0
+
+        alpha_original = alpha
+        entry = self.tt.probe(board.key)
+        tt_move = None
+        if entry is not None:
+            tt_move = entry[4]
+            if entry[1] >= depth:
+                score = _from_tt(entry[3], ply)
+                if entry[2] == EXACT:
+                    return score
+                if entry[2] == LOWER:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+
+        if depth <= 0:
+            return self.quiescence(board, alpha, beta)
+
+        moves = board.get_valid_moves()
+        if not moves:
+            return -MATE + ply if board.checkmate else 0
+
+        self.order_moves(moves, tt_move, ply)
+        best_score = -INFINITY
+        best_move = None
+        for move in moves:
+            board.move(move)
+            score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            board.cancel_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if not move.code & CAPTURE_MASK:
+                            self.store_killer(move, ply)
+                            history_key = (move.code >> 6) & 0x3FF
+                            self.history[history_key] = self.history.get(history_key, 0) + depth * depth
+                        break
+
+        if best_score <= alpha_original:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.tt.store(board.key, depth, flag, _to_tt(best_score, ply), best_move.code & SQUARES_MASK)
+        return best_score
+
+    def quiescence(self, board, alpha, beta):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_time()
+
+        stand_pat = evaluate(board.field)
+        if not board.white_to_move:
+            stand_pat = -stand_pat
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        captures = [move for move in board.get_valid_moves() if move.code & (CAPTURE_MASK | PROMOTION_FLAG)]
+        captures.sort(key=mvv_lva, reverse=True)
+        for move in captures:
+            board.move(move)
+            score = -self.quiescence(board, -beta, -alpha)
+            board.cancel_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def check_time(self):
+        if time.perf_counter() > self.deadline or (self.stop_event is not None and self.stop_event.is_set()):
+            raise SearchTimeout()
+
+    def store_killer(self, move, ply):
+        if ply < len(self.killers):
+            killers = self.killers[ply]
+            if killers[0] != move.code & SQUARES_MASK:
+                killers[1] = killers[0]
+                killers[0] = move.code & SQUARES_MASK
+
+    def order_moves(self, moves, tt_move, ply):
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+        history = self.history
+
+        def score(move):
+            code = move.code
+            if code & SQUARES_MASK == tt_move:
+                return 3 * 10 ** 7
+            if code & (CAPTURE_MASK | PROMOTION_FLAG):
+                return 2 * 10 ** 7 + mvv_lva(move)
+            if code & SQUARES_MASK in killers:
+                return 10 ** 7
+            return min(history.get((code >> 6) & 0x3FF, 0), 10 ** 7 - 1)
+
+        moves.sort(key=score, reverse=True)
+
+
+def mvv_lva(move):
+    """Most valuable victim first, least valuable attacker as tie-break."""
+    code = move.code
+    victim = CODE_VALUES[(code >> 16) & 15]
+    if code & PROMOTION_FLAG:
+        victim += PIECE_VALUES['Q']
+    return victim * 10 - CODE_VALUES[(code >> 12) & 15] // 10
+
+
+def find_best_move(board, time_limit=2.0, max_depth=64, searcher=None, info=None):
+    return (searcher or Searcher()).search(board, time_limit, max_depth, info)
+
+
+def main(argv=None):
+    from bitboard import BitBoard
+
+    parser = argparse.ArgumentParser(description='Search a position and print the best move.')
+    parser.add_argument('--fen', default=START_FEN)
+    parser.add_argument('--time', type=float, default=5.0, help='time budget in seconds')
+    parser.add_argument('--depth', type=int, default=64, help='maximum depth')
+    parser.add_argument('--book', help='opening book file, see book.py')
+    parser.add_argument('--tablebases', help='directory of endgame tables, see tablebase.py')
+    args = parser.parse_args(argv)
+
+    book = None
+    if args.book:
+        from book import OpeningBook
+        book = OpeningBook(args.book)
+    tablebase = None
+    if args.tablebases:
+        from tablebase import Tablebase
+        tablebase = Tablebase(args.tablebases)
+    result = find_best_move(BitBoard(args.fen), args.time, args.depth, Searcher(book=book, tablebase=tablebase),
+                            info=print)
+    print('bestmove', result.best_move.get_chess_notation() if result.best_move else '-',
+          '({} nodes, {:.0f} nodes/sec)'.format(result.nodes, result.nps))
+
+
+if __name__ == '__main__':
+    main()
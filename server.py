@@ -0,0 +1,225 @@
+"""Asyncio game server: many games on one box, one JSON object per line over TCP.
+
+    python server.py --port 8765 --engine-workers 2
+
+Requests carry a "cmd" and, to allow several requests in flight on one connection, an optional "id"
+that is copied into the response:
+
+    {"id": 1, "cmd": "new", "fen": "<optional FEN>"}
+    {"id": 2, "cmd": "move", "game": 1, "move": "e2e4"}      also Pe2e4 (get_chess_notation) or SAN
+    {"id": 3, "cmd": "engine", "game": 1, "time": 0.5}       the engine moves for the side to play
+    {"id": 4, "cmd": "undo", "game": 1}
+    {"id": 5, "cmd": "state", "game": 1}
+    {"id": 6, "cmd": "close", "game": 1}
+
+Every answer has "ok"; game answers add the FEN, the side to move, the status and the legal moves.
+Games belong to the connection that created them and are dropped when it closes.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from analyse import game_status
+from chess_engine import START_FEN, make_board
+from pgn import find_move
+from search import SQUARES_MASK, Searcher
+
+MOVE_RE = re.compile(r'^[PNBRQK]?([a-h][1-8])-?([a-h][1-8])[qQ]?$')
+MAX_LINE = 1 << 16
+
+_searcher = None
+
+
+def _engine_move(fen, history, think_time):
+    # Runs in an executor process; the board travels as a FEN plus the keys of the game so far.
+    global _searcher
+    if _searcher is None:
+        _searcher = Searcher()
+    board = make_board(fen, history=history)
+    result = _searcher.search(board, think_time)
+    return (result.best_move.code & SQUARES_MASK if result.best_move else None), result.score, result.depth
+
+
+class Game:
+
+    def __init__(self, game_id, fen=START_FEN, backend='bitboard'):
+        self.id = game_id
+        self.board = make_board(fen, backend)
+        self.moves = self.board.get_valid_moves()
+        self.thinking = False
+
+    def play(self, move):
+        self.board.move(move)
+        self.moves = self.board.get_valid_moves()
+
+    def undo(self):
+        self.board.cancel_move()
+        self.moves = self.board.get_valid_moves()
+
+    def find(self, text):
+        match = MOVE_RE.match(text)
+        if match:
+            start, end = (coordinates(square) for square in match.groups())
+            return self.moves.find(start, end)
+        return find_move(text, self.moves)
+
+    def state(self):
+        board = self.board
+        return {'game': self.id, 'fen': board.get_fen(), 'turn': 'white' if board.white_to_move else 'black',
+                'status': game_status(board), 'repetitions': board.repetition_count(),
+                'last': board.move_log[-1].get_chess_notation() if board.move_log else None,
+                'moves': [move.get_rank_file(move.start_row, move.start_col) +
+                          move.get_rank_file(move.end_row, move.end_col) for move in self.moves]}
+
+
+def coordinates(square):
+    return 8 - int(square[1]), ord(square[0]) - ord('a')
+
+
+class GameServer:
+
+    def __init__(self, backend='bitboard', engine_workers=1, max_think_time=5.0):
+        self.backend = backend
+        self.max_think_time = max_think_time
+        self.executor = ProcessPoolExecutor(engine_workers) if engine_workers else None
+        self.games = {}
+        self.ids = itertools.count(1)
+        self.connections = 0
+
+    async def handle_connection(self, reader, writer):
+        self.connections += 1
+        owned = set()
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def answer(request):
+            try:
+                response = await self.handle_request(request, owned)
+            except Exception as error:
+                # Every request gets an answer, or its client would wait for one forever.
+                response = {'ok': False, 'error': 'internal error: {}'.format(error)}
+            if isinstance(request, dict) and 'id' in request:
+                response['id'] = request['id']
+            async with write_lock:
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    request = None
+                # Requests run as tasks so an engine search does not hold up the rest of the connection.
+                task = asyncio.ensure_future(answer(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            for game_id in owned:
+                self.games.pop(game_id, None)
+            self.connections -= 1
+            writer.close()
+
+    async def handle_request(self, request, owned):
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': 'requests are JSON objects'}
+        command = request.get('cmd')
+        if command == 'new':
+            fen = request.get('fen') or START_FEN
+            if not isinstance(fen, str):
+                return {'ok': False, 'error': 'bad FEN'}
+            try:
+                game = Game(next(self.ids), fen, self.backend)
+            except (ValueError, KeyError, IndexError):
+                return {'ok': False, 'error': 'bad FEN'}
+            self.games[game.id] = game
+            owned.add(game.id)
+            return dict(game.state(), ok=True)
+
+        game_id = request.get('game')
+        game = self.games.get(game_id) if isinstance(game_id, int) else None
+        if game is None or game.id not in owned:
+            return {'ok': False, 'error': 'unknown game'}
+        if game.thinking and command != 'state':
+            return {'ok': False, 'error': 'the engine is thinking', 'game': game.id}
+        if command == 'move':
+            move = game.find(str(request.get('move', '')))
+            if move is None:
+                return dict(game.state(), ok=False, error='illegal move {}'.format(request.get('move')))
+            game.play(move)
+        elif command == 'engine':
+            if not game.moves:
+                return dict(game.state(), ok=False, error='game over')
+            think_time = request.get('time', 0.1)
+            # 'not 0 < ...' also turns away NaN, which json.loads accepts.
+            if not isinstance(think_time, (int, float)) or not 0 < think_time:
+                return dict(game.state(), ok=False, error='time must be a positive number of seconds')
+            await self.engine_move(game, min(think_time, self.max_think_time))
+        elif command == 'undo':
+            if not game.board.move_log:
+                return dict(game.state(), ok=False, error='nothing to undo')
+            game.undo()
+        elif command == 'close':
+            del self.games[game.id]
+            owned.discard(game.id)
+            return {'ok': True, 'game': game.id}
+        elif command != 'state':
+            return {'ok': False, 'error': 'unknown command {}'.format(command)}
+        return dict(game.state(), ok=True)
+
+    async def engine_move(self, game, think_time):
+        board = game.board
+        game.thinking = True
+        try:
+            if self.executor is None:
+                result = _engine_move(board.get_fen(), board.key_log[:-1], think_time)
+            else:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self.executor, _engine_move, board.get_fen(),
+                                                    board.key_log[:-1], think_time)
+        finally:
+            game.thinking = False
+        moves = {move.code & SQUARES_MASK: move for move in game.moves}
+        game.play(moves[result[0]])
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+
+async def serve(host, port, backend, engine_workers):
+    game_server = GameServer(backend, engine_workers)
+    server = await asyncio.start_server(game_server.handle_connection, host, port, limit=MAX_LINE)
+    print('serving on {}:{}'.format(host, port), flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        game_server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve many chess games over a line-based JSON protocol.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--backend', choices=['bitboard', 'field'], default='bitboard')
+    parser.add_argument('--engine-workers', type=int, default=1, help='engine processes, 0 runs the engine inline')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.backend, args.engine_workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,529 @@
+"""Endgame tablebases for KQK, KRK, KPK and KBNK, generated by retrograde analysis.
+
+A table file holds one byte per position: the low two bits are the result for the side to move
+(0 unused index, 1 draw, 2 win, 3 loss), the high six bits the distance to mate in moves. Files are
+memory-mapped, so a probe is an index computation and one byte read.
+
+The stronger side is always white inside a table; positions where black has the pieces are probed
+with the board flipped. Like Board, the tables only know promotion to a queen and ignore castling.
+
+    python tablebase.py generate --output tables --workers 4
+    python tablebase.py probe --fen "8/8/8/4k3/8/8/8/KQ6 w - - 0 1"
+    python tablebase.py verify --samples 2000
+"""
+import argparse
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+from array import array
+from collections import Counter
+
+from bitboard import KING_ATTACKS, KNIGHT_ATTACKS, PAWN_ATTACKS, BitBoard, bishop_attacks, rook_attacks
+
+HEADER = struct.Struct('>4s8sI')
+MAGIC = b'CTB1'
+ILLEGAL, DRAW, WIN, LOSS = 0, 1, 2, 3
+UNKNOWN = 0xFF
+RESULTS = {DRAW: 'draw', WIN: 'win', LOSS: 'loss'}
+WHITE, BLACK = 0, 1
+# Material left after a capture in one of the tables; none of it can mate.
+DRAWN = ('KK', 'KBK', 'KNK')
+
+
+def _transform(function):
+    return [function(sq >> 3, sq & 7) for sq in range(64)]
+
+
+IDENTITY = _transform(lambda row, col: row * 8 + col)
+FLIP_COLS = _transform(lambda row, col: row * 8 + 7 - col)
+FLIP_ROWS = _transform(lambda row, col: (7 - row) * 8 + col)
+TRANSPOSE = _transform(lambda row, col: (7 - col) * 8 + 7 - row)
+
+
+def _compose(first, second):
+    return [second[first[sq]] for sq in range(64)]
+
+
+class Table:
+    """Index layout of one endgame: side to move, white king slot, black king, then the white pieces.
+
+    Pawnless tables use all eight board symmetries and keep the white king in the a1-d1-d4 triangle,
+    the pawn table only mirrors files and keeps the white king on files a-d.
+    """
+
+    def __init__(self, name, kinds):
+        self.name = name
+        self.kinds = kinds
+        if 'P' in kinds:
+            transforms = [IDENTITY, FLIP_COLS]
+            self.slots = [sq for sq in range(64) if sq & 7 <= 3]
+        else:
+            flips = [IDENTITY, FLIP_COLS, FLIP_ROWS, _compose(FLIP_COLS, FLIP_ROWS)]
+            transforms = flips + [_compose(flip, TRANSPOSE) for flip in flips]
+            # rank <= file <= 3, with rank = 7 - row and file = col
+            self.slots = [sq for sq in range(64) if 7 - (sq >> 3) <= (sq & 7) <= 3]
+        self.slot_of = {sq: slot for slot, sq in enumerate(self.slots)}
+        # Transforms that bring a white king square into the slots: one, or two on a symmetry axis.
+        self.candidates = [[t for t in transforms if t[sq] in self.slot_of] for sq in range(64)]
+        self.per_king = 64 ** (len(kinds) + 1)
+        self.size = 2 * len(self.slots) * self.per_king
+
+    def index(self, stm, wk, bk, extras):
+        """Canonical index of a position; every symmetric copy gets the same one."""
+        best = None
+        for t in self.candidates[wk]:
+            index = stm * len(self.slots) + self.slot_of[t[wk]]
+            index = index * 64 + t[bk]
+            for sq in extras:
+                index = index * 64 + t[sq]
+            if best is None or index < best:
+                best = index
+        return best
+
+    def decode(self, index):
+        extras = []
+        for _ in self.kinds:
+            index, sq = divmod(index, 64)
+            extras.append(sq)
+        index, bk = divmod(index, 64)
+        stm, slot = divmod(index, len(self.slots))
+        return stm, self.slots[slot], bk, extras[::-1]
+
+
+TABLES = {name: Table(name, kinds) for name, kinds in
+          (('KQK', 'Q'), ('KRK', 'R'), ('KPK', 'P'), ('KBNK', 'BN'))}
+# KPK promotes into KQK, so KQK has to exist first.
+DEPENDENCIES = {'KPK': ['KQK']}
+
+
+def white_attacks(kinds, wk, extras, occupied):
+    attacks = KING_ATTACKS[wk]
+    for kind, sq in zip(kinds, extras):
+        if kind == 'N':
+            attacks |= KNIGHT_ATTACKS[sq]
+        elif kind == 'P':
+            attacks |= PAWN_ATTACKS['w'][sq]
+        elif kind == 'B':
+            attacks |= bishop_attacks(sq, occupied)
+        elif kind == 'R':
+            attacks |= rook_attacks(sq, occupied)
+        else:
+            attacks |= rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)
+    return attacks
+
+
+def _is_legal(table, stm, wk, bk, extras):
+    squares = [wk, bk] + list(extras)
+    if len(set(squares)) != len(squares) or KING_ATTACKS[wk] >> bk & 1:
+        return False
+    for kind, sq in zip(table.kinds, extras):
+        if kind == 'P' and (sq >> 3 == 0 or sq >> 3 == 7):
+            return False
+    if stm == WHITE:
+        occupied = 0
+        for sq in squares:
+            occupied |= 1 << sq
+        return not white_attacks(table.kinds, wk, extras, occupied) >> bk & 1
+    return True
+
+
+def _encode(result, moves):
+    return result | moves << 2
+
+
+def _init_chunk(args):
+    """Values, move counters and promotion results for every position with one side to move and king slot."""
+    name, stm, slot, directory = args
+    table = TABLES[name]
+    kinds = table.kinds
+    wk = table.slots[slot]
+    base = (stm * len(table.slots) + slot) * table.per_king
+    values = bytearray(table.per_king)
+    counters = bytearray(table.per_king)
+    seeds = []
+    queen_table = open_table(directory, 'KQK') if 'P' in kinds else None
+
+    for offset in range(table.per_king):
+        index = base + offset
+        position = table.decode(index)
+        _, _, bk, extras = position
+        if not _is_legal(table, stm, wk, bk, extras) or table.index(stm, wk, bk, extras) != index:
+            continue
+        values[offset] = UNKNOWN
+        white = 1 << wk
+        for sq in extras:
+            white |= 1 << sq
+
+        if stm == WHITE:
+            if queen_table is not None:
+                pawn = extras[0]
+                target = pawn - 8
+                if pawn >> 3 == 1 and not (white | 1 << bk) >> target & 1:
+                    value = queen_table.value(BLACK, wk, bk, [target])
+                    if value & 3 == LOSS:
+                        seeds.append((index, (value >> 2) + 1))
+            continue
+
+        # Black to move with a bare king: a capture always draws, otherwise count the distinct replies.
+        # The black king is left out of the occupancy so sliders see through it.
+        attacks = white_attacks(kinds, wk, extras, white)
+        successors = set()
+        drawn = False
+        for target in _bits(KING_ATTACKS[bk] & ~KING_ATTACKS[wk]):
+            if white >> target & 1:
+                left = [(kind, sq) for kind, sq in zip(kinds, extras) if sq != target]
+                if not white_attacks([kind for kind, _ in left], wk, [sq for _, sq in left], white) >> target & 1:
+                    drawn = True
+                    break
+            elif not attacks >> target & 1:
+                successors.add(table.index(WHITE, wk, target, extras))
+        if drawn:
+            values[offset] = DRAW
+        elif successors:
+            counters[offset] = len(successors)
+        else:
+            values[offset] = _encode(LOSS, 0) if attacks >> bk & 1 else DRAW
+    if queen_table is not None:
+        queen_table.close()
+    return stm, slot, bytes(values), bytes(counters), seeds
+
+
+def _bits(bb):
+    while bb:
+        bit = bb & -bb
+        yield bit.bit_length() - 1
+        bb ^= bit
+
+
+def white_unmoves(table, index):
+    """Canonical white-to-move positions with a white move into the black-to-move position `index`."""
+    _, wk, bk, extras = table.decode(index)
+    kinds = table.kinds
+    occupied = 1 << wk | 1 << bk
+    for sq in extras:
+        occupied |= 1 << sq
+    found = set()
+    pieces = [('K', wk)] + list(zip(kinds, extras))
+    for number, (kind, sq) in enumerate(pieces):
+        if kind == 'K':
+            origins = KING_ATTACKS[sq] & ~KING_ATTACKS[bk]
+        elif kind == 'N':
+            origins = KNIGHT_ATTACKS[sq]
+        elif kind == 'B':
+            origins = bishop_attacks(sq, occupied)
+        elif kind == 'R':
+            origins = rook_attacks(sq, occupied)
+        elif kind == 'Q':
+            origins = rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)
+        else:
+            origins = 0
+            if sq >> 3 <= 5 and not occupied >> (sq + 8) & 1:
+                origins = 1 << (sq + 8)
+                if sq >> 3 == 4 and not occupied >> (sq + 16) & 1:
+                    origins |= 1 << (sq + 16)
+        for origin in _bits(origins & ~occupied):
+            moved = [origin if i == number else square for i, (_, square) in enumerate(pieces)]
+            new_wk, new_extras = moved[0], moved[1:]
+            new_occupied = occupied ^ 1 << sq | 1 << origin
+            if not white_attacks(kinds, new_wk, new_extras, new_occupied) >> bk & 1:
+                found.add(table.index(WHITE, new_wk, bk, new_extras))
+    return found
+
+
+def black_unmoves(table, index):
+    """Canonical black-to-move positions with a black king move into the white-to-move position `index`."""
+    _, wk, bk, extras = table.decode(index)
+    occupied = 1 << wk | 1 << bk
+    for sq in extras:
+        occupied |= 1 << sq
+    return {table.index(BLACK, wk, origin, extras)
+            for origin in _bits(KING_ATTACKS[bk] & ~occupied & ~KING_ATTACKS[wk])}
+
+
+def _predecessors(args):
+    name, side, indices = args
+    table = TABLES[name]
+    unmoves = white_unmoves if side == WHITE else black_unmoves
+    found = array('Q')
+    for index in indices:
+        found.extend(unmoves(table, index))
+    return found
+
+
+def generate(name, directory, pool=None, chunk_size=4096, log=print):
+    """Build one table and write it to directory/NAME.tb; returns the path."""
+    start = time.perf_counter()
+    table = TABLES[name]
+    mapper = pool.imap_unordered if pool is not None else map
+    values = bytearray(table.size)
+    counters = bytearray(table.size)
+    seeds = {}
+    jobs = [(name, stm, slot, directory) for stm in (WHITE, BLACK) for slot in range(len(table.slots))]
+    for stm, slot, chunk_values, chunk_counters, chunk_seeds in mapper(_init_chunk, jobs):
+        base = (stm * len(table.slots) + slot) * table.per_king
+        values[base:base + table.per_king] = chunk_values
+        counters[base:base + table.per_king] = chunk_counters
+        for index, moves in chunk_seeds:
+            seeds.setdefault(moves, []).append(index)
+    init_time = time.perf_counter() - start
+
+    def expand(side, indices):
+        jobs = [(name, side, indices[i:i + chunk_size]) for i in range(0, len(indices), chunk_size)]
+        for found in mapper(_predecessors, jobs):
+            yield from found
+
+    lost = [index for index in range(table.size // 2, table.size) if values[index] == _encode(LOSS, 0)]
+    moves = 0
+    while lost or any(distance > moves for distance in seeds):
+        moves += 1
+        won = []
+        for index in expand(WHITE, lost):
+            if values[index] == UNKNOWN:
+                values[index] = _encode(WIN, moves)
+                won.append(index)
+        for index in seeds.pop(moves, []):
+            if values[index] == UNKNOWN:
+                values[index] = _encode(WIN, moves)
+                won.append(index)
+        lost = []
+        for index in expand(BLACK, won):
+            if values[index] == UNKNOWN:
+                counters[index] -= 1
+                if counters[index] == 0:
+                    values[index] = _encode(LOSS, moves)
+                    lost.append(index)
+    for index in range(table.size):
+        if values[index] == UNKNOWN:
+            values[index] = DRAW
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + '.tb')
+    with open(path + '.tmp', 'wb') as file:
+        file.write(HEADER.pack(MAGIC, name.encode(), table.size))
+        file.write(values)
+    os.replace(path + '.tmp', path)
+    histogram = Counter(values)
+    counts = {result: sum(n for value, n in histogram.items() if value and value & 3 == result) for result in RESULTS}
+    longest = max((value >> 2 for value in histogram if value & 3 == WIN), default=0)
+    log('{:5} {:9} positions ({} win, {} draw, {} loss), longest mate {} moves, {:.1f}s '
+        '(first pass {:.1f}s), {} bytes'.format(name, sum(counts.values()), counts[WIN], counts[DRAW],
+                                                counts[LOSS], longest, time.perf_counter() - start, init_time,
+                                                os.path.getsize(path)))
+    return path
+
+
+class TableFile:
+
+    def __init__(self, path, table):
+        self.table = table
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, name, size = HEADER.unpack_from(self.data)
+        if magic != MAGIC or name.rstrip(b'\0').decode() != table.name or size != table.size:
+            self.close()
+            raise ValueError('{} is not a {} table'.format(path, table.name))
+
+    def value(self, stm, wk, bk, extras):
+        return self.data[HEADER.size + self.table.index(stm, wk, bk, extras)]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def open_table(directory, name):
+    return TableFile(os.path.join(directory, name + '.tb'), TABLES[name])
+
+
+class Tablebase:
+    """Probes whatever tables exist in `directory`; close it when done."""
+
+    def __init__(self, directory):
+        self.files = {}
+        for name in TABLES:
+            if os.path.exists(os.path.join(directory, name + '.tb')):
+                self.files[name] = open_table(directory, name)
+
+    def probe(self, board):
+        """(result, plies to mate) for the side to move, result 'win', 'draw' or 'loss', or None if not covered."""
+        rights = board.current_castling_rights
+        if rights.wks or rights.wqs or rights.bks or rights.bqs:
+            return None
+        pieces = {'w': [], 'b': []}
+        for row in range(8):
+            for col in range(8):
+                piece = board.field[row][col]
+                if piece != '--':
+                    pieces[piece[0]].append((piece[1], row * 8 + col))
+                    if len(pieces['w']) + len(pieces['b']) > 4:
+                        return None
+        stm = WHITE if board.white_to_move else BLACK
+        if len(pieces['w']) < len(pieces['b']):
+            # Flip the board so the stronger side is white.
+            pieces = {'w': [(kind, FLIP_ROWS[sq]) for kind, sq in pieces['b']],
+                      'b': [(kind, FLIP_ROWS[sq]) for kind, sq in pieces['w']]}
+            stm = 1 - stm
+        if len(pieces['b']) != 1:
+            return None
+        order = 'KQRBNP'
+        strong = sorted(pieces['w'], key=lambda piece: order.index(piece[0]))
+        name = ''.join(kind for kind, _ in strong) + 'K'
+        if name in DRAWN:
+            return 'draw', 0
+        if name not in self.files:
+            return None
+        value = self.files[name].value(stm, strong[0][1], pieces['b'][0][1], [sq for _, sq in strong[1:]])
+        result, moves = value & 3, value >> 2
+        if result == ILLEGAL:
+            return None
+        if result == WIN:
+            return 'win', 2 * moves - 1
+        if result == LOSS:
+            return 'loss', 2 * moves
+        return 'draw', 0
+
+    def best_move(self, board):
+        """(move, result, plies) of the fastest win, a drawing move, or the slowest loss; None if not covered."""
+        if self.probe(board) is None:
+            return None
+        best = None
+        for move in board.get_valid_moves():
+            board.move(move)
+            answer = self.probe(board)
+            board.cancel_move()
+            if answer is None:
+                return None
+            result, plies = answer
+            # The opponent's loss in n plies is our win in n + 1.
+            rank = {'loss': (2, -plies), 'draw': (1, 0), 'win': (0, plies)}[result]
+            if best is None or rank > best[0]:
+                best = (rank, move, {'loss': 'win', 'draw': 'draw', 'win': 'loss'}[result], plies + 1)
+        if best is None:
+            return None
+        return best[1], best[2], best[3] if best[2] != 'draw' else 0
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def random_position(table, rng):
+    while True:
+        index = rng.randrange(table.size)
+        stm, wk, bk, extras = table.decode(index)
+        if _is_legal(table, stm, wk, bk, extras):
+            return stm, wk, bk, extras
+
+
+def position_fen(table, stm, wk, bk, extras):
+    field = [['--'] * 8 for _ in range(8)]
+    field[wk >> 3][wk & 7] = 'wK'
+    field[bk >> 3][bk & 7] = 'bK'
+    for kind, sq in zip(table.kinds, extras):
+        field[sq >> 3][sq & 7] = 'w' + kind
+    rows = []
+    for row in field:
+        text, empty = '', 0
+        for piece in row:
+            if piece == '--':
+                empty += 1
+                continue
+            if empty:
+                text += str(empty)
+                empty = 0
+            text += piece[1] if piece[0] == 'w' else piece[1].lower()
+        rows.append(text + (str(empty) if empty else ''))
+    return '/'.join(rows) + (' w' if stm == WHITE else ' b') + ' - - 0 1'
+
+
+def verify(tablebase, names, samples, seed=0):
+    """Check random positions against BitBoard's move rules: every value must follow from its successors."""
+    rng = random.Random(seed)
+    failures = 0
+    for name in names:
+        table = TABLES[name]
+        for _ in range(samples):
+            fen = position_fen(table, *random_position(table, rng))
+            board = BitBoard(fen)
+            expected = tablebase.probe(board)
+            moves = board.get_valid_moves()
+            if not moves:
+                actual = ('loss', 0) if board.in_check() else ('draw', 0)
+            else:
+                best = tablebase.best_move(board)
+                actual = (best[1], best[2]) if best is not None else None
+            if actual != expected:
+                failures += 1
+                print('{}: {} table says {}, successors say {}'.format(name, fen, expected, actual))
+        print('{:5} {} positions checked'.format(name, samples))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate, probe or verify endgame tablebases.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('generate', help='generate tables')
+    build.add_argument('--tables', default=','.join(TABLES), help='comma separated, default: all')
+    build.add_argument('--output', default='tables')
+    build.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    probe = commands.add_parser('probe', help='look up a position')
+    probe.add_argument('--fen', required=True)
+    probe.add_argument('--tables', dest='directory', default='tables')
+    check = commands.add_parser('verify', help='check random positions against the move rules')
+    check.add_argument('--tables', default=','.join(TABLES))
+    check.add_argument('--directory', default='tables')
+    check.add_argument('--samples', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        names = []
+        for name in args.tables.split(','):
+            for needed in DEPENDENCIES.get(name, []) + [name]:
+                if needed not in names:
+                    names.append(needed)
+        pool = multiprocessing.Pool(args.workers) if args.workers > 1 else None
+        try:
+            start = time.perf_counter()
+            for name in names:
+                generate(name, args.output, pool)
+            print('{} tables in {:.1f}s with {} workers'.format(len(names), time.perf_counter() - start,
+                                                                 args.workers))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return 0
+
+    if args.command == 'probe':
+        board = BitBoard(args.fen)
+        with Tablebase(args.directory) as tablebase:
+            start = time.perf_counter()
+            answer = tablebase.probe(board)
+            elapsed = time.perf_counter() - start
+            if answer is None:
+                print('not in the tables')
+                return 1
+            best = tablebase.best_move(board)
+            print('{} in {} plies{}  ({:.1f} us)'.format(
+                answer[0], answer[1], ', best ' + best[0].get_chess_notation() if best else '', elapsed * 1e6))
+        return 0
+
+    with Tablebase(args.directory) as tablebase:
+        failures = verify(tablebase, args.tables.split(','), args.samples)
+    print('all positions consistent' if not failures else '{} inconsistent positions'.format(failures))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,337 @@
+"""Self-play tournaments between engine settings, played in parallel worker processes.
+
+Every pair of players plays every opening twice, once with each color, `--rounds` times over. Games
+end on checkmate, stalemate, threefold repetition, the 50-move rule, insufficient material or the
+ply limit. Each finished game is appended to the output as one JSON line, so a long run can be
+watched, interrupted and picked up again with --resume. The report gives scores, Elo estimates,
+games/sec and per-move time percentiles for every player.
+
+Players: random, depth:N (search to depth N), time:S (search for S seconds a move). Name them with
+name=spec, e.g. --player fast=depth:1.
+
+    python tournament.py --player random --player depth:1 --player depth:2 --workers 4 --output games.jsonl
+    python tournament.py --player a=depth:2 --player b=time:0.05 --rounds 3 --openings 8
+"""
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from chess_engine import START_FEN, make_board
+from pgn import find_move
+from search import Searcher
+
+# Short, well-known lines; both colors play each one from both sides.
+OPENINGS = [
+    'e4 e5 Nf3 Nc6 Bb5', 'e4 e5 Nf3 Nc6 Bc4', 'e4 c5 Nf3 d6', 'e4 c5 Nc3 Nc6', 'e4 e6 d4 d5', 'e4 c6 d4 d5',
+    'd4 d5 c4 e6', 'd4 d5 c4 c6', 'd4 Nf6 c4 g6', 'd4 Nf6 c4 e6', 'c4 e5 Nc3 Nf6', 'Nf3 d5 g3 Nf6',
+    'e4 d5 exd5 Qxd5', 'd4 f5 g3 Nf6', 'e4 e5 f4 exf4', 'e4 Nf6 e5 Nd5',
+]
+SCORES = {'1-0': (1, 0), '0-1': (0, 1), '1/2-1/2': (0.5, 0.5)}
+# Minor pieces that cannot mate alone.
+MINORS = {'wN', 'wB', 'bN', 'bB'}
+
+
+class RandomPlayer:
+
+    def __init__(self):
+        self.rng = random.Random()
+
+    def new_game(self, seed):
+        self.rng.seed(seed)
+
+    def choose(self, board, moves):
+        return self.rng.choice(moves)
+
+
+class SearchPlayer:
+
+    def __init__(self, depth=64, time_limit=10 ** 6):
+        self.depth = depth
+        self.time_limit = time_limit
+        self.searcher = Searcher(tt_size=1 << 16)
+
+    def new_game(self, seed):
+        self.searcher.tt.clear()
+        self.searcher.history.clear()
+
+    def choose(self, board, moves):
+        return self.searcher.search(board, self.time_limit, self.depth).best_move
+
+
+def positive(convert, argument):
+    value = convert(argument)
+    if not value > 0:
+        raise ValueError('{!r} is not a positive number'.format(argument))
+    return value
+
+
+PLAYERS = {
+    'random': lambda argument: RandomPlayer(),
+    'depth': lambda argument: SearchPlayer(depth=positive(int, argument)),
+    'time': lambda argument: SearchPlayer(time_limit=positive(float, argument)),
+}
+
+
+def register_player(kind, factory):
+    """Make `kind:argument` specs build players with factory(argument)."""
+    PLAYERS[kind] = factory
+
+
+def parse_player(text):
+    """(name, spec) from 'name=kind:argument', 'kind:argument' or 'kind'.
+
+    The player is built once here, so a bad argument is reported before any game goes to the workers.
+    """
+    name, _, spec = text.rpartition('=')
+    kind = spec.partition(':')[0]
+    if kind not in PLAYERS:
+        raise ValueError('unknown player kind {!r}, expected one of {}'.format(kind, ', '.join(PLAYERS)))
+    try:
+        make_player(spec)
+    except ValueError as error:
+        raise ValueError('bad player {!r}: {}'.format(text, error))
+    return name or spec, spec
+
+
+def make_player(spec):
+    kind, _, argument = spec.partition(':')
+    return PLAYERS[kind](argument)
+
+
+def opening_board(opening, backend='bitboard'):
+    board = make_board(START_FEN, backend)
+    for san in opening.split():
+        move = find_move(san, board.get_valid_moves())
+        if move is None:
+            raise ValueError('illegal opening move {} in {!r}'.format(san, opening))
+        board.move(move)
+    return board
+
+
+def insufficient_material(board):
+    pieces = [piece for row in board.field for piece in row if piece != '--' and piece[1] != 'K']
+    return not pieces or (len(pieces) == 1 and pieces[0] in MINORS)
+
+
+_players = {}
+
+
+def play_game(job):
+    """Play one game in a worker; returns its result record."""
+    game_id, white, black, opening, seed, max_plies, backend = job
+    sides = []
+    for spec in (white[1], black[1]):
+        if spec not in _players:
+            _players[spec] = make_player(spec)
+        # The same spec on both sides still needs two players.
+        player = _players[spec] if not sides or sides[0] is not _players[spec] else make_player(spec)
+        player.new_game(seed)
+        sides.append(player)
+    board = opening_board(opening, backend)
+    times = {'white': [], 'black': []}
+    halfmoves = 0
+    start = time.perf_counter()
+    result, reason = '1/2-1/2', 'ply limit'
+    for _ in range(max_plies):
+        moves = board.get_valid_moves()
+        if not moves:
+            if board.checkmate:
+                result, reason = ('0-1' if board.white_to_move else '1-0'), 'checkmate'
+            else:
+                reason = 'stalemate'
+            break
+        if board.repetition_count() >= 3:
+            reason = 'repetition'
+            break
+        if halfmoves >= 100:
+            reason = 'fifty moves'
+            break
+        if insufficient_material(board):
+            reason = 'insufficient material'
+            break
+        color = 'white' if board.white_to_move else 'black'
+        move_start = time.perf_counter()
+        move = sides[color == 'black'].choose(board, moves)
+        times[color].append(round((time.perf_counter() - move_start) * 1000, 3))
+        halfmoves = 0 if move.piece_moved[1] == 'P' or move.piece_captured != '--' else halfmoves + 1
+        board.move(move)
+    return {'id': game_id, 'white': white[0], 'black': black[0], 'opening': opening, 'result': result,
+            'reason': reason, 'plies': len(board.move_log), 'seconds': round(time.perf_counter() - start, 3),
+            'fen': board.get_fen(), 'move_ms': times}
+
+
+def schedule(players, openings, rounds, max_plies, backend='bitboard', seed=0):
+    """Jobs for every pair, opening, color and round, with a stable id per game."""
+    jobs = []
+    for round_number, (first, second), opening in itertools.product(range(rounds),
+                                                                     itertools.combinations(players, 2), openings):
+        for white, black in ((first, second), (second, first)):
+            game_id = '{}|{}|{}|{}'.format(round_number, white[0], black[0], opening)
+            jobs.append((game_id, white, black, opening, seed + len(jobs), max_plies, backend))
+    return jobs
+
+
+def elo_difference(score):
+    score = min(max(score, 1e-3), 1 - 1e-3)
+    return -400 * math.log10(1 / score - 1)
+
+
+def fit_ratings(results, names, iterations=2000):
+    """Elo ratings that best explain the pairwise scores, averaging 0."""
+    ratings = dict.fromkeys(names, 0.0)
+    games = [(result['white'], result['black'], SCORES[result['result']][0]) for result in results]
+    if not games:
+        return ratings
+    for _ in range(iterations):
+        gradient = dict.fromkeys(names, 0.0)
+        counts = dict.fromkeys(names, 0)
+        for white, black, score in games:
+            expected = 1 / (1 + 10 ** ((ratings[black] - ratings[white]) / 400))
+            gradient[white] += score - expected
+            gradient[black] -= score - expected
+            counts[white] += 1
+            counts[black] += 1
+        change = 0
+        for name in names:
+            if counts[name]:
+                step = 400 * gradient[name] / counts[name]
+                ratings[name] += step
+                change = max(change, abs(step))
+        mean = sum(ratings.values()) / len(ratings)
+        for name in names:
+            # Clamp players who won or lost everything, whose rating would grow without bound.
+            ratings[name] = min(max(ratings[name] - mean, -2000), 2000)
+        if change < 0.01:
+            break
+    return ratings
+
+
+def percentiles(values, points=(50, 90, 99)):
+    values = sorted(values)
+    return [values[min(len(values) - 1, len(values) * p // 100)] if values else 0 for p in points]
+
+
+def report(results, names, elapsed=None, played=None):
+    """Print the table for `results`; games/sec counts `played`, the games of this run, over `elapsed`."""
+    ratings = fit_ratings(results, names)
+    print('{:12} {:>6} {:>5} {:>5} {:>5} {:>7} {:>7} {:>6}   move ms p50/p90/p99/max'.format(
+        'player', 'games', 'win', 'draw', 'loss', 'score', 'elo', '+/-'))
+    for name in sorted(names, key=ratings.get, reverse=True):
+        points, outcomes, times = [], {'win': 0, 'draw': 0, 'loss': 0}, []
+        for result in results:
+            for side, index in (('white', 0), ('black', 1)):
+                if result[side] == name:
+                    score = SCORES[result['result']][index]
+                    points.append(score)
+                    outcomes['win' if score == 1 else 'loss' if score == 0 else 'draw'] += 1
+                    times += result['move_ms'][side]
+        if not points:
+            continue
+        mean = sum(points) / len(points)
+        deviation = math.sqrt(sum((point - mean) ** 2 for point in points) / len(points))
+        margin = 1.96 * deviation / math.sqrt(len(points))
+        error = (elo_difference(mean + margin) - elo_difference(mean - margin)) / 2
+        print('{:12} {:6} {:5} {:5} {:5} {:6.1f}% {:7.0f} {:6.0f}   {}/{:.1f}'.format(
+            name, len(points), outcomes['win'], outcomes['draw'], outcomes['loss'], 100 * mean, ratings[name], error,
+            '/'.join('{:.1f}'.format(value) for value in percentiles(times)), max(times, default=0)))
+    reasons = {}
+    for result in results:
+        reasons[result['reason']] = reasons.get(result['reason'], 0) + 1
+    print('endings: ' + ', '.join('{} {}'.format(reason, count) for reason, count in sorted(reasons.items())))
+    if elapsed and played:
+        plies = sum(result['plies'] for result in played)
+        print('{} games in {:.1f}s: {:.2f} games/sec, {:.0f} plies/sec'.format(len(played), elapsed,
+                                                                              len(played) / elapsed, plies / elapsed))
+
+
+def read_results(path):
+    results = []
+    if path and os.path.exists(path):
+        with open(path) as file:
+            for line in file:
+                line = line.strip()
+                if line:
+                    results.append(json.loads(line))
+    return results
+
+
+def run(players, openings, rounds, workers, output=None, resume=False, max_plies=300, seed=0, progress=10):
+    """Play the tournament; returns every result, including those from an earlier run with `resume`."""
+    jobs = schedule(players, openings, rounds, max_plies, seed=seed)
+    # Results of games outside this schedule stay in the file but are left out of the report.
+    scheduled = {job[0] for job in jobs}
+    done = [result for result in read_results(output) if result['id'] in scheduled] if resume else []
+    finished = {result['id'] for result in done}
+    jobs = [job for job in jobs if job[0] not in finished]
+    names = [name for name, _ in players]
+    print('{} games to play with {} workers{}'.format(len(jobs), workers,
+                                                      ', {} already done'.format(len(done)) if done else ''))
+    results = []
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    file = open(output, 'a' if resume else 'w') if output else None
+    try:
+        games = pool.imap_unordered(play_game, jobs) if pool is not None else map(play_game, jobs)
+        for result in games:
+            results.append(result)
+            if file is not None:
+                file.write(json.dumps(result) + '\n')
+                file.flush()
+            if progress and len(results) % progress == 0:
+                elapsed = time.perf_counter() - start
+                print('{}/{} games, {:.2f} games/sec'.format(len(results), len(jobs), len(results) / elapsed),
+                      flush=True)
+    finally:
+        if file is not None:
+            file.close()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    elapsed = time.perf_counter() - start
+    report(done + results, names, elapsed, results)
+    return done + results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play engine settings against each other.')
+    parser.add_argument('--player', action='append', default=[], help="name=kind:argument, at least two")
+    parser.add_argument('--openings', type=int, default=len(OPENINGS), help='how many of the built-in openings')
+    parser.add_argument('--openings-file', help='one opening per line as SAN moves, replaces the built-in list')
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--max-plies', type=int, default=300, help='games reaching this are drawn')
+    parser.add_argument('--output', help='JSON lines file, one game per line')
+    parser.add_argument('--resume', action='store_true', help='skip the games already in --output')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', action='store_true', help='only print the report for --output')
+    args = parser.parse_args(argv)
+
+    if args.report:
+        results = read_results(args.output)
+        report(results, sorted({result[side] for result in results for side in ('white', 'black')}))
+        return 0
+    try:
+        players = [parse_player(text) for text in args.player]
+    except ValueError as error:
+        parser.error(str(error))
+    if len(players) < 2 or len({name for name, _ in players}) != len(players):
+        parser.error('give at least two players with different names')
+    if args.openings_file:
+        with open(args.openings_file) as file:
+            openings = [line.strip() for line in file if line.strip() and not line.startswith('#')]
+    else:
+        openings = OPENINGS[:args.openings]
+    for opening in openings:
+        opening_board(opening)
+    run(players, openings, args.rounds, args.workers, args.output, args.resume, args.max_plies, args.seed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""Move generation and engine searches off the game loop, with results delivered as pygame events.
+
+Jobs run one after the other in a worker process, so a deep search neither freezes the window nor
+competes with it for the GIL. Boards travel as a FEN plus the Zobrist keys of the game, results come
+back as move codes. A listener thread turns every result into a WORKER_EVENT:
+
+    kind='moves':  job, codes, checkmate, stale_mate
+    kind='search': job, code (code & SQUARES_MASK of the best move, or None), score, depth
+
+cancel() stops the running search and drops every result that has not arrived yet, so the game can
+undo or restart at any time. BackgroundWorker(process=False) runs the jobs inline and posts the same
+events, which is handy under a debugger or the profiler.
+"""
+import itertools
+import multiprocessing
+import threading
+
+import pygame
+
+from chess_engine import Move, MoveList, make_board
+from search import SQUARES_MASK, Searcher
+
+WORKER_EVENT = pygame.event.custom_type()
+
+
+class JobCancelled:
+    """Stop flag for Searcher: set once the game cancels this job or any job after it."""
+
+    def __init__(self, cancelled, job):
+        self.cancelled = cancelled
+        self.job = job
+
+    def is_set(self):
+        return self.cancelled.value >= self.job
+
+
+def make_searcher(book=None, tablebases=None):
+    from book import OpeningBook
+    from tablebase import Tablebase
+
+    return Searcher(book=OpeningBook(book) if book else None, tablebase=Tablebase(tablebases) if tablebases else None)
+
+
+def run_job(searcher, request, stop_event=None):
+    kind, job, fen, history, backend, think_time = request
+    board = make_board(fen, backend, history)
+    if kind == 'moves':
+        codes = [move.code for move in board.get_valid_moves()]
+        return {'kind': kind, 'job': job, 'codes': codes, 'checkmate': board.checkmate,
+                'stale_mate': board.stale_mate}
+    searcher.stop_event = stop_event
+    result = searcher.search(board, think_time)
+    return {'kind': kind, 'job': job, 'code': result.best_move.code & SQUARES_MASK if result.best_move else None,
+            'score': result.score, 'depth': result.depth}
+
+
+def _serve(requests, results, cancelled, book, tablebases):
+    searcher = make_searcher(book, tablebases)
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        job = request[1]
+        if cancelled.value >= job:
+            continue
+        results.put(run_job(searcher, request, JobCancelled(cancelled, job)))
+
+
+class BackgroundWorker:
+    """Runs 'moves' and 'search' jobs for the game; close it when done."""
+
+    def __init__(self, backend='bitboard', book=None, tablebases=None, process=True):
+        self.backend = backend
+        self.jobs = itertools.count(1)
+        self.pending = {}
+        self.process = None
+        if not process:
+            self.searcher = make_searcher(book, tablebases)
+            return
+        self.requests = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.cancelled = multiprocessing.Value('q', 0, lock=False)
+        self.process = multiprocessing.Process(target=_serve, daemon=True,
+                                               args=(self.requests, self.results, self.cancelled, book, tablebases))
+        self.process.start()
+        self.listener = threading.Thread(target=self._listen, daemon=True)
+        self.listener.start()
+
+    @property
+    def busy(self):
+        return bool(self.pending)
+
+    def thinking(self):
+        return 'search' in self.pending.values()
+
+    def _listen(self):
+        while True:
+            result = self.results.get()
+            if result is None:
+                return
+            pygame.event.post(pygame.event.Event(WORKER_EVENT, result))
+
+    def _submit(self, kind, board, think_time=0):
+        job = next(self.jobs)
+        self.pending[job] = kind
+        request = (kind, job, board.get_fen(), board.key_log[:-1], self.backend, think_time)
+        if self.process is None:
+            pygame.event.post(pygame.event.Event(WORKER_EVENT, run_job(self.searcher, request)))
+        else:
+            self.requests.put(request)
+        return job
+
+    def request_moves(self, board):
+        return self._submit('moves', board)
+
+    def request_search(self, board, think_time):
+        return self._submit('search', board, think_time)
+
+    def cancel(self):
+        """Stop the running job; results of every job submitted so far are ignored."""
+        last = next(self.jobs)
+        self.pending.clear()
+        if self.process is not None:
+            self.cancelled.value = last
+
+    def accept(self, event):
+        """True if `event` answers a job that is still wanted, which is then no longer pending."""
+        return self.pending.pop(event.job, None) is not None
+
+    def close(self):
+        if self.process is None:
+            return
+        self.cancel()
+        self.requests.put(None)
+        self.results.put(None)
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+
+
+def moves_from_codes(codes):
+    return MoveList(map(Move.from_code, codes))
+
+
+def find_code(moves, code):
+    for move in moves:
+        if move.code & SQUARES_MASK == code:
+            return move
+    return None
@@ -0,0 +1,64 @@
+import random
+
+# Fixed seed: keys must be identical between runs and processes, book files and caches are keyed by them.
+_random = random.Random(0x5EED)
+
+PIECE_KEYS = {piece: [_random.getrandbits(64) for _ in range(64)]
+              for piece in ('wP', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK')}
+SIDE_KEY = _random.getrandbits(64)
+CASTLE_KEYS = [_random.getrandbits(64) for _ in range(16)]
+ENPASSANT_KEYS = [_random.getrandbits(64) for _ in range(8)]
+
+
+def castle_key(rights):
+    return CASTLE_KEYS[rights.wks | rights.wqs << 1 | rights.bks << 2 | rights.bqs << 3]
+
+
+def enpassant_key(field, enpassant_possible, white_to_move):
+    """Key of the en passant square, which only counts when a pawn could actually take on it."""
+    if not enpassant_possible:
+        return 0
+    row, col = enpassant_possible
+    pawn_row, pawn = (row + 1, 'wP') if white_to_move else (row - 1, 'bP')
+    for pawn_col in (col - 1, col + 1):
+        if 0 <= pawn_col <= 7 and field[pawn_row][pawn_col] == pawn:
+            return ENPASSANT_KEYS[col]
+    return 0
+
+
+def compute_key(field, white_to_move, rights, enpassant_possible):
+    key = 0
+    for row in range(8):
+        for col in range(8):
+            piece = field[row][col]
+            if piece != '--':
+                key ^= PIECE_KEYS[piece][row * 8 + col]
+    if not white_to_move:
+        key ^= SIDE_KEY
+    return key ^ castle_key(rights) ^ enpassant_key(field, enpassant_possible, white_to_move)
+
+
+def update_key(key, move, old_rights, new_rights, old_enpassant_key, new_enpassant_key):
+    """Key after `move`, given the key before it. Only the squares the move touches are rehashed."""
+    moved = PIECE_KEYS[move.piece_moved]
+    start = move.start_row * 8 + move.start_col
+    end = move.end_row * 8 + move.end_col
+    key ^= moved[start]
+    if move.is_pawn_promoted:
+        key ^= PIECE_KEYS[move.piece_moved[0] + 'Q'][end]
+    else:
+        key ^= moved[end]
+
+    if move.is_enpassant_move:
+        key ^= PIECE_KEYS[move.piece_captured][move.start_row * 8 + move.end_col]
+    elif move.piece_captured != '--':
+        key ^= PIECE_KEYS[move.piece_captured][end]
+
+    if move.is_castle_move:
+        rook = PIECE_KEYS[move.piece_moved[0] + 'R']
+        if move.end_col - move.start_col == 2:
+            key ^= rook[end + 1] ^ rook[end - 1]
+        else:
+            key ^= rook[end - 2] ^ rook[end + 1]
+
+    return key ^ SIDE_KEY ^ castle_key(old_rights) ^ castle_key(new_rights) ^ old_enpassant_key ^ new_enpassant_key